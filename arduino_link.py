@@ -0,0 +1,390 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+import serial
+
+# Version of the framing understood by waitmode.ino / ws2812b.ino.
+# A command is sent as "@<version>,<seq>,<COMMAND>\n" and the Arduino
+# answers "#ACK,<seq>" as soon as it has read the line, before running it.
+# A plain "PING\n" is answered with "#PONG", a plain "STATS\n" with
+# "#STATS,<lines>,<overflows>,<framing errors>,<frames>" and a reboot
+# announces itself with "#READY,<version>". Binary LED frames (see
+# led_stream.py) are sent without acknowledgement.
+PROTOCOL_VERSION = 1
+
+# Environment variable overriding the serial port of the Arduino, e.g. the
+# pseudo-terminal of virtual_arduino.py
+ARDUINO_PORT_VARIABLE = "CBR_ARDUINO_PORT"
+
+# Seconds between reconnection attempts, doubled after every failure
+RECONNECT_MIN = 0.1
+RECONNECT_MAX = 5.0
+
+# Something the Arduino said, parsed from one line
+# kind is one of "ack", "nak", "pong", "stats", "ready", "reply", "stopped", "invalid",
+# "message", "link_up", "link_down" or "error"; command is the command the
+# line answers when it can be matched, time is time.monotonic()
+ArduinoEvent = namedtuple("ArduinoEvent", ["kind", "text", "command", "time"])
+
+
+# Serial port of the Arduino, default unless CBR_ARDUINO_PORT is set
+def arduino_port(default="/dev/ttyUSB0"):
+    return os.environ.get(ARDUINO_PORT_VARIABLE, default)
+
+
+# Build the frame of one command
+def encode_frame(seq, command):
+    return f"@{PROTOCOL_VERSION},{seq},{command}\n".encode()
+
+
+# Sequence number of an acknowledgement line, or None for any other line
+def parse_ack(line):
+    if not line.startswith("#ACK,"):
+        return None
+    try:
+        return int(line[5:])
+    except ValueError:
+        return None
+
+
+# Counters of a "#STATS" line, or None if it is malformed
+def parse_stats(line):
+    try:
+        values = [int(value) for value in line.split(",")[1:]]
+    except ValueError:
+        return None
+    if len(values) not in (3, 4):
+        return None
+    names = ("lines", "overflows", "framing_errors", "frames")
+    return dict(zip(names, values))
+
+
+# Kind of event of one line that is not an acknowledgement
+def classify_line(line):
+    if line == "#NAK":
+        return "nak"
+    if line == "#PONG":
+        return "pong"
+    if line.startswith("#STATS,"):
+        return "stats"
+    if line.startswith("#READY"):
+        return "ready"
+    if line == "Animation stopped":
+        return "stopped"
+    if line == "Invalid command":
+        return "invalid"
+    if line.endswith("LED pattern") or line == "Waiting Mode":
+        return "reply"
+    return "message"
+
+
+# Serial link to the LED Arduino speaking the framed protocol.
+#
+# Callers only put commands on a bounded queue; a writer thread sends them
+# so no GUI or pump code ever blocks on a stalled USB-serial adapter. LED
+# state commands replace any state command still waiting in the queue
+# (WAITING followed by a recipe pattern only sends the pattern). Every
+# command gets a sequence number and is resent when its acknowledgement
+# does not arrive within ack_timeout; the firmware ignores a repeated
+# sequence number so a retry never restarts an animation.
+#
+# A reader thread turns everything the Arduino prints into ArduinoEvents,
+# matched to the command they answer, and a heartbeat thread pings the
+# board so a silent link is reported as "link_down" within link_timeout.
+# A port that disappears, or a board that stays silent for reconnect_after,
+# is reopened with exponential backoff (reopening also resets the Uno).
+# Every stats_interval the board is asked for the counters of its serial
+# parser, kept in firmware_stats, to see how clean the link is.
+#
+# stream() hands the writer a binary LED frame. Only the most recent frame
+# is kept: a frame that is replaced before the writer gets to it is counted
+# in frames_dropped, so a slow link lowers the frame rate instead of adding
+# latency. Queued commands always go first.
+class ArduinoLink:
+    def __init__(self, port, baudrate=115200, ack_timeout=0.25, retries=2, write_timeout=0.5, max_queued=32,
+                 heartbeat_interval=0.1, link_timeout=0.3, reconnect_after=5.0, stats_interval=5.0, history=1000, journal=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.write_timeout = write_timeout
+        self.max_queued = max_queued
+        self.heartbeat_interval = heartbeat_interval
+        self.link_timeout = link_timeout
+        self.reconnect_after = reconnect_after
+        self.stats_interval = stats_interval
+        self.journal = journal  # EventJournal of the commands sent, print() if None
+        self.ser = None  # None while the port is closed
+        self.connected = threading.Event()  # Set while the port is open
+        self.write_lock = threading.Lock()
+        self.link_up = False
+        self.last_rx = time.monotonic()  # When the last line arrived
+        self.seq = 0
+        self.inflight = {}  # seq -> (command, threading.Event set on its ack)
+        self.last_acked = None  # Command the following text replies belong to
+        self.pending = deque()  # (command, coalesce) waiting for the writer
+        self.pending_frame = None  # Binary LED frame waiting for the writer
+        self.condition = threading.Condition()
+        self.events = queue.Queue(maxsize=1000)  # ArduinoEvents for drain()
+        self.latencies = deque(maxlen=history)  # Round trip seconds, most recent last
+        self.write_latencies = deque(maxlen=history)  # Seconds spent in ser.write
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.opened = False  # The port was open at least once
+        self.firmware_stats = {}  # Last counters reported by the Arduino parser
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._run_reader, name="ArduinoReader", daemon=True),
+            threading.Thread(target=self._run_writer, name="ArduinoWriter", daemon=True),
+            threading.Thread(target=self._run_heartbeat, name="ArduinoHeartbeat", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    # Queue one command for the writer thread and return immediately.
+    # A coalescing command replaces the coalescing commands not sent yet.
+    def send(self, command, coalesce=True):
+        with self.condition:
+            if coalesce:
+                kept = deque(item for item in self.pending if not item[1])
+                self.coalesced += len(self.pending) - len(kept)
+                self.pending = kept
+            if len(self.pending) >= self.max_queued:
+                self.pending.popleft()  # Drop the oldest rather than block the caller
+                self.dropped += 1
+            self.pending.append((command, coalesce))
+            self.condition.notify()
+
+    # Hand the writer one encoded LED frame, replacing a frame not sent yet
+    def stream(self, frame):
+        with self.condition:
+            if self.pending_frame is not None:
+                self.frames_dropped += 1
+            self.pending_frame = frame
+            self.condition.notify()
+
+    # Number of commands waiting for the writer
+    def depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    # Hand every pending ArduinoEvent to handler
+    def drain(self, handler):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+            handler(event)
+
+    def _emit(self, kind, text="", command=None):
+        try:
+            self.events.put_nowait(ArduinoEvent(kind, text, command, time.monotonic()))
+        except queue.Full:
+            pass  # Nobody is draining, keep the threads running anyway
+
+    def _open(self):
+        self.ser = serial.Serial(self.port, self.baudrate, timeout=0.05, write_timeout=self.write_timeout)
+        self.last_rx = time.monotonic()
+        if self.opened:
+            self.reconnects += 1
+        self.opened = True
+        self.connected.set()
+
+    def _drop_connection(self, reason):
+        with self.write_lock:
+            if self.ser is None:
+                return
+            self.connected.clear()
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.ser = None
+        self._set_link(False, reason)
+
+    def _set_link(self, up, reason=""):
+        if up != self.link_up:
+            self.link_up = up
+            self._emit("link_up" if up else "link_down", reason)
+
+    # Write raw bytes, returns False if the port is closed or the write timed out
+    def _write(self, data):
+        with self.write_lock:
+            if self.ser is None:
+                return False
+            try:
+                self.ser.write(data)
+                return True
+            except serial.SerialTimeoutException:
+                return False
+            except (serial.SerialException, OSError) as e:
+                error = e
+        self._drop_connection(str(error))
+        return False
+
+    def _run_reader(self):
+        backoff = RECONNECT_MIN
+        buffer = b""
+        while self.running:
+            if self.ser is None:
+                try:
+                    self._open()
+                    backoff = RECONNECT_MIN
+                    buffer = b""
+                except (serial.SerialException, OSError) as e:
+                    self._emit("error", str(e))
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, RECONNECT_MAX)
+                continue
+
+            try:
+                ser = self.ser
+                chunk = ser.read(max(ser.in_waiting, 1)) if ser else b""
+            except (serial.SerialException, OSError, TypeError) as e:
+                self._drop_connection(str(e))
+                continue
+            buffer += chunk
+            while b"\n" in buffer:
+                raw, buffer = buffer.split(b"\n", 1)
+                line = raw.decode(errors="replace").strip()
+                if line:
+                    self._handle_line(line)
+
+    def _handle_line(self, line):
+        self.last_rx = time.monotonic()
+        self._set_link(True)
+
+        seq = parse_ack(line)
+        if seq is not None:
+            command, acked = self.inflight.get(seq, (None, None))
+            if acked is not None:
+                acked.set()
+                self.last_acked = command
+            self._emit("ack", line, command)
+            return
+
+        kind = classify_line(line)
+        if kind == "pong":
+            return  # Heartbeats only keep last_rx fresh
+        if kind == "stats":
+            counters = parse_stats(line)
+            if counters is None:
+                return
+            self.firmware_stats = counters
+        if kind == "ready":
+            self.last_acked = None  # The board rebooted, forget what it was doing
+        self._emit(kind, line, self.last_acked if kind in ("reply", "stopped", "invalid") else None)
+
+    def _run_writer(self):
+        while self.running:
+            with self.condition:
+                while not self.pending and self.pending_frame is None:
+                    self.condition.wait()
+                if self.pending:
+                    command, _ = self.pending.popleft()
+                else:
+                    command, frame = None, self.pending_frame
+                    self.pending_frame = None
+            self.connected.wait()  # Keep the command until the port is back
+            if command is None:
+                if self._write(frame):
+                    self.frames_sent += 1
+                else:
+                    self.frames_dropped += 1
+            elif self._transmit(command):
+                if self.journal:
+                    self.journal.log("command", command, self.seq)
+                else:
+                    print(f"Sent command {command} to Arduino")
+            elif self.journal:
+                self.journal.log("command_failed", command, self.seq)
+            else:
+                print(f"Command {command} was not acknowledged by the Arduino")
+
+    # Send one command and wait for its acknowledgement, returns True if acked
+    def _transmit(self, command):
+        self.seq = (self.seq + 1) % 65536
+        seq = self.seq
+        acked = threading.Event()
+        self.inflight[seq] = (command, acked)
+        frame = encode_frame(seq, command)
+        self.sent += 1
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.retried += 1
+                start = time.perf_counter()
+                if not self._write(frame):
+                    time.sleep(self.ack_timeout)
+                    continue
+                self.write_latencies.append(time.perf_counter() - start)
+                if acked.wait(self.ack_timeout):
+                    self.latencies.append(time.perf_counter() - start)
+                    return True
+            self.failed += 1
+            return False
+        finally:
+            del self.inflight[seq]
+
+    def _run_heartbeat(self):
+        last_stats = time.monotonic()
+        while self.running:
+            time.sleep(self.heartbeat_interval)
+            if self.ser is None:
+                continue
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                self._write(b"STATS\n")
+            self._write(b"PING\n")
+            silent = time.monotonic() - self.last_rx
+            if silent > self.link_timeout:
+                self._set_link(False, f"no reply for {silent * 1000:.0f} ms")
+            if silent > self.reconnect_after:
+                self._drop_connection("Arduino not answering, reopening the port")
+
+    # Percentiles in milliseconds of the recent round trips (or write times)
+    def latency_percentiles(self, percentiles=(50, 90, 99), writes=False):
+        samples = sorted(self.write_latencies if writes else self.latencies)
+        if not samples:
+            return {}
+        result = {}
+        for p in percentiles:
+            index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+            result[f"p{p}"] = samples[index] * 1000
+        result["max"] = samples[-1] * 1000
+        return result
+
+    # Counters and latencies of the link, e.g. for a status line
+    def stats(self):
+        return {
+            "link_up": self.link_up,
+            "queue_depth": self.depth(),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "firmware": self.firmware_stats,
+            "round_trip_ms": self.latency_percentiles(),
+            "write_ms": self.latency_percentiles(writes=True),
+        }
+
+    def close(self):
+        self.running = False
+        self._drop_connection("closed")
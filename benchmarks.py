@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from clock import RealClock
+from menu_matrix import MenuMatrix
+from pour_engine import RELAY_PINS, PourEngine, simulate_orders
+from pump_calibration import PumpCalibration
+from pump_scheduler import MAX_RUNNING_PUMPS, schedule_pours
+from recipe_compiler import compile_recipes
+from relay_driver import SimulatedRelayDriver
+from relay_timing import RelayTimingBuffer
+
+# Benchmarks of the pour machine on the simulated relays, written as JSON so
+# runs of different commits can be compared:
+#   python3 benchmarks.py --output bench.json [--recipes holiday.json] [--quick]
+# Relay timing, start skew, CPU and UI latency are measured in real time on
+# the simulated relays; orders per hour on the simulated clock.
+
+
+def summary(values, scale=1000.0):
+    if not values:
+        return {}
+    values = sorted(v * scale for v in values)
+
+    def percentile(p):
+        return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 3)
+
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": round(values[-1], 3),
+    }
+
+
+def real_engine():
+    relays = SimulatedRelayDriver()
+    relays.setup(RELAY_PINS)
+    return PourEngine(relays, lambda command: None, RealClock()), relays
+
+
+# Relay on-time minus the computed run_time of every pour, per channel (ms)
+def bench_relay_timing(rounds, run_time):
+    engine, relays = real_engine()
+    errors = {pin: [] for pin in RELAY_PINS}
+    for _ in range(rounds):
+        engine.pour([(pin, run_time * (1 + i / 10), None, 0.0) for i, pin in enumerate(RELAY_PINS)])
+    for i, pin in enumerate(RELAY_PINS):
+        expected = run_time * (1 + i / 10)
+        errors[pin] = [(off - on) - expected for on, off in relays.runs(pin)]
+    every = [error for pin_errors in errors.values() for error in pin_errors]
+    return {"all_ms": summary(every), "per_pin_ms": {str(pin): summary(e) for pin, e in errors.items()}}
+
+
+# Cost of recording one relay switching in the RelayTimingBuffer, next to
+# the cost of the switching itself on the simulated relays (us)
+def bench_timing_record(switchings):
+    relays = SimulatedRelayDriver()
+    relays.setup(RELAY_PINS)
+    buffer = RelayTimingBuffer(RELAY_PINS)
+    now = time.monotonic()
+    started = time.perf_counter()
+    for i in range(switchings):
+        relays.on(RELAY_PINS[i % len(RELAY_PINS)])
+    switch = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(switchings):
+        buffer.record(RELAY_PINS[i % len(RELAY_PINS)], True, now, now + 0.0003)
+    record = time.perf_counter() - started
+    return {"switch_us": round(switch / switchings * 1e6, 3), "record_us": round(record / switchings * 1e6, 3)}
+
+
+# Spread of the relay on-times of pumps planned to start together, as in
+# start_all_motors with every motor allowed to run (ms)
+def bench_start_skew(rounds, run_time):
+    engine, relays = real_engine()
+    skews = []
+    for _ in range(rounds):
+        first = len(relays.transitions)
+        engine.pour([(pin, run_time, None, 0.0) for pin in RELAY_PINS])
+        starts = [t.time for t in relays.transitions[first:] if t.on]
+        skews.append(max(starts) - min(starts))
+    return summary(skews)
+
+
+# Process CPU time over wall time while pours run, in percent
+def bench_cpu(seconds):
+    engine, _ = real_engine()
+    offsets, _ = schedule_pours([seconds] * len(RELAY_PINS), MAX_RUNNING_PUMPS)
+    steps = [(pin, seconds / 3, None, offset / 3) for pin, offset in zip(RELAY_PINS, offsets)]
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    engine.pour(steps)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    return {"wall_s": round(wall, 3), "cpu_s": round(cpu, 4), "cpu_percent": round(cpu / wall * 100, 3)}
+
+
+# Lateness of a 16 ms UI tick (poll_ui_events) while a pour runs, on Tk
+# when there is a display and on a thread ticking the same way otherwise (ms)
+def bench_ui_latency(seconds):
+    engine, _ = real_engine()
+    pour = threading.Thread(target=engine.pour, args=([(pin, seconds, None, 0.0) for pin in RELAY_PINS],))
+    lateness = []
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        root = None
+
+    if root is not None:
+        expected = [time.perf_counter() + 0.016]
+
+        def tick():
+            now = time.perf_counter()
+            lateness.append(now - expected[0])
+            if pour.is_alive():
+                expected[0] = now + 0.016
+                root.after(16, tick)
+            else:
+                root.quit()
+
+        pour.start()
+        root.after(16, tick)
+        root.mainloop()
+        root.destroy()
+    else:
+        pour.start()
+        while pour.is_alive():
+            expected = time.perf_counter() + 0.016
+            time.sleep(0.016)
+            lateness.append(time.perf_counter() - expected)
+    pour.join()
+    return {"tk": root is not None, "frame_lateness_ms": summary(lateness)}
+
+
+# Time to get every cocktail thumbnail through the ThumbnailCache on a
+# thread pool like the launch of with_flag.py, from an empty cache (cold)
+# and again with the cache filled (warm)
+def bench_startup(images):
+    from PIL import Image
+    from thumbnail_cache import ThumbnailCache
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = []
+        for i in range(images):
+            path = os.path.join(directory, f"cocktail{i}.jpg")
+            Image.new("RGB", (800, 800), (i * 37 % 256, i * 91 % 256, 128)).save(path, quality=85)
+            sources.append(path)
+
+        def load_all():
+            cache = ThumbnailCache(os.path.join(directory, "thumbnails"))
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                thumbnails = list(pool.map(lambda path: cache.thumbnail(path), sources))
+            assert all(thumbnails)
+            return time.perf_counter() - started, cache
+
+        cold, _ = load_all()
+        warm, cache = load_all()
+    return {"images": images, "cold_s": round(cold, 4), "warm_s": round(warm, 4), "warm_hits": cache.hits}
+
+
+# A recipe book like holiday.json: 2 to 6 ingredients of 10 to 60 mL each
+def synthetic_recipes(count, seed=0):
+    picker = random.Random(seed)
+    recipes = {}
+    for i in range(count):
+        motors = picker.sample(range(1, len(RELAY_PINS) + 1), picker.randint(2, 6))
+        recipes[f"Cocktail {i}"] = {"ingredients": [
+            {"name": f"Bottle {motor}", "motor": motor, "quantity": picker.randint(10, 60)} for motor in motors
+        ]}
+    return recipes
+
+
+def bench_throughput(recipes, orders, swap_time):
+    motor_mapping = {i + 1: pin for i, pin in enumerate(RELAY_PINS)}
+    calibration = {motor: PumpCalibration(1.5) for motor in motor_mapping}
+    plans, _ = compile_recipes(recipes, motor_mapping, calibration, MAX_RUNNING_PUMPS)
+    return simulate_orders(plans, orders, swap_time, seed=0)
+
+
+# Availability and servings of every cocktail for one set of bottle levels,
+# looping over the ingredients of the recipes and with the MenuMatrix (ms)
+def bench_menu(recipes, rounds):
+    motor_mapping = {i + 1: pin for i, pin in enumerate(RELAY_PINS)}
+    calibration = {motor: PumpCalibration(1.5) for motor in motor_mapping}
+    plans, _ = compile_recipes(recipes, motor_mapping, calibration, MAX_RUNNING_PUMPS)
+    levels = {motor: 40.0 * motor for motor in motor_mapping}
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        looped = {cocktail: min(levels[i['motor']] // i['quantity'] for i in recipes[cocktail]['ingredients'])
+                  for cocktail in plans}
+    loop = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    menu = MenuMatrix(plans, motor_mapping)
+    build = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(rounds):
+        vector = menu.level_vector(levels)
+        menu.available(vector)
+        servings = menu.servings(vector)
+    vectorised = (time.perf_counter() - started) / rounds
+    assert list(servings) == list(looped.values())
+    return {"recipes": len(plans), "loop_ms": round(loop * 1000, 4), "matrix_ms": round(vectorised * 1000, 4),
+            "build_ms": round(build * 1000, 3)}
+
+
+# Numbers of a result tree as {"a.b.c": value}
+def flatten(tree, prefix=""):
+    values = {}
+    for key, value in tree.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+# Print the values that changed by more than threshold (relative) since baseline
+def compare(results, baseline, threshold=0.1):
+    old = flatten(baseline)
+    for name, value in flatten(results).items():
+        if name in old and old[name] and abs(value - old[name]) / abs(old[name]) > threshold:
+            print(f"{name}: {old[name]} -> {value} ({(value - old[name]) / abs(old[name]) * 100:+.0f}%)")
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Timing and throughput benchmarks on the simulated relays")
+    parser.add_argument("--output", help="JSON file to write, stdout if missing")
+    parser.add_argument("--recipes", help="recipe JSON for the order mix, synthetic recipes if missing")
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--quick", action="store_true", help="shorter runs, e.g. for CI")
+    parser.add_argument("--baseline", help="JSON of an earlier run to compare with")
+    args = parser.parse_args()
+
+    rounds = 3 if args.quick else 10
+    pour_time = 0.2 if args.quick else 1.0
+    if args.recipes:
+        with open(args.recipes) as file:
+            recipes = json.load(file)
+    else:
+        recipes = synthetic_recipes(100)
+
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "relay_timing_error": bench_relay_timing(rounds, pour_time / 2),
+        "timing_record": bench_timing_record(10000 if args.quick else 100000),
+        "start_skew_ms": bench_start_skew(rounds, pour_time / 4),
+        "cpu_during_pour": bench_cpu(pour_time * 3),
+        "ui_latency_during_pour": bench_ui_latency(pour_time * 2),
+        "startup_images": bench_startup(10 if args.quick else 40),
+        "throughput": bench_throughput(recipes, args.orders, 5.0),
+        "menu": bench_menu(synthetic_recipes(500), 20 if args.quick else 200),
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print(f"Changes since {baseline.get('commit')}:")
+        compare(results, baseline)
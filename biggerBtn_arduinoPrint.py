@@ -7,21 +7,20 @@ from PIL import Image, ImageTk
 import json
 import requests
 from io import BytesIO
-import RPi.GPIO as GPIO
 import time
 import os
 import threading
 import serial
+from pump_timer import PumpTimer
+from relay_driver import create_relay_driver
+from arduino_link import arduino_port
 
 # Defining the GPIO pins connected to the relay module
 relay_pins = [26, 21, 19, 15, 13, 11, 7, 5, 31, 33, 35]
 
-# Initialize GPIO setup
-GPIO.setmode(GPIO.BOARD)
-GPIO.setwarnings(False)
-for pin in relay_pins:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.HIGH)
+# Relay driver chosen at startup: RPi.GPIO, or the simulation with CBR_RELAY_BACKEND=sim
+relays = create_relay_driver()
+relays.setup(relay_pins)
 
 # Flow rate of the pump motors in mL/second
 flow_rate = 1.5
@@ -45,58 +44,52 @@ cocktail_start_time = None
 motor_mutex = threading.Lock()
 
 # Define the serial port and baud rate for Arduino communication
-ser = serial.Serial('/dev/ttyUSB0', 115200)  # Update the port as needed
+ser = serial.Serial(arduino_port(), 115200)  # Set CBR_ARDUINO_PORT to use another port
 
 # Function to send commands to the Arduino
 def send_command_to_arduino(command):
     ser.write(command.encode())
     print(f"Sent command {command} to Arduino")
 
-# Function to start a pump motor
-def start_pump(motor_pin, volume):
-    run_time = volume / flow_rate  # run time based on volume
+# Functions to switch a single relay; the relay module is active LOW
+def relay_on(motor_pin):
+    relays.on(motor_pin)  # Turn on the motor
 
-    try:
-        GPIO.output(motor_pin, GPIO.LOW)  # Turn on the motor
-        #send_command_to_arduino("PUMPNUMBER")
-        start_time = time.time()  # Record the start time
+def relay_off(motor_pin):
+    relays.off(motor_pin)  # Turn off the motor
 
-        # Check if the pump operation is still running
-        while pump_running and (time.time() - start_time) < run_time:
-            pass
+# Function called by the pump timer once a pump has been switched off
+def report_pump(pour):
+    elapsed_time = pour.end_time - pour.start_time
+    pump_start_times[pour.motor_pin] = pour.start_time  # Record the start time
+    pump_end_times[pour.motor_pin] = pour.end_time  # Record the end time
+    if pour.stopped:
+        print(f"Stopped Motor {relay_pins.index(pour.motor_pin) + 1} after {elapsed_time:.2f} seconds")
+    else:
+        print(f"Pumping {pour.volume} mL from Motor {relay_pins.index(pour.motor_pin) + 1}. Time: {int(elapsed_time // 60)} minutes {int(elapsed_time % 60)} seconds (overshoot {pour.overshoot * 1000:.1f} ms)")
 
-        end_time = time.time()  # Record the end time
+# Single timer thread switching the pumps off at their deadlines
+pump_timer = PumpTimer(relay_on, relay_off, report_pump)
 
-        if pump_running:
-            GPIO.output(motor_pin, GPIO.HIGH)  # Turn off the motor
-            elapsed_time = end_time - start_time
-            pump_start_times[motor_pin] = start_time  # Record the start time
-            pump_end_times[motor_pin] = end_time  # Record the end time
-            print(f"Pumping {volume} mL from Motor {relay_pins.index(motor_pin) + 1}. Time: {int(elapsed_time // 60)} minutes {int(elapsed_time % 60)} seconds")
-    except KeyboardInterrupt:
-        print("Process interrupted by the user.")
-    finally:
-        GPIO.output(motor_pin, GPIO.HIGH)  # Turn off the motor
+# Function to start a pump motor, returns the running Pour without waiting for it
+def start_pump(motor_pin, volume):
+    run_time = volume / flow_rate  # run time based on volume
+    #send_command_to_arduino("PUMPNUMBER")
+    return pump_timer.start(motor_pin, run_time, volume)
 
 # Function to start all motors simultaneously
 def start_all_motors(volume):
-    global cocktail_start_time, pump_running
+    global cocktail_start_time
     cocktail_start_time = time.time()  # Record the cocktail start time
-    pump_running = True  # Start the pump operation
 
     # Sending the corresponding cocktail command to Arduino for LED strip control
     #send_command_to_arduino("ALLMOTORS")
 
-    threads = []
+    pours = [start_pump(motor_pin, volume) for motor_pin in relay_pins]
 
-    for motor_pin in relay_pins:
-        thread = threading.Thread(target=start_pump, args=(motor_pin, volume))
-        threads.append(thread)
-        thread.start()
-
-    # Wait for all threads to finish
-    for thread in threads:
-        thread.join()
+    # Wait for the pump timer to switch every motor off
+    for pour in pours:
+        pour.wait()
 
     end_time = time.time()  # Record the end time for the last motor
 
@@ -107,8 +100,6 @@ def start_all_motors(volume):
     # Sending the completion command to Arduino for LED strip control
     send_command_to_arduino("COMPLETE")
 
-    pump_running = False  # Stop the pump operation
-
 # Function to load cocktail image
 def load_cocktail_image(cocktail):
     local_img_path = recipes[cocktail]['imgpath']
@@ -143,9 +134,8 @@ def show_cocktail_details(cocktail):
 
 # Function to make a cocktail
 def make_cocktail(cocktail):
-    global cocktail_start_time, pump_running
+    global cocktail_start_time
     cocktail_start_time = time.time()  # Record the cocktail start time
-    pump_running = True  # Start the pump operation
 
     # Sending the corresponding cocktail command to Arduino for LED strip control
     if cocktail == "AMF":
@@ -168,18 +158,12 @@ def make_cocktail(cocktail):
     # Sort the run_times in ascending order of volume
     run_times.sort(key=lambda x: x[1])
 
-    # Create a list to store threads
-    threads = []
+    # Turn on all required motors, the pump timer switches them off again
+    pours = [start_pump(motor_pin, volume) for motor_pin, volume in run_times]
 
-    # Turn on all required motors using threads
-    for motor_pin, volume in run_times:
-        thread = threading.Thread(target=start_pump, args=(motor_pin, volume))
-        threads.append(thread)
-        thread.start()
-
-    # Wait for all threads to finish
-    for thread in threads:
-        thread.join()
+    # Wait for all pumps to finish
+    for pour in pours:
+        pour.wait()
 
     end_time = time.time()  # Record the end time for the last motor
 
@@ -188,14 +172,11 @@ def make_cocktail(cocktail):
     # Sending the completion command to Arduino for LED strip control
     send_command_to_arduino("COMPLETE")
 
-    pump_running = False  # Stop the pump operation
-
 # Function to stop the cocktail making process
 def stop_pumps():
-    global pump_running
-    GPIO.output(relay_pins, GPIO.HIGH)  # Turn off the motor
+    pump_timer.stop_all()  # Cancel every pending deadline and report the pours
+    relays.off_many(relay_pins)  # Turn off the motor
     #send_command_to_arduino("WAITING")
-    pump_running = False
 
 # Create the main tkinter window
 root = tk.Tk()
@@ -287,5 +268,5 @@ for i, cocktail in enumerate(recipes):
 # Start the tkinter main loop
 root.mainloop()
 
-# Cleanup GPIO
-GPIO.cleanup()
+# Switch every relay off and release the pins
+relays.cleanup()
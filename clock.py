@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import heapq
+import threading
+import time
+
+
+# Time source of the pour engine. now() is monotonic seconds, time() the
+# wall clock used in the logs.
+class RealClock:
+    simulated = False
+
+    def now(self):
+        return time.monotonic()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    # Wait for a threading.Event, returns True if it was set
+    def wait(self, event, timeout=None):
+        return event.wait(timeout)
+
+    # Call callback() from a timer thread once now() reaches when
+    def schedule(self, when, callback):
+        timer = threading.Timer(max(0.0, when - self.now()), callback)
+        timer.daemon = True
+        timer.start()
+
+
+# Discrete-event clock: time only moves when somebody waits, jumping straight
+# to the next scheduled callback, so a 50 s pour takes microseconds. Everything
+# runs on the thread that waits: PumpTimer schedules its deadlines here
+# instead of running its own thread, and the relay switching and reports
+# happen at exactly the simulated time they are due.
+class SimulatedClock:
+    simulated = True
+
+    def __init__(self, start=0.0, epoch=1_700_000_000.0):
+        self.current = start
+        self.epoch = epoch  # Wall time at current == 0
+        self.events = []  # Min-heap of (time, sequence, callback)
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def now(self):
+        return self.current
+
+    def time(self):
+        return self.epoch + self.current
+
+    # Call callback() once the simulated time reaches when
+    def schedule(self, when, callback):
+        with self.lock:
+            heapq.heappush(self.events, (max(when, self.current), self.sequence, callback))
+            self.sequence += 1
+
+    # Run the callbacks due up to until (every pending one if None), leaving
+    # the clock at until; stop early once done() is true
+    def run(self, until=None, done=None):
+        while not (done and done()):
+            with self.lock:
+                if not self.events or (until is not None and self.events[0][0] > until):
+                    break
+                when, _, callback = heapq.heappop(self.events)
+                self.current = when
+            callback()
+        if until is not None and not (done and done()):
+            self.current = max(self.current, until)
+
+    def sleep(self, seconds):
+        self.run(until=self.current + seconds)
+
+    def wait(self, event, timeout=None):
+        until = None if timeout is None else self.current + timeout
+        self.run(until, done=event.is_set)
+        return event.is_set()
+
+    def pending(self):
+        with self.lock:
+            return len(self.events)
+
+
+# Clock named by the pour engine options, "real" or "sim"
+def create_clock(name="real"):
+    if name == "real":
+        return RealClock()
+    if name == "sim":
+        return SimulatedClock()
+    raise ValueError(f"unknown clock {name!r}, expected real or sim")
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+# One event: wall time, kind, flags, channel (relay pin, motor, command
+# sequence or -1), value (volume, timing error, ...) and 42 bytes of UTF-8
+# text. Longer texts go on in the next records of the same event (flagged
+# CONTINUED), up to MAX_RECORDS per event. Every record is 64 bytes, the
+# first slot of a segment holds its header.
+RECORD = struct.Struct("<dBBid42s")
+HEADER = struct.Struct("<4sHHd")  # Magic, version, record size, creation time
+MAGIC = b"CBRJ"
+VERSION = 2
+TEXT_SIZE = 42
+CONTINUED = 1  # Flag: the text goes on in the next record
+MAX_RECORDS = 6
+CHANNEL_MIN, CHANNEL_MAX = -2 ** 31, 2 ** 31 - 1
+
+# Records of the segments written before the channel was widened to 32 bits
+RECORDS = {1: struct.Struct("<dBxhd44s"), VERSION: RECORD}  # Version 1 has no flags
+
+EVENT_KINDS = {
+    "message": 1,
+    "error": 2,
+    "order": 3,  # An order started, text is the cocktail
+    "order_done": 4,  # value is the pour time in seconds
+    "order_failed": 5,
+    "relay_on": 6,  # channel is the pin, value the timing error in seconds
+    "relay_off": 7,
+    "pour": 8,  # A pump finished, channel is the pin, value the volume
+    "command": 9,  # Acknowledged by the Arduino, text is the command
+    "command_failed": 10,
+    "reply": 11,  # Line from the Arduino
+}
+KIND_NAMES = {number: name for name, number in EVENT_KINDS.items()}
+
+SEGMENT_PATTERN = re.compile(r"journal-(\d{6})\.bin$")
+
+
+def segment_name(number):
+    return f"journal-{number:06d}.bin"
+
+
+# Segment files of a journal directory, oldest first
+def segment_paths(directory):
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if SEGMENT_PATTERN.match(name))
+    return [os.path.join(directory, name) for name in names]
+
+
+# Append-only event journal in place of print(): fixed-size binary records
+# written into a memory-mapped segment file, so logging one event is a
+# struct.pack_into under a lock and survives a crash of the app. Segments
+# are preallocated to segment_size bytes; when one is full the next is
+# started and only the newest segments are kept, bounding the disk used.
+# flush() pushes the mapped pages to the SD card, it is called after the
+# events that must survive a power cut (finished orders and errors).
+# With echo the events are printed as before, for runs from a terminal, as
+# "text: value" when they have a value.
+class EventJournal:
+    def __init__(self, directory, segment_size=1 << 20, segments=8, echo=False):
+        self.directory = directory
+        self.slots = segment_size // RECORD.size  # Records per segment, header included
+        self.segments = segments
+        self.echo = echo
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+        self.position = 0  # Next free slot of the current segment
+        self.written = 0
+        self.failed = 0  # Events that could not be written
+        os.makedirs(directory, exist_ok=True)
+        existing = segment_paths(directory)
+        self.number = int(SEGMENT_PATTERN.search(existing[-1]).group(1)) if existing else 0
+        self._open_segment()
+
+    def _open_segment(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+        self.number += 1
+        path = os.path.join(self.directory, segment_name(self.number))
+        self.file = open(path, "w+b")
+        self.file.truncate(self.slots * RECORD.size)
+        self.map = mmap.mmap(self.file.fileno(), self.slots * RECORD.size)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, time.time())
+        self.position = 1
+        for old in segment_paths(self.directory)[:-self.segments]:
+            os.remove(old)
+
+    # Append one event, kind is a name of EVENT_KINDS. Never raises: it is
+    # called from the PumpTimer and Arduino writer threads, which must keep
+    # running whatever happens to the journal, so a failure is only counted.
+    def log(self, kind, text="", channel=-1, value=0.0):
+        now = time.time()
+        try:
+            data = text.encode()
+            chunks = [data[i:i + TEXT_SIZE] for i in range(0, len(data), TEXT_SIZE)][:MAX_RECORDS] or [b""]
+            channel = min(max(int(channel), CHANNEL_MIN), CHANNEL_MAX)
+            number = EVENT_KINDS[kind]
+            value = float(value)
+            with self.lock:
+                if self.map is None:
+                    return
+                if self.position + len(chunks) > self.slots:
+                    self._open_segment()  # The records of one event stay in one segment
+                for i, chunk in enumerate(chunks):
+                    flags = CONTINUED if i < len(chunks) - 1 else 0
+                    RECORD.pack_into(self.map, (self.position + i) * RECORD.size, now, number, flags, channel, value, chunk)
+                self.position += len(chunks)
+                self.written += 1
+        except (struct.error, OSError, ValueError, TypeError, KeyError):
+            self.failed += 1
+            return
+        if self.echo and text:
+            print(f"{text}: {value:g}" if value else text)
+
+    def error(self, text, channel=-1):
+        self.log("error", text, channel)
+        self.flush()
+
+    # Relay switching from the PumpTimer, same call as RelayTimingBuffer.record
+    def record(self, pin, on, commanded, actual):
+        self.log("relay_on" if on else "relay_off", "", pin, actual - commanded)
+
+    def flush(self):
+        with self.lock:
+            if self.map is not None:
+                try:
+                    self.map.flush()
+                except OSError:
+                    self.failed += 1
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+                self.map.close()
+                self.file.close()
+                self.map = None
+
+
+# Number of records written in a segment: the free slots are zero-filled and
+# come after the used ones, so a binary search finds the end
+def used_slots(data):
+    low, high = 1, len(data) // RECORD.size
+    while low < high:
+        middle = (low + high) // 2
+        if data[middle * RECORD.size + 8]:  # Kind byte of the record
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def record_time(data, slot):
+    return struct.unpack_from("<d", data, slot * RECORD.size)[0]
+
+
+# First slot in [1, end) whose time is at least when
+def first_slot_at(data, end, when):
+    low, high = 1, end
+    while low < high:
+        middle = (low + high) // 2
+        if record_time(data, middle) < when:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+# Events of the journal between since and until (wall times, None for no
+# bound) as dicts, oldest first. Each segment is mapped, not read, and the
+# first event is found by a binary search on the time, so a query only
+# touches the pages it returns. Times are assumed not to go back, which
+# holds unless the wall clock is set back while the app runs.
+def read_events(directory, since=None, until=None, kinds=None):
+    for path in segment_paths(directory):
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size < 2 * RECORD.size:
+                continue
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, version, size, _ = HEADER.unpack_from(data, 0)
+                record = RECORDS.get(version)
+                if magic != MAGIC or record is None or size != record.size:
+                    continue
+                end = used_slots(data)
+                if end == 1:
+                    continue
+                if until is not None and record_time(data, 1) > until:
+                    return  # This segment and the newer ones are after the range
+                if since is not None and record_time(data, end - 1) < since:
+                    continue
+                # The records of one event share its time, so this is its first one
+                slot = 1 if since is None else first_slot_at(data, end, since)
+                text = b""
+                for slot in range(slot, end):
+                    fields = record.unpack_from(data, slot * RECORD.size)
+                    if version == 1:
+                        fields = fields[:2] + (0,) + fields[2:]
+                    when, kind, flags, channel, value, chunk = fields
+                    if until is not None and when > until:
+                        return
+                    text += chunk.rstrip(b"\0")
+                    if flags & CONTINUED:
+                        continue
+                    name = KIND_NAMES.get(kind, str(kind))
+                    if not kinds or name in kinds:
+                        yield {"time": when, "kind": name, "channel": channel, "value": value,
+                               "text": text.decode(errors="replace")}
+                    text = b""
+
+
+# Epoch seconds, "YYYY-MM-DDTHH:MM:SS" local time or "10m" / "2h" / "1d" before now
+def parse_time(text):
+    relative = re.fullmatch(r"(\d+(?:\.\d+)?)([smhd])", text)
+    if relative:
+        return time.time() - float(relative.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[relative.group(2)]
+    try:
+        return float(text)
+    except ValueError:
+        return time.mktime(time.strptime(text, "%Y-%m-%dT%H:%M:%S"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the event journal as JSON Lines")
+    parser.add_argument("directory", help="journal directory of the app")
+    parser.add_argument("--since", type=parse_time, help="epoch seconds, 2024-12-24T18:00:00 or 30m (ago)")
+    parser.add_argument("--until", type=parse_time, help="same formats as --since")
+    parser.add_argument("--kind", action="append", choices=sorted(EVENT_KINDS), help="only these kinds (repeatable)")
+    parser.add_argument("--output", help="JSON Lines file to write, stdout if missing")
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    for event in read_events(args.directory, args.since, args.until, args.kind):
+        output.write(json.dumps(event) + "\n")
+    if args.output:
+        output.close()
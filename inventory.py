@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import json
+import os
+import threading
+
+
+class InventoryError(ValueError):
+    pass
+
+
+# mL left in the bottle behind every motor number. Bottles never refilled
+# are not tracked (level None) and never refuse an order.
+#
+# Every change is appended to a write-ahead log next to the snapshot
+# (path + ".wal") and fsynced before it is applied, so a crash or a power
+# cut loses at most the change being written; a torn last line is ignored
+# on load. Every compact_every changes the levels are written to the
+# snapshot atomically and the log is emptied. Changes carry a sequence
+# number and the snapshot the last one it contains, so a crash between the
+# two steps does not apply a change twice.
+class BottleInventory:
+    def __init__(self, path, motors, compact_every=100, reserve=30.0):
+        self.path = path
+        self.wal_path = path + ".wal"
+        self.compact_every = compact_every
+        self.reserve = reserve  # mL under which a bottle is reported as low
+        self.lock = threading.Lock()
+        self.levels = {motor: None for motor in motors}  # mL left
+        self.capacity = {motor: None for motor in motors}  # mL of the last refill
+        self.sequence = 0  # Number of the last change applied
+        self.logged = 0  # Changes in the log since the last compaction
+        self._load()
+        self.wal = open(self.wal_path, "a")
+        if self.wal.tell():
+            self._compact()  # Also drops a torn line, the next changes must not follow it
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                stored = json.load(file)
+            self.sequence = stored.get("sequence", 0)
+            for motor, bottle in stored.get("bottles", {}).items():
+                if int(motor) in self.levels:
+                    self.levels[int(motor)] = bottle["level"]
+                    self.capacity[int(motor)] = bottle["capacity"]
+        if os.path.exists(self.wal_path):
+            with open(self.wal_path) as file:
+                for line in file:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        break  # Torn by a crash while it was written
+                    if change["seq"] > self.sequence:
+                        self._apply(change)
+
+    def _apply(self, change):
+        motor = change["motor"]
+        if motor not in self.levels:
+            return
+        if change["op"] == "refill":
+            self.levels[motor] = self.capacity[motor] = change["volume"]
+        elif change["op"] == "pour" and self.levels[motor] is not None:
+            self.levels[motor] = max(0.0, self.levels[motor] - change["volume"])
+        self.sequence = change["seq"]
+
+    def _log(self, op, motor, volume):
+        with self.lock:
+            change = {"seq": self.sequence + 1, "op": op, "motor": motor, "volume": round(volume, 2)}
+            self.wal.write(json.dumps(change) + "\n")
+            self.wal.flush()
+            os.fsync(self.wal.fileno())
+            self._apply(change)
+            self.logged += 1
+            if self.logged >= self.compact_every:
+                self._compact()
+
+    # Write the levels to the snapshot and start an empty log
+    def _compact(self):
+        bottles = {str(motor): {"level": level, "capacity": self.capacity[motor]}
+                   for motor, level in sorted(self.levels.items()) if level is not None}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"sequence": self.sequence, "bottles": bottles}, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        self.wal.close()
+        self.wal = open(self.wal_path, "w")
+        self.logged = 0
+
+    # A full bottle of volume mL was put behind motor
+    def refill(self, motor, volume):
+        if volume <= 0:
+            raise InventoryError("a refill needs a positive volume")
+        self._log("refill", motor, volume)
+
+    # volume mL were pumped out of the bottle behind motor
+    def pour(self, motor, volume):
+        if volume > 0:
+            self._log("pour", motor, volume)
+
+    def level(self, motor):
+        with self.lock:
+            return self.levels[motor]
+
+    # {motor: mL left} of every bottle, None if it is not tracked
+    def snapshot(self):
+        with self.lock:
+            return dict(self.levels)
+
+    # Bottles that cannot pour needs ({motor: mL}) as [(motor, needed, left)],
+    # and the ones that would be left under the reserve as [(motor, left after)]
+    def check(self, needs):
+        with self.lock:
+            short = []
+            low = []
+            for motor, needed in needs.items():
+                left = self.levels.get(motor)
+                if left is None:
+                    continue
+                if left < needed:
+                    short.append((motor, needed, left))
+                elif left - needed < self.reserve:
+                    low.append((motor, left - needed))
+            return short, low
+
+    def close(self):
+        with self.lock:
+            self.wal.close()
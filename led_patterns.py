@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import math
+
+# Encoder of the one-character LED opcodes understood by waitmode.ino /
+# ws2812b.ino. The firmware keeps its patterns in one table indexed by
+# opcode, so the Pi only sends a character for the built-in patterns and a
+# fixed-width "X" command for patterns that only exist in the recipe JSON.
+
+# Control commands
+CONTROL_OPCODES = {
+    "COMPLETE": "C",
+    "FINISHED": "F",
+    "WAITING": "W",
+    "BLINK": "B",
+}
+
+# Built-in moving patterns, same order as the firmware pattern table
+PATTERN_OPCODES = {
+    "ADIOS": "A",
+    "LONGISLAND": "L",
+    "PEACHCRUSH": "P",
+    "MIDORISOUR": "M",
+    "ALLMOTORS": "V",
+    "PUMPNUMBER": "N",
+}
+
+# Pattern of the cocktails that do not name one with an "led" entry
+RECIPE_PATTERNS = {
+    "AMF": "ADIOS",
+    "Long Island Ice Tea": "LONGISLAND",
+    "Peach Crush": "PEACHCRUSH",
+    "Midori Sour": "MIDORISOUR",
+}
+
+OPCODES = set(CONTROL_OPCODES.values()) | set(PATTERN_OPCODES.values())
+
+# Pour progress bar, "G" + the start offset and run time of every pump in
+# 100 ms units as 3 hex digits each. The firmware gives every pump its own
+# segment of the strip and fills it from millis(), so one command covers
+# the whole pour. Every segment needs an LED, and the smallest strip
+# (ws2812b.ino) has 6: a pour of more pumps shows its pattern instead.
+PROGRESS_OPCODE = "G"
+MAX_PROGRESS_SEGMENTS = 6
+
+
+# "#00FFFF", "00ffff" or [0, 255, 255] as 6 hex digits
+def encode_color(color):
+    if isinstance(color, str):
+        value = color.lstrip("#")
+        if len(value) != 6:
+            raise ValueError(f"invalid LED colour {color!r}")
+        int(value, 16)  # Raises ValueError for non hex digits
+        return value.upper()
+    red, green, blue = color
+    return f"{red:02X}{green:02X}{blue:02X}"
+
+
+# Command of a pattern spec from the recipe JSON:
+#   "ADIOS" (built-in name) or "A" (opcode), or
+#   {"fill": "#00FFFF", "trail": "#FF0000", "fg": "#00FFFF", "group": 6, "speed": 100}
+#   where fill is the colour set first, fg the moving group of group LEDs,
+#   trail the colour it leaves behind and speed the frame time in ms
+def encode_pattern(spec):
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        return encode_command(spec)
+    group = int(spec.get("group", 6))
+    speed = int(spec.get("speed", 100))
+    if not 1 <= group <= 255 or not 10 <= speed <= 65535:
+        raise ValueError(f"invalid LED group {group} or speed {speed}")
+    fg = encode_color(spec["fg"])
+    fill = encode_color(spec.get("fill", spec["fg"]))
+    trail = encode_color(spec.get("trail", "#000000"))
+    return f"X{fill}{trail}{fg}{group:02X}{speed:04X}"
+
+
+# Progress bar command of (start offset, run time) pairs in seconds, None if
+# there are too many pumps or a pour is too long to fit the command
+def encode_progress(pours):
+    if not 0 < len(pours) <= MAX_PROGRESS_SEGMENTS:
+        return None
+    fields = []
+    for offset, run_time in pours:
+        start = max(0, round(offset * 10))
+        length = math.ceil(run_time * 10)
+        if start > 0xFFF or length > 0xFFF:
+            return None
+        fields.append(f"{start:03X}{length:03X}")
+    return PROGRESS_OPCODE + "".join(fields)
+
+
+# Command of a control or pattern name, opcodes, X and G commands pass unchanged
+def encode_command(command):
+    if command in OPCODES or (command.startswith("X") and len(command) == 25) or \
+            (command.startswith(PROGRESS_OPCODE) and len(command) % 6 == 1 and len(command) > 1):
+        return command
+    if command in CONTROL_OPCODES:
+        return CONTROL_OPCODES[command]
+    if command in PATTERN_OPCODES:
+        return PATTERN_OPCODES[command]
+    raise ValueError(f"unknown LED command {command!r}")
+
+
+# Command to send when a cocktail starts, None if it has no pattern
+def recipe_pattern(cocktail, recipe):
+    return encode_pattern(recipe.get('led', RECIPE_PATTERNS.get(cocktail)))
@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+# Streaming mode of waitmode.ino / ws2812b.ino: the Pi renders every frame of
+# the strip with NumPy and the Arduino only copies it to the LEDs, so a new
+# effect does not need a reflash. A frame is sent as
+#   0xFE <type> <length> <payload> <checksum>
+# where checksum is the sum of type, length and payload modulo 256 and type is
+#   K  key frame, every pixel as G R B
+#   R  runs of (count, G, R, B) covering the strip
+#   D  delta from the previous frame, (index, G, R, B) of the changed pixels
+# A key frame of 30 pixels is 94 bytes, about 8 ms at 115200 baud; runs and
+# deltas are usually a few bytes. Frames are not acknowledged; at most
+# keyframe_interval deltas follow each other, so a frame lost on the way is
+# repaired by the next full frame, and one is sent as soon as the Arduino
+# reports a framing error. A payload is at most 255 bytes, which
+# limits a strip to 85 LEDs.
+FRAME_START = 0xFE
+KEY_FRAME = ord("K")
+RLE_FRAME = ord("R")
+DELTA_FRAME = ord("D")
+
+NUM_LEDS = 30
+BAUDRATE = 115200
+
+
+# Builds RGB frames of a strip as float arrays of shape (num_leds, 3)
+class LedCompositor:
+    def __init__(self, num_leds=NUM_LEDS):
+        self.num_leds = num_leds
+        self.positions = np.arange(num_leds, dtype=np.float32)
+
+    def solid(self, color):
+        return np.tile(np.asarray(color, dtype=np.float32), (self.num_leds, 1))
+
+    # Linear gradient from start on the first LED to end on the last, moved
+    # along the strip (and wrapped around) by offset strip lengths
+    def gradient(self, start, end, offset=0.0):
+        ramp = self.positions / max(self.num_leds - 1, 1)
+        if offset:
+            ramp = (ramp + offset) % 1.0
+        start = np.asarray(start, dtype=np.float32)
+        end = np.asarray(end, dtype=np.float32)
+        return start + ramp[:, None] * (end - start)
+
+    # Bar of color over the first fraction of the strip, the last LED of the
+    # bar dimmed in proportion so the bar grows smoothly
+    def progress(self, fraction, color, background=(0, 0, 0)):
+        return self.segments([fraction], [color], background)
+
+    # One bar per pump: the strip is cut into len(colors) equal segments and
+    # segment i is filled with colors[i] over fractions[i] of its length
+    def segments(self, fractions, colors, background=(0, 0, 0)):
+        count = len(colors)
+        frame = self.solid(background)
+        if not count:
+            return frame
+        bounds = np.linspace(0, self.num_leds, count + 1)
+        index = np.minimum((self.positions * count / self.num_leds).astype(int), count - 1)
+        start = bounds[index]
+        lit = np.clip(np.asarray(fractions, dtype=np.float32), 0, 1)[index] * (bounds[index + 1] - start)
+        coverage = np.clip(lit - (self.positions - start), 0, 1)[:, None]
+        return frame + coverage * (np.asarray(colors, dtype=np.float32)[index] - frame)
+
+    @staticmethod
+    def blend(below, above, alpha):
+        return below + alpha * (above - below)
+
+    # Whole frame scaled by a sine between low and 1 with the given period
+    @staticmethod
+    def pulse(frame, t, period=1.0, low=0.3):
+        level = low + (1 - low) * (0.5 + 0.5 * np.sin(2 * np.pi * t / period))
+        return frame * level
+
+    # Frame as the uint8 G R B bytes of the wire format
+    @staticmethod
+    def to_grb(frame):
+        rgb = np.clip(np.rint(frame), 0, 255).astype(np.uint8)
+        return np.ascontiguousarray(rgb[:, [1, 0, 2]])
+
+
+def frame_bytes(kind, payload):
+    header = bytes((kind, len(payload)))
+    checksum = (sum(header) + sum(payload)) & 0xFF
+    return bytes((FRAME_START,)) + header + payload + bytes((checksum,))
+
+
+def encode_key(grb):
+    return frame_bytes(KEY_FRAME, grb.tobytes())
+
+
+def encode_rle(grb):
+    changes = np.any(grb[1:] != grb[:-1], axis=1)
+    starts = np.flatnonzero(np.concatenate(([True], changes)))
+    counts = np.diff(np.append(starts, len(grb)))
+    runs = np.column_stack((counts, grb[starts])).astype(np.uint8)
+    return frame_bytes(RLE_FRAME, runs.tobytes())
+
+
+def encode_delta(previous, grb):
+    changed = np.flatnonzero(np.any(previous != grb, axis=1))
+    pixels = np.column_stack((changed, grb[changed])).astype(np.uint8)
+    return frame_bytes(DELTA_FRAME, pixels.tobytes())
+
+
+# Picks the smallest encoding of every frame, remembering the last frame sent
+class FrameEncoder:
+    def __init__(self, keyframe_interval=10):
+        self.keyframe_interval = keyframe_interval
+        self.previous = None
+        self.since_key = 0
+        self.counts = {KEY_FRAME: 0, RLE_FRAME: 0, DELTA_FRAME: 0}
+        self.bytes = 0
+
+    # Next frame sends every pixel again
+    def reset(self):
+        self.previous = None
+
+    # Encoded frame, or None if it is the same as the previous one
+    def encode(self, grb):
+        # Runs cover the whole strip too, so they can stand in for a key frame
+        candidates = [encode_key(grb), encode_rle(grb)]
+        if self.previous is not None and self.since_key < self.keyframe_interval:
+            if np.array_equal(self.previous, grb):
+                return None
+            candidates.append(encode_delta(self.previous, grb))
+        data = min(candidates, key=len)
+        self.since_key = self.since_key + 1 if data[1] == DELTA_FRAME else 0
+        self.previous = grb.copy()
+        self.counts[data[1]] += 1
+        self.bytes += len(data)
+        return data
+
+
+# Renders render(compositor, t) fps times per second and streams the frames
+# through an ArduinoLink. A frame is only rendered once the writer has taken
+# the previous one, otherwise the tick is skipped, so deltas always apply to
+# the frame the Arduino really has. A frame the Arduino rejected (bad
+# checksum, bytes lost while the strip was shown) shows up in the framing
+# errors of its STATS, which also restart from 0 after a reset; either way
+# the next frame is a key frame.
+class LedStreamer:
+    def __init__(self, link, render, fps=30, num_leds=NUM_LEDS, keyframe_interval=10):
+        self.link = link
+        self.render = render
+        self.period = 1.0 / fps
+        self.compositor = LedCompositor(num_leds)
+        self.encoder = FrameEncoder(keyframe_interval)
+        self.rendered = 0
+        self.unchanged = 0
+        self.skipped = 0  # Ticks where the link was still busy with the previous frame
+        self.late = 0  # Ticks missed because rendering took longer than a period
+        self.render_time = 0.0
+        self.running = False
+        self.thread = None
+        self.started = None
+        self.stopped = None
+
+    def start(self):
+        self.running = True
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="LedStreamer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.stopped = time.monotonic()
+
+    def _run(self):
+        seen_drops = self.link.frames_dropped
+        seen_errors = self.link.firmware_stats.get("framing_errors")
+        deadline = time.monotonic()
+        while self.running:
+            deadline += self.period
+            now = time.monotonic()
+            if now > deadline:
+                missed = int((now - deadline) / self.period) + 1
+                self.late += missed
+                deadline += missed * self.period
+            time.sleep(max(0.0, deadline - now))
+
+            if self.link.pending_frame is not None:
+                self.skipped += 1
+                continue
+            if self.link.frames_dropped != seen_drops:
+                seen_drops = self.link.frames_dropped
+                self.encoder.reset()  # A write failed, the Arduino needs a key frame
+            errors = self.link.firmware_stats.get("framing_errors")
+            if errors != seen_errors:
+                seen_errors = errors
+                self.encoder.reset()  # The Arduino rejected a frame or rebooted
+
+            start = time.perf_counter()
+            frame = self.render(self.compositor, deadline - self.started)
+            data = self.encoder.encode(self.compositor.to_grb(frame))
+            self.render_time += time.perf_counter() - start
+            self.rendered += 1
+            if data is None:
+                self.unchanged += 1
+            else:
+                self.link.stream(data)
+
+    def stats(self):
+        elapsed = (self.stopped or time.monotonic()) - self.started
+        sent = self.rendered - self.unchanged
+        return {
+            "seconds": round(elapsed, 3),
+            "rendered": self.rendered,
+            "unchanged": self.unchanged,
+            "skipped": self.skipped,
+            "late": self.late,
+            "fps": round(self.rendered / elapsed, 2) if elapsed else 0.0,
+            "render_ms": round(self.render_time / self.rendered * 1000, 3) if self.rendered else 0.0,
+            "bytes_per_frame": round(self.encoder.bytes / sent, 1) if sent else 0.0,
+            "key_frames": self.encoder.counts[KEY_FRAME],
+            "rle_frames": self.encoder.counts[RLE_FRAME],
+            "delta_frames": self.encoder.counts[DELTA_FRAME],
+        }
+
+
+# Demo effect of the benchmark: four pump bars filling over 10 s on a
+# slowly moving gradient
+def demo_render(compositor, t):
+    background = compositor.gradient((40, 0, 60), (0, 20, 60), offset=t / 8)
+    fractions = [(t / duration) % 1.0 for duration in (4, 6, 8, 10)]
+    colors = [(0, 255, 255), (139, 69, 19), (0, 255, 0), (255, 140, 0)]
+    bars = compositor.segments(fractions, colors)
+    lit = bars.any(axis=1, keepdims=True)
+    return np.where(lit, bars, background)
+
+
+# Frames per second the encoder and the wire allow without a board
+def benchmark_encoder(num_leds, frames, fps):
+    compositor = LedCompositor(num_leds)
+    encoder = FrameEncoder()
+    start = time.perf_counter()
+    sizes = []
+    for i in range(frames):
+        data = encoder.encode(compositor.to_grb(demo_render(compositor, i / fps)))
+        sizes.append(len(data) if data else 0)
+    elapsed = time.perf_counter() - start
+    bytes_per_frame = sum(sizes) / frames
+    return {
+        "frames": frames,
+        "render_ms": round(elapsed / frames * 1000, 3),
+        "bytes_per_frame": round(bytes_per_frame, 1),
+        "key_frame_bytes": num_leds * 3 + 4,
+        "wire_fps": round(BAUDRATE / 10 / bytes_per_frame, 1) if bytes_per_frame else None,
+        "key_frames": encoder.counts[KEY_FRAME],
+        "rle_frames": encoder.counts[RLE_FRAME],
+        "delta_frames": encoder.counts[DELTA_FRAME],
+    }
+
+
+def benchmark_link(port, num_leds, fps, seconds):
+    from arduino_link import ArduinoLink
+
+    link = ArduinoLink(port, BAUDRATE, stats_interval=1.0)
+    time.sleep(2.5)  # Opening the port resets the Uno
+    first = dict(link.firmware_stats)
+    streamer = LedStreamer(link, demo_render, fps, num_leds)
+    streamer.start()
+    time.sleep(seconds)
+    streamer.stop()
+    time.sleep(1.5)  # Let the next STATS reply come in
+    result = streamer.stats()
+    result["link_sent"] = link.frames_sent
+    result["link_dropped"] = link.frames_dropped
+    last = link.firmware_stats
+    if "frames" in first and "frames" in last:
+        result["arduino_frames"] = last["frames"] - first["frames"]
+        result["arduino_framing_errors"] = last["framing_errors"] - first["framing_errors"]
+    link.send("FINISHED")
+    time.sleep(0.5)
+    link.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LED frame streaming mode")
+    parser.add_argument("--port", help="serial port of the Arduino, encoder only without it")
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--leds", type=int, default=NUM_LEDS)
+    args = parser.parse_args()
+
+    if args.port:
+        result = benchmark_link(args.port, args.leds, args.fps, args.seconds)
+    else:
+        result = benchmark_encoder(args.leds, int(args.fps * args.seconds), args.fps)
+    for name, value in result.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import numpy as np
+
+
+# The recipe book as a dense cocktails x motors matrix of mL per serving,
+# built once from the compiled RecipePlans, so what the bottles can still
+# make is one array operation against the vector of levels instead of a
+# loop over every recipe's ingredients on each UI refresh. Rows follow
+# cocktails (the order of the plans), columns follow motors.
+class MenuMatrix:
+    def __init__(self, plans, motors):
+        self.cocktails = list(plans)
+        self.motors = list(motors)
+        self.rows = {cocktail: row for row, cocktail in enumerate(self.cocktails)}
+        columns = {motor: column for column, motor in enumerate(self.motors)}
+        self.volumes = np.zeros((len(self.cocktails), len(self.motors)))
+        for row, cocktail in enumerate(self.cocktails):
+            for step in plans[cocktail].steps:
+                self.volumes[row, columns[step.motor]] = step.volume
+        self.uses = self.volumes > 0
+
+    # Vector of mL left per motor from {motor: level}, untracked bottles
+    # (level None) never run out
+    def level_vector(self, levels):
+        return np.array([np.inf if levels.get(motor) is None else levels[motor] for motor in self.motors])
+
+    # True for every cocktail the bottles can pour once
+    def available(self, levels):
+        return (self.volumes <= levels).all(axis=1)
+
+    # Servings of every cocktail the bottles can still pour, inf when none
+    # of its bottles is tracked
+    def servings(self, levels):
+        ratios = np.divide(levels, self.volumes, out=np.full(self.volumes.shape, np.inf), where=self.uses)
+        return np.floor(ratios.min(axis=1))
+
+    # True for every cocktail using one of the bottles where low is True
+    # (a vector over motors, e.g. levels < 100)
+    def affected(self, low):
+        return self.uses @ low > 0
+
+    # Names of the cocktails where mask is True
+    def names(self, mask):
+        return [self.cocktails[row] for row in np.flatnonzero(mask)]
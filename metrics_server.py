@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Environment variables turning the metrics endpoint on (port) and choosing
+# the address it listens on, 127.0.0.1 unless set
+METRICS_PORT_VARIABLE = "CBR_METRICS_PORT"
+METRICS_HOST_VARIABLE = "CBR_METRICS_HOST"
+
+# Updates kept waiting for a scrape, the newer ones are dropped (and counted)
+MAX_QUEUED_UPDATES = 10000
+
+# Histogram buckets of the order latencies from the submission, queue included, in seconds
+ORDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+
+# Port of the metrics endpoint, None (no endpoint) unless CBR_METRICS_PORT is set
+def metrics_port():
+    port = os.environ.get(METRICS_PORT_VARIABLE)
+    return int(port) if port else None
+
+
+# {quantile: value} of a window of samples, for a gauge() of a summary
+def quantiles(values, points=(0.5, 0.9, 0.99)):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {point: values[min(len(values) - 1, int(point * len(values)))] for point in points}
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Cumulative histogram in the Prometheus text format
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name):
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            yield f'{name}_bucket{{le="{bound}"}} {seen}'
+        yield f'{name}_bucket{{le="+Inf"}} {self.count}'
+        yield f"{name}_sum {self.sum:.6f}"
+        yield f"{name}_count {self.count}"
+
+
+# Counters and histograms of the pour machine. The pour threads only put a
+# tuple on a SimpleQueue (no lock shared with the endpoint), and the queued
+# updates are folded into the metrics when they are scraped, on the HTTP
+# thread. Past MAX_QUEUED_UPDATES unscraped updates the new ones are dropped,
+# never folded by a pour thread. Gauges read elsewhere (queue depths, serial
+# latencies, cache hits) are registered with gauge() and read at scrape time.
+class PourMetrics:
+    def __init__(self, pins, clock=time.monotonic):
+        self.pins = list(pins)
+        self.clock = clock
+        self.started = clock()
+        self.updates = queue.SimpleQueue()
+        self.lock = threading.Lock()  # Held while folding and rendering only
+        self.orders_completed = {}  # Recipe -> orders poured
+        self.orders_failed = 0
+        self.on_time = {pin: 0.0 for pin in self.pins}  # Seconds each relay was on
+        self.switched_on = {}  # Pin -> clock() when its relay went on
+        self.order_start = None  # clock() when the current order was submitted
+        self.waiting_first_drop = False
+        self.first_drop = Histogram(ORDER_BUCKETS)
+        self.complete = Histogram(ORDER_BUCKETS)
+        self.gauges = []  # (name, help, label, read) read at scrape time
+        self.dropped = 0  # Updates dropped because nobody scraped them
+
+    # Called from the order worker when an order starts pouring, with the
+    # clock() when it was submitted (now if None); the latencies run from there
+    def order_started(self, recipe, submitted=None):
+        self._put(("started", recipe, self.clock() if submitted is None else submitted))
+
+    # Called from the order worker once the order is in the glass
+    def order_completed(self, recipe):
+        self._put(("completed", recipe, self.clock()))
+
+    def order_failed(self, recipe):
+        self._put(("failed", recipe, self.clock()))
+
+    # Relay switching from the PumpTimer, same call as RelayTimingBuffer.record
+    def record(self, pin, on, commanded, actual):
+        self._put(("on" if on else "off", pin, actual))
+
+    def _put(self, update):
+        if self.updates.qsize() >= MAX_QUEUED_UPDATES:
+            self.dropped += 1
+            return
+        self.updates.put(update)
+
+    # Export read() as a gauge; read returns a number, or {label value: number}
+    # for one series per label value
+    def gauge(self, name, help, read, label=None):
+        self.gauges.append((name, help, label, read))
+
+    def _fold(self):
+        while True:
+            try:
+                kind, key, when = self.updates.get_nowait()
+            except queue.Empty:
+                return
+            if kind == "on":
+                self.switched_on[key] = when
+                if self.waiting_first_drop:
+                    self.first_drop.observe(when - self.order_start)
+                    self.waiting_first_drop = False
+            elif kind == "off":
+                start = self.switched_on.pop(key, None)
+                if start is not None and key in self.on_time:
+                    self.on_time[key] += when - start
+            elif kind == "started":
+                self.order_start = when
+                self.waiting_first_drop = True
+            elif kind == "completed":
+                self.orders_completed[key] = self.orders_completed.get(key, 0) + 1
+                if self.order_start is not None:
+                    self.complete.observe(when - self.order_start)
+                self.order_start = None
+                self.waiting_first_drop = False
+            elif kind == "failed":
+                self.orders_failed += 1
+                self.order_start = None
+                self.waiting_first_drop = False
+
+    # Every metric in the Prometheus text format
+    def render(self):
+        with self.lock:
+            self._fold()
+            now = self.clock()
+            uptime = now - self.started
+            on_time = dict(self.on_time)
+            for pin, start in self.switched_on.items():
+                on_time[pin] = on_time.get(pin, 0.0) + now - start  # Still running
+            lines = [
+                "# HELP cbr_uptime_seconds Seconds since the app started",
+                "# TYPE cbr_uptime_seconds gauge",
+                f"cbr_uptime_seconds {uptime:.3f}",
+                "# HELP cbr_orders_completed_total Orders poured, per recipe",
+                "# TYPE cbr_orders_completed_total counter",
+            ]
+            lines += [f'cbr_orders_completed_total{{recipe="{escape_label(recipe)}"}} {count}'
+                      for recipe, count in sorted(self.orders_completed.items())]
+            lines += [
+                "# HELP cbr_orders_failed_total Orders that raised an error",
+                "# TYPE cbr_orders_failed_total counter",
+                f"cbr_orders_failed_total {self.orders_failed}",
+                "# HELP cbr_metrics_dropped_updates_total Updates dropped while nobody scraped",
+                "# TYPE cbr_metrics_dropped_updates_total counter",
+                f"cbr_metrics_dropped_updates_total {self.dropped}",
+                "# HELP cbr_pump_on_seconds_total Seconds each pump relay was on",
+                "# TYPE cbr_pump_on_seconds_total counter",
+            ]
+            lines += [f'cbr_pump_on_seconds_total{{pin="{pin}"}} {seconds:.3f}' for pin, seconds in on_time.items()]
+            lines += [
+                "# HELP cbr_pump_duty_cycle Share of the uptime each pump relay was on",
+                "# TYPE cbr_pump_duty_cycle gauge",
+            ]
+            lines += [f'cbr_pump_duty_cycle{{pin="{pin}"}} {seconds / uptime if uptime else 0.0:.6f}'
+                      for pin, seconds in on_time.items()]
+            lines += [
+                "# HELP cbr_order_first_drop_seconds Order submitted to the first pump going on",
+                "# TYPE cbr_order_first_drop_seconds histogram",
+                *self.first_drop.lines("cbr_order_first_drop_seconds"),
+                "# HELP cbr_order_complete_seconds Order submitted to the drink being ready",
+                "# TYPE cbr_order_complete_seconds histogram",
+                *self.complete.lines("cbr_order_complete_seconds"),
+            ]
+        for name, help, label, read in self.gauges:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            value = read()
+            if isinstance(value, dict):
+                lines += [f'{name}{{{label}="{escape_label(key)}"}} {number}'
+                          for key, number in value.items() if number is not None]
+            elif value is not None:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # No line on stderr for every scrape
+
+
+# Serve metrics on http://host:port/metrics from a daemon thread
+def start_metrics_server(metrics, port, host=None):
+    server = HTTPServer((host or os.environ.get(METRICS_HOST_VARIABLE, "127.0.0.1"), port), MetricsHandler)
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="Metrics", daemon=True).start()
+    return server
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+# Event posted from the worker to the UI thread
+# kind is one of "queued", "started", "progress", "waiting_glass", "finished" or "failed"
+UiEvent = namedtuple("UiEvent", ["kind", "order", "data"])
+
+# One unit of work taken from a button: a label for the UI, the call to run,
+# the estimated pour time in seconds used for the ETAs and the
+# time.monotonic() when it was submitted
+Order = namedtuple("Order", ["name", "target", "args", "duration", "submitted"])
+
+# Seconds we allow the bartender to take the finished drink and put a new glass
+GLASS_SWAP_TIME = 5.0
+
+
+# Runs the orders coming from the Tk buttons on a background worker so the
+# mainloop never blocks on a pour. Orders wait in a FIFO with a fixed cap and
+# the next one starts as soon as the glass under the nozzles is swapped. The
+# worker reports back through a queue that the UI drains from root.after(),
+# because tkinter widgets may only be touched from the thread running the
+# mainloop.
+class OrderDispatcher:
+    def __init__(self, max_orders=5, swap_time=GLASS_SWAP_TIME, journal=None):
+        self.max_orders = max_orders  # Orders allowed to wait behind the current one
+        self.swap_time = swap_time
+        self.journal = journal  # EventJournal of the failed orders, print() if None
+        self.pending = deque()  # Orders waiting for the worker, oldest first
+        self.condition = threading.Condition()
+        self.glass_ready = True  # An empty glass is under the nozzles
+        self.events = queue.Queue()  # UiEvents waiting for the UI thread
+        self.current = None  # Order the worker is running right now
+        self.current_started = None  # time.monotonic() when the current order started
+        self.worker = threading.Thread(target=self._run, name="OrderDispatcher", daemon=True)
+        self.worker.start()
+
+    # Called from the UI thread: queue an order and return immediately.
+    # Returns None if the queue is already full.
+    def submit(self, name, target, *args, duration=0.0):
+        order = Order(name, target, args, duration, time.monotonic())
+        with self.condition:
+            if len(self.pending) >= self.max_orders:
+                return None
+            self.pending.append(order)
+            self.condition.notify()
+        self.post("queued", order=order)
+        return order
+
+    # Called from the UI thread when the bartender has put an empty glass
+    def glass_swapped(self):
+        with self.condition:
+            self.glass_ready = True
+            self.condition.notify()
+
+    # Called from any thread: pass an event on to the UI thread
+    def post(self, kind, data=None, order=None):
+        self.events.put(UiEvent(kind, order or self.current, data))
+
+    # Called from the UI thread: hand every pending event to handler
+    def drain(self, handler):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+            handler(event)
+
+    # True while the worker is running an order
+    def busy(self):
+        return self.current is not None
+
+    # Number of orders waiting behind the current one
+    def depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    # Estimated (order, seconds until start, seconds until finish) for every
+    # waiting order, assuming one glass swap between consecutive orders
+    def schedule(self):
+        with self.condition:
+            now = time.monotonic()
+            start = 0.0
+            if self.current is not None:
+                remaining = self.current_started + self.current.duration - now
+                start = max(remaining, 0.0) + self.swap_time
+            elif not self.glass_ready:
+                start = self.swap_time
+
+            etas = []
+            for order in self.pending:
+                etas.append((order, start, start + order.duration))
+                start += order.duration + self.swap_time
+            return etas
+
+    def _run(self):
+        while True:
+            with self.condition:
+                waiting_posted = False
+                while not self.pending or not self.glass_ready:
+                    if self.pending and not waiting_posted:
+                        self.post("waiting_glass", order=self.pending[0])
+                        waiting_posted = True
+                    self.condition.wait()
+                order = self.pending.popleft()
+                self.glass_ready = False  # This order fills the glass
+                self.current = order
+                self.current_started = time.monotonic()
+
+            self.post("started")
+            try:
+                result = order.target(*order.args)
+            except Exception as e:
+                if self.journal:
+                    self.journal.log("order_failed", f"{order.name}: {e}")
+                    self.journal.flush()
+                else:
+                    print(f"Order {order.name} failed: {e}")
+                self.post("failed", e)
+            else:
+                self.post("finished", result)
+            finally:
+                with self.condition:
+                    self.current = None
+                    self.current_started = None
@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import argparse
+import json
+import random
+import time
+
+from clock import RealClock, SimulatedClock
+from led_patterns import encode_progress
+from pump_calibration import PumpCalibration
+from pump_scheduler import MAX_RUNNING_PUMPS
+from pump_timer import PumpTimer
+from recipe_compiler import compile_recipes
+from relay_driver import SimulatedRelayDriver
+
+# Relay pins of the machine, motor n is RELAY_PINS[n - 1]
+RELAY_PINS = [26, 21, 19, 15, 13, 11, 7, 5, 31, 33, 35]
+
+
+# Pours the orders: switches the pumps through a PumpTimer and tells the LED
+# strip what is going on. Everything waits on clock, so the same code runs
+# the machine in real time or a whole evening of orders on a SimulatedClock.
+class PourEngine:
+    def __init__(self, relays, send_command, clock=None, on_finished=None, recorders=(), journal=None):
+        self.relays = relays
+        self.send_command = send_command  # Called with an LED command name or opcode
+        self.clock = clock or RealClock()
+        self.timer = PumpTimer(relays.on, relays.off, on_finished, self.clock, recorders, journal)
+
+    # Let the Arduino draw the progress bar of running pours by itself,
+    # returns False if they do not fit one command
+    def send_progress(self, pours):
+        now = self.clock.now()
+        command = encode_progress([(pour.start_at - now, pour.run_time) for pour in pours])
+        if command is None:
+            return False
+        self.send_command(command)
+        return True
+
+    # Run (motor_pin, run_time, volume, start_offset) steps and wait for all
+    # of them, showing their progress (or led_command) and then COMPLETE on
+    # the LEDs. Returns the finished Pours.
+    def pour(self, steps, led_command=None):
+        pours = [self.timer.start(pin, run_time, volume, offset) for pin, run_time, volume, offset in steps]
+        if not self.send_progress(pours) and led_command:
+            self.send_command(led_command)
+        for pour in pours:
+            pour.wait()
+        self.send_command("COMPLETE")
+        return pours
+
+    # Run the steps of a compiled RecipePlan
+    def pour_plan(self, plan):
+        steps = [(step.pin, step.run_time, step.volume, step.start_offset) for step in plan.steps]
+        return self.pour(steps, plan.led_command)
+
+    # Switch every pump off now, the waiting pour() returns right away
+    def stop(self, pins):
+        self.timer.stop_all()
+        self.relays.off_many(pins)
+
+
+# Engine on the simulated relays, recording the LED commands as (time, command)
+def simulated_engine(clock, pins=RELAY_PINS):
+    relays = SimulatedRelayDriver(clock.now)
+    relays.setup(pins)
+    commands = []
+    engine = PourEngine(relays, lambda command: commands.append((clock.now(), command)), clock)
+    return engine, relays, commands
+
+
+# Relay switchings of one pour of plan, as (pin, on, ms after the start),
+# pressing STOP PUMPS stop_at seconds into the pour if set
+def pour_timeline(plan, clock, stop_at=None):
+    engine, relays, _ = simulated_engine(clock)
+    start = clock.now()
+    if stop_at is not None:
+        clock.schedule(start + stop_at, lambda: engine.stop(RELAY_PINS))
+    engine.pour_plan(plan)
+    return [(t.pin, t.on, (t.time - start) * 1000) for t in relays.transitions]
+
+
+# Pour orders cocktails picked at random from plans, waiting swap_time between
+# two glasses, on a simulated clock. A stop_rate share of the orders is cut
+# short by STOP PUMPS at a random time of their pour.
+def simulate_orders(plans, orders, swap_time, seed=None, stop_rate=0.0):
+    clock = SimulatedClock()
+    engine, relays, commands = simulated_engine(clock)
+    names = sorted(plans)
+    picker = random.Random(seed)
+    stopped = 0
+    started = time.perf_counter()
+    for _ in range(orders):
+        plan = plans[picker.choice(names)]
+        if stop_rate and picker.random() < stop_rate:
+            clock.schedule(clock.now() + picker.uniform(0, plan.makespan), lambda: engine.stop(RELAY_PINS))
+        pours = engine.pour_plan(plan)
+        stopped += any(pour.stopped for pour in pours)
+        clock.sleep(swap_time)
+    wall = time.perf_counter() - started
+    return {
+        "orders": orders,
+        "stopped_orders": stopped,
+        "simulated_s": round(clock.now(), 3),
+        "wall_s": round(wall, 3),
+        "speedup": round(clock.now() / wall) if wall else None,
+        "orders_per_hour": round(orders / clock.now() * 3600, 1),
+        "relay_transitions": len(relays.transitions),
+        "led_commands": len(commands),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pour engine on a simulated clock")
+    parser.add_argument("recipes", help="recipe JSON, e.g. holiday.json")
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--swap-time", type=float, default=5.0, help="seconds to change the glass")
+    parser.add_argument("--flow-rate", type=float, default=1.5, help="mL/second of the pumps")
+    parser.add_argument("--max-running", type=int, default=MAX_RUNNING_PUMPS, help="motors allowed to run at once")
+    parser.add_argument("--compare", metavar="COCKTAIL", help="also pour COCKTAIL in real time and compare the relay timings")
+    parser.add_argument("--stop-at", type=float, help="with --compare, press STOP PUMPS this many seconds into the pour")
+    parser.add_argument("--stop-rate", type=float, default=0.0, help="share of the orders stopped at a random time")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    with open(args.recipes) as file:
+        recipes = json.load(file)
+    motor_mapping = {i + 1: pin for i, pin in enumerate(RELAY_PINS)}
+    calibration = {motor: PumpCalibration(args.flow_rate) for motor in motor_mapping}
+    plans, errors = compile_recipes(recipes, motor_mapping, calibration, args.max_running)
+    for error in errors.values():
+        print(f"Recipe refused: {error}")
+
+    for name, value in simulate_orders(plans, args.orders, args.swap_time, args.seed, args.stop_rate).items():
+        print(f"{name}: {value}")
+
+    if args.compare:
+        simulated = pour_timeline(plans[args.compare], SimulatedClock(), args.stop_at)
+        real = pour_timeline(plans[args.compare], RealClock(), args.stop_at)
+        # Every pin is switched on and off at most once per pour
+        simulated = {(pin, on): ms for pin, on, ms in simulated}
+        real = {(pin, on): ms for pin, on, ms in real}
+        worst = max(abs(ms - real[key]) for key, ms in simulated.items())
+        print(f"Relay transitions: {len(simulated)}, same transitions: {simulated.keys() == real.keys()}, worst difference {worst:.2f} ms")
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import json
+import os
+
+# Largest volume in mL one pump pours for one order, the fitted model must
+# keep pouring more for longer runs up to here
+MAX_POUR_VOLUME = 500.0
+
+# Distinct run times needed before the curve is fitted; with fewer it would
+# go through the samples and fit their noise
+MIN_CURVE_DURATIONS = 4
+
+# Share of the longest run's volume the straight line may miss a mean volume
+# by before the curve is fitted
+CURVE_TOLERANCE = 0.03
+
+# Version of the stored model: 1 (no "model" key) had the curve on the volume
+MODEL = 2
+
+
+# Solve the least squares problem rows * x = values with the normal equations
+# (the systems here are at most 3x3, so plain Gaussian elimination is enough)
+def least_squares(rows, values):
+    size = len(rows[0])
+    matrix = [[sum(row[i] * row[j] for row in rows) for j in range(size)] for i in range(size)]
+    vector = [sum(row[i] * value for row, value in zip(rows, values)) for i in range(size)]
+
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(matrix[r][col]))
+        if abs(matrix[pivot][col]) < 1e-12:
+            raise ValueError("calibration samples do not determine the model")
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        vector[col], vector[pivot] = vector[pivot], vector[col]
+        for r in range(col + 1, size):
+            factor = matrix[r][col] / matrix[col][col]
+            for c in range(col, size):
+                matrix[r][c] -= factor * matrix[col][c]
+            vector[r] -= factor * vector[col]
+
+    solution = [0.0] * size
+    for r in reversed(range(size)):
+        solution[r] = (vector[r] - sum(matrix[r][c] * solution[c] for c in range(r + 1, size))) / matrix[r][r]
+    return solution
+
+
+# Flow model of one peristaltic pump, for a relay on for seconds:
+#   volume(seconds) = flow_rate * t + curve * t ** 2, t = seconds - prime_delay
+# prime_delay is the time the liquid needs to reach the nozzle, flow_rate the
+# nominal mL/second and curve lets the effective rate drift with the run time.
+# Samples are (seconds the relay was on, measured mL) pairs.
+class PumpCalibration:
+    def __init__(self, flow_rate, prime_delay=0.0, curve=0.0, samples=()):
+        self.flow_rate = flow_rate
+        self.prime_delay = prime_delay
+        self.curve = curve
+        self.samples = [tuple(sample) for sample in samples]
+
+    # Seconds the relay must stay on to pour volume mL, the inverse of volume
+    def run_time(self, volume):
+        if volume <= 0:
+            return 0.0
+        if self.curve == 0:
+            return self.prime_delay + volume / self.flow_rate
+        # curve * t ** 2 + flow_rate * t - volume = 0, smallest positive root;
+        # with a negative curve the volume peaks where the root vanishes
+        discriminant = max(self.flow_rate ** 2 + 4 * self.curve * volume, 0.0)
+        return self.prime_delay + (-self.flow_rate + discriminant ** 0.5) / (2 * self.curve)
+
+    # mL poured by a relay that was on for seconds
+    def volume(self, seconds):
+        t = seconds - self.prime_delay
+        if t <= 0:
+            return 0.0
+        if self.curve < 0:
+            t = min(t, -self.flow_rate / (2 * self.curve))  # Past the peak of the model
+        return self.flow_rate * t + self.curve * t * t
+
+    # Record one "dispense N seconds, measured M mL" run and refit the model
+    def add_sample(self, seconds, volume):
+        if seconds <= 0 or volume <= 0:
+            raise ValueError("calibration runs need a positive time and volume")
+        self.samples.append((float(seconds), float(volume)))
+        self.fit()
+
+    # Fit the model to the samples
+    def fit(self):
+        self.flow_rate, self.prime_delay, self.curve = fit_samples(self.samples, self.flow_rate)
+
+    def to_dict(self):
+        return {
+            "model": MODEL,
+            "flow_rate": self.flow_rate,
+            "prime_delay": self.prime_delay,
+            "curve": self.curve,
+            "samples": [list(sample) for sample in self.samples],
+        }
+
+
+# (flow_rate, prime_delay, curve) fitted to (seconds, mL) samples. The run
+# time is what the wizard controls, so the measured volume is fitted against
+# it, on the mean volume of every run time (repeating a run only averages
+# its noise). Two run times add the priming delay. The curve is only fitted
+# from MIN_CURVE_DURATIONS run times, and only kept when the straight line
+# misses a mean volume by more than CURVE_TOLERANCE of the longest run's:
+# otherwise it fits the measurement noise. A model that primes for longer than a run or pours less
+# when running longer falls back to the simpler one.
+def fit_samples(samples, flow_rate):
+    runs = {}
+    for seconds, volume in samples:
+        runs.setdefault(seconds, []).append(volume)
+    points = [(seconds, sum(volumes) / len(volumes)) for seconds, volumes in sorted(runs.items())]
+    if not points:
+        return flow_rate, 0.0, 0.0
+
+    shortest = points[0][0]
+    volumes = [volume for _, volume in points]
+    model = None
+    if len(points) >= 2:
+        intercept, rate = least_squares([(1.0, s) for s, _ in points], volumes)
+        model = model_from_polynomial(intercept, rate, 0.0, shortest)
+    if model is None:
+        # Through the origin: no priming delay
+        model = sum(s * v for s, v in points) / sum(s * s for s, _ in points), 0.0, 0.0
+    if len(points) >= MIN_CURVE_DURATIONS:
+        line = PumpCalibration(*model)
+        if any(abs(line.volume(s) - v) > CURVE_TOLERANCE * volumes[-1] for s, v in points):
+            curved = model_from_polynomial(*least_squares([(1.0, s, s * s) for s, _ in points], volumes), shortest)
+            model = curved or model
+    return model
+
+
+# (flow_rate, prime_delay, curve) of volume = intercept + rate * s + curve * s ** 2,
+# None unless it primes in [0, shortest) seconds and pours more when running
+# longer up to MAX_POUR_VOLUME
+def model_from_polynomial(intercept, rate, curve, shortest):
+    if curve == 0:
+        if rate <= 0:
+            return None
+        prime_delay = -intercept / rate
+    else:
+        # Priming ends at the positive root of the polynomial
+        discriminant = rate * rate - 4 * curve * intercept
+        if discriminant < 0:
+            return None
+        roots = sorted(((-rate - discriminant ** 0.5) / (2 * curve), (-rate + discriminant ** 0.5) / (2 * curve)))
+        prime_delay = roots[1] if roots[0] < 0 else roots[0]
+    if not 0 <= prime_delay < shortest:
+        return None
+    prime_delay += 0.0  # No -0.0 on the calibration label
+    # Rate and curve about t = s - prime_delay
+    flow_rate = rate + 2 * curve * prime_delay
+    if flow_rate <= 0:
+        return None
+    if curve < 0 and -flow_rate * flow_rate / (4 * curve) <= MAX_POUR_VOLUME:
+        return None
+    return flow_rate, prime_delay, curve
+
+
+# Load the calibration of every motor number, falling back to the global
+# flow rate for motors that were never calibrated
+def load_calibration(path, motor_numbers, flow_rate):
+    stored = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            stored = json.load(file)
+
+    calibration = {}
+    for motor in motor_numbers:
+        entry = stored.get(str(motor))
+        if entry:
+            pump = PumpCalibration(entry["flow_rate"], entry.get("prime_delay", 0.0), entry.get("curve", 0.0), entry.get("samples", ()))
+            if entry.get("model", 1) != MODEL and pump.curve:
+                pump.fit()  # Without the curve both models are the same
+            calibration[motor] = pump
+        else:
+            calibration[motor] = PumpCalibration(flow_rate)
+    return calibration
+
+
+# Save the calibration of every motor number, replacing the file atomically
+def save_calibration(path, calibration):
+    data = {str(motor): pump.to_dict() for motor, pump in sorted(calibration.items())}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=2)
+    os.replace(tmp_path, path)
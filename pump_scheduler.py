@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import argparse
+import heapq
+import json
+
+from pump_calibration import PumpCalibration, load_calibration
+
+# Default number of motors allowed to run at the same time on the 5V supply
+MAX_RUNNING_PUMPS = 4
+
+
+# Plan the start offset of every pour so that at most max_running motors are
+# on at once, packing them to keep the total pour time (makespan) short.
+# Longest pours are placed first, each on the motor slot that frees up
+# earliest (LPT list scheduling, never more than 4/3 of the optimum).
+# Returns the offsets in the order of durations and the makespan.
+def schedule_pours(durations, max_running=MAX_RUNNING_PUMPS):
+    if max_running < 1:
+        raise ValueError("max_running must be at least 1")
+
+    offsets = [0.0] * len(durations)
+    slots = [0.0] * min(max_running, len(durations))  # Time each slot frees up
+    heapq.heapify(slots)
+    for index in sorted(range(len(durations)), key=lambda i: durations[i], reverse=True):
+        start = heapq.heappop(slots)
+        offsets[index] = start
+        heapq.heappush(slots, start + durations[index])
+    makespan = max((offset + duration for offset, duration in zip(offsets, durations)), default=0.0)
+    return offsets, makespan
+
+
+# Run times of every ingredient of a recipe, using the pump calibration
+def recipe_durations(recipe, calibration):
+    return [calibration[ingredient['motor']].run_time(ingredient['quantity']) for ingredient in recipe['ingredients']]
+
+
+# Print the predicted makespan of every recipe against switching every
+# relay on at once (which is the fastest, but ignores the current budget)
+def report(recipes, calibration, max_running):
+    print(f"{'Cocktail':<30}{'Pumps':>6}{'All at once':>13}{'Scheduled':>11}{'Slowdown':>10}")
+    for cocktail, recipe in recipes.items():
+        durations = recipe_durations(recipe, calibration)
+        baseline = max(durations, default=0.0)
+        _, makespan = schedule_pours(durations, max_running)
+        slowdown = makespan / baseline if baseline else 1.0
+        print(f"{cocktail:<30}{len(durations):>6}{baseline:>12.1f}s{makespan:>10.1f}s{slowdown:>9.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predicted pour times under a limit on motors running at once")
+    parser.add_argument("recipes", help="recipe JSON, e.g. holiday.json")
+    parser.add_argument("--max-running", type=int, default=MAX_RUNNING_PUMPS, help="motors allowed to run at once")
+    parser.add_argument("--flow-rate", type=float, default=1.5, help="mL/second of uncalibrated pumps")
+    parser.add_argument("--calibration", help="pump_calibration.json to use per-pump flow models")
+    args = parser.parse_args()
+
+    with open(args.recipes) as file:
+        recipes = json.load(file)
+
+    motors = {ingredient['motor'] for recipe in recipes.values() for ingredient in recipe['ingredients']}
+    if args.calibration:
+        calibration = load_calibration(args.calibration, motors, args.flow_rate)
+    else:
+        calibration = {motor: PumpCalibration(args.flow_rate) for motor in motors}
+    report(recipes, calibration, args.max_running)
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import heapq
+import threading
+
+from clock import RealClock
+
+
+# One pump run: when it was switched on, when it must be switched off
+# and how late the relay actually went off
+class Pour:
+    def __init__(self, motor_pin, volume, run_time, start_at, clock):
+        self.motor_pin = motor_pin
+        self.volume = volume
+        self.run_time = run_time  # Seconds the relay must stay on
+        self.start_at = start_at  # clock.now() when the relay must go on
+        self.start_time = None  # clock.now() when the relay went on
+        self.deadline = None  # clock.now() when the relay must go off
+        self.end_time = None  # clock.now() when the relay actually went off
+        self.overshoot = None  # end_time - deadline, in seconds
+        self.stopped = False  # True if the pour was cut short by stop_all()
+        self.done = threading.Event()
+        self.clock = clock
+
+    # Wait until the pour is over; with a simulated clock this runs the
+    # simulation up to that point
+    def wait(self, timeout=None):
+        return self.clock.wait(self.done, timeout)
+
+
+# Single scheduler thread that switches the relays on and off at their
+# deadlines. The deadlines live in a min-heap on clock.now() and the
+# thread sleeps until the earliest one (or until a new pour / stop request
+# wakes it up), so any number of running pumps costs one sleeping thread
+# instead of one spinning thread per channel. A pour waiting for its start
+# sits in the heap under its start time, a running one under its deadline.
+#
+# With a simulated clock (see clock.py) there is no thread: the earliest
+# deadline is scheduled on the clock and handled when the simulation
+# reaches it.
+class PumpTimer:
+    def __init__(self, turn_on, turn_off, on_finished=None, clock=None, recorders=(), journal=None):
+        self.turn_on = turn_on  # Called with the motor pin to start the motor
+        self.turn_off = turn_off  # Called with the motor pin to stop the motor
+        self.on_finished = on_finished  # Called with the Pour once it is over
+        self.recorders = recorders  # Get record(pin, on, commanded, actual) of every switching
+        self.journal = journal  # EventJournal of the failed switchings and reports, print() if None
+        self.errors = 0  # Failed switchings and reports
+        self.deadlines = []  # Min-heap of (deadline, sequence, pour)
+        self.sequence = 0  # Tie breaker so equal deadlines never compare pours
+        self.condition = threading.Condition()
+        self.clock = clock or RealClock()
+        self.thread = None
+        if not self.clock.simulated:
+            self.thread = threading.Thread(target=self._run, name="PumpTimer", daemon=True)
+            self.thread.start()
+
+    # Switch a motor on after delay seconds (now by default) and schedule it
+    # to go off run_time seconds after it actually went on
+    def start(self, motor_pin, run_time, volume=None, delay=0.0):
+        with self.condition:
+            pour = Pour(motor_pin, volume, run_time, self.clock.now() + delay, self.clock)
+            if delay <= 0:
+                self._switch_on(pour)
+            else:
+                self._push(pour.start_at, pour)
+            self.condition.notify()
+        return pour
+
+    # Switch every running motor off immediately and drop the pending starts
+    def stop_all(self):
+        with self.condition:
+            stopped = []
+            while self.deadlines:
+                _, _, pour = heapq.heappop(self.deadlines)
+                pour.stopped = True
+                self._finish(pour)
+                stopped.append(pour)
+            self.condition.notify()
+        self._report(stopped)
+
+    # Number of motors currently switched on
+    def active_count(self):
+        with self.condition:
+            return sum(1 for _, _, pour in self.deadlines if pour.start_time is not None)
+
+    def _push(self, when, pour):
+        heapq.heappush(self.deadlines, (when, self.sequence, pour))
+        self.sequence += 1
+        if self.clock.simulated:
+            self.clock.schedule(when, self._simulate)
+
+    # Hand a switching to the recorders; a failing recorder must not stop the
+    # thread that switches the other relays
+    def _record(self, pin, on, commanded, actual):
+        for recorder in self.recorders:
+            try:
+                recorder.record(pin, on, commanded, actual)
+            except Exception:
+                pass
+
+    # An error of a relay or of on_finished: noted and counted, never raised,
+    # so one failing channel cannot keep the other relays from switching off
+    def _error(self, text, pin):
+        self.errors += 1
+        if self.journal:
+            self.journal.error(text, pin)
+        else:
+            print(text)
+
+    def _switch_on(self, pour):
+        try:
+            self.turn_on(pour.motor_pin)
+        except Exception as e:
+            # Still scheduled to go off, in case the relay did switch
+            self._error(f"Relay {pour.motor_pin} failed to switch on: {e}", pour.motor_pin)
+        pour.start_time = self.clock.now()
+        pour.deadline = pour.start_time + pour.run_time
+        self._push(pour.deadline, pour)
+        self._record(pour.motor_pin, True, pour.start_at, pour.start_time)
+
+    def _finish(self, pour):
+        if pour.start_time is None:
+            # Stopped before it was ever switched on
+            pour.start_time = pour.end_time = self.clock.now()
+            pour.overshoot = 0.0
+            return
+        try:
+            self.turn_off(pour.motor_pin)
+        except Exception as e:
+            self._error(f"Relay {pour.motor_pin} failed to switch off: {e}", pour.motor_pin)
+        pour.end_time = self.clock.now()
+        pour.overshoot = pour.end_time - pour.deadline
+        # A stopped pour went off when it was told to
+        commanded = pour.end_time if pour.stopped else pour.deadline
+        self._record(pour.motor_pin, False, commanded, pour.end_time)
+
+    def _report(self, pours):
+        for pour in pours:
+            # Before done is set, so the report of a pour always comes
+            # before whatever its waiter does next
+            try:
+                if self.on_finished:
+                    self.on_finished(pour)
+            except Exception as e:
+                self._error(f"Report of relay {pour.motor_pin} failed: {e}", pour.motor_pin)
+            finally:
+                pour.done.set()
+
+    # Switch on every pending pour whose start time has come and switch off
+    # every motor whose deadline has passed, returns the finished pours
+    def _expire(self):
+        expired = []
+        now = self.clock.now()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, pour = heapq.heappop(self.deadlines)
+            if pour.start_time is None:
+                self._switch_on(pour)
+            else:
+                self._finish(pour)
+                expired.append(pour)
+        return expired
+
+    # Deadline handler of the simulated clock
+    def _simulate(self):
+        with self.condition:
+            expired = self._expire()
+        self._report(expired)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.deadlines:
+                    self.condition.wait()
+
+                timeout = self.deadlines[0][0] - self.clock.now()
+                if timeout > 0:
+                    # Sleep until the earliest deadline or until woken up by
+                    # start() / stop_all(), then look at the heap again
+                    self.condition.wait(timeout)
+                    continue
+
+                expired = self._expire()
+
+            # Report outside the lock so callbacks can start new pours
+            self._report(expired)
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+from collections import namedtuple
+from numbers import Real
+
+from led_patterns import recipe_pattern
+from pump_scheduler import schedule_pours
+
+# One relay of a plan: switch pin on start_offset seconds into the pour and
+# keep it on for run_time seconds to pour volume mL
+PourStep = namedtuple("PourStep", ["motor", "pin", "volume", "start_offset", "run_time"])
+
+# Everything needed to pour one cocktail, built once when the recipes load.
+# led_command is the encoded LED opcode sent when the pour starts.
+RecipePlan = namedtuple("RecipePlan", ["cocktail", "steps", "makespan", "led_command"])
+
+
+class RecipeError(ValueError):
+    pass
+
+
+# Check one recipe and turn it into an immutable RecipePlan
+def compile_recipe(cocktail, recipe, motor_mapping, calibration, max_running):
+    ingredients = recipe.get('ingredients')
+    if not ingredients:
+        raise RecipeError(f"{cocktail}: no ingredients")
+
+    pours = []
+    for ingredient in ingredients:
+        motor = ingredient.get('motor')
+        quantity = ingredient.get('quantity')
+        if motor not in motor_mapping:
+            raise RecipeError(f"{cocktail}: {ingredient.get('name')} uses unknown motor {motor!r}")
+        if not isinstance(quantity, Real) or isinstance(quantity, bool) or quantity <= 0:
+            raise RecipeError(f"{cocktail}: {ingredient.get('name')} has invalid quantity {quantity!r}")
+        if any(motor == other for other, _ in pours):
+            raise RecipeError(f"{cocktail}: motor {motor} is used twice")
+        pours.append((motor, quantity))
+
+    try:
+        led_command = recipe_pattern(cocktail, recipe)
+    except (ValueError, KeyError, TypeError) as e:
+        raise RecipeError(f"{cocktail}: invalid LED pattern ({e})")
+
+    run_times = [calibration[motor].run_time(quantity) for motor, quantity in pours]
+    offsets, makespan = schedule_pours(run_times, max_running)
+    steps = tuple(
+        PourStep(motor, motor_mapping[motor], quantity, offset, run_time)
+        for (motor, quantity), offset, run_time in zip(pours, offsets, run_times)
+    )
+    return RecipePlan(cocktail, steps, makespan, led_command)
+
+
+# Compile every recipe, returns the plans and the error of every refused recipe
+def compile_recipes(recipes, motor_mapping, calibration, max_running):
+    plans = {}
+    errors = {}
+    for cocktail, recipe in recipes.items():
+        try:
+            plans[cocktail] = compile_recipe(cocktail, recipe, motor_mapping, calibration, max_running)
+        except RecipeError as e:
+            errors[cocktail] = e
+    return plans, errors
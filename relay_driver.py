@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Environment variable choosing the relay backend at startup, "gpio" on the
+# Pi (the default) or "sim" to run the pour logic on any machine
+RELAY_BACKEND_VARIABLE = "CBR_RELAY_BACKEND"
+
+# One relay switching of the simulated backend, time is the clock reading
+RelayTransition = namedtuple("RelayTransition", ["pin", "on", "time"])
+
+
+# Switches the pump relays. Pins are board numbers and the relay module is
+# active LOW, which only the GPIO backend needs to know about.
+class RelayDriver:
+    # Configure pins as outputs with every relay off
+    def setup(self, pins):
+        raise NotImplementedError
+
+    def on(self, pin):
+        raise NotImplementedError
+
+    def off(self, pin):
+        raise NotImplementedError
+
+    def on_many(self, pins):
+        for pin in pins:
+            self.on(pin)
+
+    def off_many(self, pins):
+        for pin in pins:
+            self.off(pin)
+
+    # Release the pins, every relay off
+    def cleanup(self):
+        raise NotImplementedError
+
+
+# Relays on the Raspberry Pi header through RPi.GPIO
+class GpioRelayDriver(RelayDriver):
+    def __init__(self):
+        import RPi.GPIO as GPIO  # Only available on the Pi
+        self.GPIO = GPIO
+
+    def setup(self, pins):
+        self.GPIO.setmode(self.GPIO.BOARD)
+        self.GPIO.setwarnings(False)
+        for pin in pins:
+            self.GPIO.setup(pin, self.GPIO.OUT)
+            self.GPIO.output(pin, self.GPIO.HIGH)
+
+    def on(self, pin):
+        self.GPIO.output(pin, self.GPIO.LOW)
+
+    def off(self, pin):
+        self.GPIO.output(pin, self.GPIO.HIGH)
+
+    def on_many(self, pins):
+        self.GPIO.output(list(pins), self.GPIO.LOW)
+
+    def off_many(self, pins):
+        self.GPIO.output(list(pins), self.GPIO.HIGH)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+# In-process relays that record every transition with the time it happened,
+# so pour timing, scheduling and throughput can be measured off the Pi.
+# A batch is switched at one clock reading, like one GPIO.output() call.
+class SimulatedRelayDriver(RelayDriver):
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = {}  # pin -> True while the relay is on
+        self.transitions = []  # RelayTransitions in the order they happened
+
+    def setup(self, pins):
+        with self.lock:
+            for pin in pins:
+                self.state[pin] = False
+
+    def _switch(self, pins, on):
+        with self.lock:
+            now = self.clock()
+            for pin in pins:
+                if pin not in self.state:
+                    raise ValueError(f"relay pin {pin} was not set up")
+                if self.state[pin] != on:
+                    self.state[pin] = on
+                    self.transitions.append(RelayTransition(pin, on, now))
+
+    def on(self, pin):
+        self._switch((pin,), True)
+
+    def off(self, pin):
+        self._switch((pin,), False)
+
+    def on_many(self, pins):
+        self._switch(pins, True)
+
+    def off_many(self, pins):
+        self._switch(pins, False)
+
+    def cleanup(self):
+        self._switch(list(self.state), False)
+
+    def is_on(self, pin):
+        with self.lock:
+            return self.state.get(pin, False)
+
+    # Pins of the relays currently on
+    def running(self):
+        with self.lock:
+            return [pin for pin, on in self.state.items() if on]
+
+    # (on time, off time) of every completed run of pin
+    def runs(self, pin):
+        with self.lock:
+            transitions = [t for t in self.transitions if t.pin == pin]
+        started = None
+        result = []
+        for transition in transitions:
+            if transition.on:
+                started = transition.time
+            elif started is not None:
+                result.append((started, transition.time))
+                started = None
+        return result
+
+
+RELAY_BACKENDS = {
+    "gpio": GpioRelayDriver,
+    "sim": SimulatedRelayDriver,
+}
+
+
+# Driver of the backend named by backend, or by CBR_RELAY_BACKEND
+def create_relay_driver(backend=None):
+    backend = backend or os.environ.get(RELAY_BACKEND_VARIABLE, "gpio")
+    if backend not in RELAY_BACKENDS:
+        raise ValueError(f"unknown relay backend {backend!r}, expected one of {', '.join(RELAY_BACKENDS)}")
+    print(f"Using the {backend} relay backend")
+    return RELAY_BACKENDS[backend]()
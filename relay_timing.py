@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+from array import array
+
+# Histogram bins of the timing error: BIN_WIDTH seconds each, the last bin
+# collects everything later, early switchings go to the first one
+BIN_WIDTH = 0.00025
+BINS = 40
+
+
+# Ring buffer of the last capacity relay switchings as (pin, on, commanded
+# time, actual time), kept in arrays allocated once so recording one is a
+# handful of stores: it runs on the PumpTimer thread right after the relay
+# switched, under the timer lock. Per channel histograms of the timing error
+# (actual - commanded) are updated as switchings are recorded; the skew
+# between channels switched on together is computed from the ring on demand.
+class RelayTimingBuffer:
+    def __init__(self, pins, capacity=4096, bin_width=BIN_WIDTH, bins=BINS):
+        self.pins = list(pins)
+        self.channels = {pin: index for index, pin in enumerate(self.pins)}
+        self.capacity = capacity
+        self.bin_width = bin_width
+        self.bins = bins
+        self.pin = array("i", [0]) * capacity
+        self.on = array("b", [0]) * capacity
+        self.commanded = array("d", [0.0]) * capacity
+        self.actual = array("d", [0.0]) * capacity
+        self.count = 0  # Switchings recorded since the start, the ring holds the last capacity
+        # Error histogram of channel c, on (1) or off (0): bins starting at (2 * c + on) * bins
+        self.histogram = array("L", [0]) * (len(self.pins) * 2 * bins)
+
+    def record(self, pin, on, commanded, actual):
+        i = self.count % self.capacity
+        self.pin[i] = pin
+        self.on[i] = on
+        self.commanded[i] = commanded
+        self.actual[i] = actual
+        self.count += 1
+        slot = int((actual - commanded) / self.bin_width)
+        if slot < 0:
+            slot = 0
+        elif slot >= self.bins:
+            slot = self.bins - 1
+        self.histogram[(2 * self.channels[pin] + on) * self.bins + slot] += 1
+
+    # Recorded switchings, oldest first, as (pin, on, commanded, actual)
+    def records(self):
+        count = self.count
+        first = max(0, count - self.capacity)
+        return [(self.pin[i % self.capacity], bool(self.on[i % self.capacity]), self.commanded[i % self.capacity],
+                 self.actual[i % self.capacity]) for i in range(first, count)]
+
+    # Timing error counts of pin per bin, for switching on or off
+    def error_histogram(self, pin, on=False):
+        start = (2 * self.channels[pin] + on) * self.bins
+        return list(self.histogram[start:start + self.bins])
+
+    # Upper bound in ms of the bin holding the given percentile of errors
+    def error_percentile(self, pin, percentile, on=False):
+        counts = self.error_histogram(pin, on)
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for slot, count in enumerate(counts):
+            seen += count
+            if seen >= total * percentile / 100:
+                return (slot + 1) * self.bin_width * 1000
+        return self.bins * self.bin_width * 1000
+
+    # Histogram per pin of how much later than the first relay of its group a
+    # relay went on, for relays commanded to go on within window seconds of
+    # each other (the pumps of a start_all_motors or of a pour offset)
+    def skew_histograms(self, window=0.001):
+        starts = sorted((commanded, actual, pin) for pin, on, commanded, actual in self.records() if on)
+        histograms = {pin: [0] * self.bins for pin in self.pins}
+        group = []
+        for start in starts + [(float("inf"), 0.0, None)]:
+            if group and start[0] - group[0][0] > window:
+                if len(group) > 1:
+                    first = min(actual for _, actual, _ in group)
+                    for _, actual, pin in group:
+                        slot = min(self.bins - 1, int((actual - first) / self.bin_width))
+                        histograms[pin][slot] += 1
+                group = []
+            group.append(start)
+        return histograms
+
+    # Summary per pin for logs and the metrics: switchings and p50/p99 errors in ms
+    def summary(self):
+        return {
+            pin: {
+                "switchings": sum(self.error_histogram(pin, True)) + sum(self.error_histogram(pin, False)),
+                "on_p50_ms": self.error_percentile(pin, 50, True),
+                "off_p50_ms": self.error_percentile(pin, 50),
+                "off_p99_ms": self.error_percentile(pin, 99),
+            }
+            for pin in self.pins
+        }
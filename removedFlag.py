@@ -8,23 +8,21 @@ from PIL import Image, ImageTk
 import json
 import requests
 from io import BytesIO
-import RPi.GPIO as GPIO
 import time
 import os
 import threading
 import serial
+from relay_driver import create_relay_driver
+from arduino_link import arduino_port
 
 
 # Defining the GPIO pins connected to the relay module
 relay_pins = [26, 21, 19, 15, 13, 11, 7, 5, 31, 33, 35]
 #pump_running = False
 
-# Initialize GPIO setup
-GPIO.setmode(GPIO.BOARD)
-GPIO.setwarnings(False)
-for pin in relay_pins:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.HIGH)
+# Relay driver chosen at startup: RPi.GPIO, or the simulation with CBR_RELAY_BACKEND=sim
+relays = create_relay_driver()
+relays.setup(relay_pins)
 
 # Flow rate of the pump motors in mL/second
 flow_rate = 1.5
@@ -58,7 +56,7 @@ motor_mutex = threading.Lock()
 
 
 try:
-    ser = serial.Serial('/dev/ttyUSB0', 115200) 
+    ser = serial.Serial(arduino_port(), 115200)
 except serial.SerialException:
     ser = None  # Arduino not connected
 
@@ -79,7 +77,7 @@ def send_waiting_command():
 # Function to start a pump motor
 def start_pump(motor_pin, volume):
     run_time = volume / flow_rate  # run time based on volume
-    GPIO.output(motor_pin, GPIO.LOW)  # Turn on the motor
+    relays.on(motor_pin)  # Turn on the motor
     start_time = time.time()  # Record the start time
 
     # Check if the pump operation is still running
@@ -87,7 +85,7 @@ def start_pump(motor_pin, volume):
         pass
 
     end_time = time.time()  # Record the end time
-    GPIO.output(motor_pin, GPIO.HIGH)  # Turn off the motor
+    relays.off(motor_pin)  # Turn off the motor
     elapsed_time = end_time - start_time
     pump_start_times[motor_pin] = start_time  # Record the start time
     pump_end_times[motor_pin] = end_time  # Record the end time
@@ -206,7 +204,7 @@ def make_cocktail(cocktail):
 # Function to stop the cocktail making process
 def stop_pumps():
     global pump_running
-    GPIO.output(relay_pins, GPIO.HIGH)  # Turn off the motor
+    relays.off_many(relay_pins)  # Turn off the motor
     #send_command_to_arduino("WAITING")
     pump_running = False
 
@@ -304,5 +302,5 @@ send_waiting_command()
 # Start the tkinter main loop
 root.mainloop()
 
-# Cleanup GPIO
-GPIO.cleanup()
+# Switch every relay off and release the pins
+relays.cleanup()
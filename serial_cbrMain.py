@@ -7,21 +7,19 @@ from PIL import Image, ImageTk
 import json
 import requests
 from io import BytesIO
-import RPi.GPIO as GPIO
 import time
 import os
 import threading
 import serial
+from relay_driver import create_relay_driver
+from arduino_link import arduino_port
 
 # Defining the GPIO pins connected to the relay module
 relay_pins = [26, 21, 19, 15, 13, 11, 7, 5, 31, 33]
 
-# Initialize GPIO setup
-GPIO.setmode(GPIO.BOARD)
-GPIO.setwarnings(False)
-for pin in relay_pins:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.HIGH)
+# Relay driver chosen at startup: RPi.GPIO, or the simulation with CBR_RELAY_BACKEND=sim
+relays = create_relay_driver()
+relays.setup(relay_pins)
 
 
 # Flow rate of the pump motors in mL/second
@@ -46,7 +44,7 @@ cocktail_start_time = None
 motor_mutex = threading.Lock()
 
 # Define the serial port and baud rate for Arduino communication
-ser = serial.Serial('/dev/ttyUSB0', 115200)  # Update the port as needed
+ser = serial.Serial(arduino_port(), 115200)  # Set CBR_ARDUINO_PORT to use another port
 
 # Function to send commands to the Arduino
 def send_command_to_arduino(command):
@@ -57,14 +55,14 @@ def start_pump(motor_pin, volume):
     run_time = volume / flow_rate  # run time based on volume
     
     try:
-        GPIO.output(motor_pin, GPIO.LOW)  # Turn on the motor
+        relays.on(motor_pin)  # Turn on the motor
         start_time = time.time()  # Record the start time
         time.sleep(run_time)  # Run the motor for the calculated time
         end_time = time.time()  # Record the end time
     except KeyboardInterrupt:
         print("Process interrupted by the user.")
     finally:
-        GPIO.output(motor_pin, GPIO.HIGH)  # Turn off the motor
+        relays.off(motor_pin)  # Turn off the motor
         elapsed_time = end_time - start_time
         pump_start_times[motor_pin] = start_time  # Record the start time
         pump_end_times[motor_pin] = end_time  # Record the end time
@@ -249,5 +247,5 @@ root.grid_columnconfigure(2, weight=1)
 # Start the tkinter main loop
 root.mainloop()
 
-# Cleanup GPIO
-GPIO.cleanup()
+# Switch every relay off and release the pins
+relays.cleanup()
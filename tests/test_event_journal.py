@@ -0,0 +1,99 @@
+import os
+import struct
+
+import pytest
+
+import event_journal
+from event_journal import HEADER, MAGIC, RECORD, EventJournal, read_events, segment_paths
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]  # Wall time the journal sees, set by the tests
+    monkeypatch.setattr(event_journal.time, "time", lambda: now[0])
+    return now
+
+
+def test_events_are_read_back(tmp_path, clock):
+    journal = EventJournal(str(tmp_path))
+    clock[0] = 1001.0
+    journal.log("order", "Mojito")
+    clock[0] = 1002.0
+    journal.log("pour", "Motor 3 done, mL", 21, 40.0)
+    journal.record(21, False, 5.0, 5.002)
+    journal.close()
+
+    events = list(read_events(str(tmp_path)))
+    assert [(e["kind"], e["text"], e["channel"]) for e in events] == [
+        ("order", "Mojito", -1), ("pour", "Motor 3 done, mL", 21), ("relay_off", "", 21)]
+    assert events[1]["value"] == 40.0
+    assert events[2]["value"] == pytest.approx(0.002)
+    assert [e["time"] for e in events] == [1001.0, 1002.0, 1002.0]
+
+
+def test_long_text_is_joined(tmp_path, clock):
+    journal = EventJournal(str(tmp_path), segment_size=RECORD.size * 8)
+    text = "Arduino link down: " + "x" * 100
+    journal.log("message", "first")
+    journal.log("error", text)
+    journal.log("message", "é" * 200)  # Cut after MAX_RECORDS records
+    journal.close()
+
+    events = list(read_events(str(tmp_path)))
+    assert [e["text"] for e in events[:2]] == ["first", text]
+    assert len(events[2]["text"].encode()) <= event_journal.MAX_RECORDS * event_journal.TEXT_SIZE
+    # 7 slots per segment: "first" and the 3 records of the error fill 4,
+    # the 6 records of the last event go to a new segment whole
+    assert len(segment_paths(str(tmp_path))) == 2
+
+
+def test_segments_rotate_and_old_ones_are_removed(tmp_path, clock):
+    journal = EventJournal(str(tmp_path), segment_size=RECORD.size * 5, segments=2)
+    for i in range(20):
+        journal.log("message", f"event {i}")
+    journal.close()
+
+    paths = segment_paths(str(tmp_path))
+    assert [os.path.basename(path) for path in paths] == ["journal-000004.bin", "journal-000005.bin"]
+    assert [e["text"] for e in read_events(str(tmp_path))] == [f"event {i}" for i in range(12, 20)]
+    # A new journal goes on after the newest segment
+    EventJournal(str(tmp_path), segment_size=RECORD.size * 5, segments=2).close()
+    assert os.path.basename(segment_paths(str(tmp_path))[-1]) == "journal-000006.bin"
+
+
+def test_time_range_and_kinds(tmp_path, clock):
+    journal = EventJournal(str(tmp_path), segment_size=RECORD.size * 4)
+    for i in range(10):
+        clock[0] = 2000.0 + i
+        journal.log("order" if i % 2 else "message", f"event {i}")
+    journal.close()
+
+    texts = [e["text"] for e in read_events(str(tmp_path), since=2002.0, until=2006.0)]
+    assert texts == [f"event {i}" for i in range(2, 7)]
+    assert [e["text"] for e in read_events(str(tmp_path), since=2008.5)] == ["event 9"]
+    assert list(read_events(str(tmp_path), until=1999.0)) == []
+    orders = [e["text"] for e in read_events(str(tmp_path), kinds=["order"])]
+    assert orders == [f"event {i}" for i in range(1, 10, 2)]
+
+
+def test_version_1_segments_are_read(tmp_path):
+    old = struct.Struct("<dBxhd44s")
+    data = bytearray(RECORD.size * 4)
+    HEADER.pack_into(data, 0, MAGIC, 1, old.size, 1000.0)
+    old.pack_into(data, RECORD.size, 1001.0, event_journal.EVENT_KINDS["pour"], 21, 30.0, b"Motor 2 done")
+    (tmp_path / "journal-000001.bin").write_bytes(bytes(data))
+
+    events = list(read_events(str(tmp_path)))
+    assert events == [{"time": 1001.0, "kind": "pour", "channel": 21, "value": 30.0, "text": "Motor 2 done"}]
+
+
+def test_log_never_raises(tmp_path):
+    journal = EventJournal(str(tmp_path))
+    journal.log("no such kind", "text")
+    journal.log("message", "wide channel", 2 ** 40)
+    journal.log("message", "bad value", 1, "not a number")
+    journal.close()
+    journal.log("message", "after close")
+
+    assert journal.failed == 2
+    assert [e["channel"] for e in read_events(str(tmp_path))] == [event_journal.CHANNEL_MAX]
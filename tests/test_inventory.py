@@ -0,0 +1,81 @@
+import json
+
+from inventory import BottleInventory
+
+
+def open_inventory(tmp_path, **options):
+    return BottleInventory(str(tmp_path / "bottles.json"), [1, 2], **options)
+
+
+def wal_changes(tmp_path):
+    with open(tmp_path / "bottles.json.wal") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_log_is_replayed_over_the_snapshot(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.refill(1, 700.0)
+    inventory.pour(1, 50.0)
+    inventory.close()  # Crash: never compacted
+
+    assert not (tmp_path / "bottles.json").exists()
+    assert [change["op"] for change in wal_changes(tmp_path)] == ["refill", "pour"]
+    reopened = open_inventory(tmp_path)
+    assert reopened.snapshot() == {1: 650.0, 2: None}
+    assert reopened.sequence == 2
+
+
+def test_changes_in_the_snapshot_are_not_applied_twice(tmp_path):
+    inventory = open_inventory(tmp_path, compact_every=2)
+    inventory.refill(1, 700.0)
+    inventory.pour(1, 50.0)  # Compacts into the snapshot
+    inventory.close()
+    # Crash between writing the snapshot and emptying the log
+    with open(tmp_path / "bottles.json.wal", "w") as file:
+        file.write(json.dumps({"seq": 2, "op": "pour", "motor": 1, "volume": 50.0}) + "\n")
+        file.write(json.dumps({"seq": 3, "op": "pour", "motor": 1, "volume": 25.0}) + "\n")
+
+    reopened = open_inventory(tmp_path)
+    assert reopened.level(1) == 625.0
+    assert reopened.sequence == 3
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    inventory = open_inventory(tmp_path)
+    inventory.refill(2, 500.0)
+    inventory.close()
+    with open(tmp_path / "bottles.json.wal", "a") as file:
+        file.write('{"seq": 2, "op": "pour", "mo')
+
+    reopened = open_inventory(tmp_path)
+    assert reopened.level(2) == 500.0
+    # Opening compacted, so the next change does not follow the torn line
+    assert wal_changes(tmp_path) == []
+    reopened.pour(2, 100.0)
+    reopened.close()
+    assert open_inventory(tmp_path).level(2) == 400.0
+
+
+def test_compaction_empties_the_log(tmp_path):
+    inventory = open_inventory(tmp_path, compact_every=3)
+    inventory.refill(1, 700.0)
+    inventory.pour(1, 100.0)
+    assert len(wal_changes(tmp_path)) == 2
+    inventory.pour(1, 100.0)
+    assert wal_changes(tmp_path) == []
+    with open(tmp_path / "bottles.json") as file:
+        stored = json.load(file)
+    assert stored == {"sequence": 3, "bottles": {"1": {"level": 500.0, "capacity": 700.0}}}
+    inventory.pour(1, 20.0)
+    inventory.close()
+    assert open_inventory(tmp_path).level(1) == 480.0
+
+
+def test_check_reports_short_and_low_bottles(tmp_path):
+    inventory = open_inventory(tmp_path, reserve=30.0)
+    inventory.refill(1, 100.0)
+    short, low = inventory.check({1: 80.0, 2: 1000.0})
+    assert short == []
+    assert low == [(1, 20.0)]
+    short, _ = inventory.check({1: 150.0})
+    assert short == [(1, 150.0, 100.0)]
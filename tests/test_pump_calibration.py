@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from pump_calibration import PumpCalibration, fit_samples, load_calibration, save_calibration
+
+
+def calibrate(samples, flow_rate=1.5):
+    pump = PumpCalibration(flow_rate)
+    for seconds, volume in samples:
+        pump.add_sample(seconds, volume)
+    return pump
+
+
+def test_repeated_run_time_is_averaged():
+    pump = calibrate([(10, 15.0), (10, 15.2)])
+    assert pump.flow_rate == pytest.approx(1.51)
+    assert pump.prime_delay == 0.0
+    assert pump.curve == 0.0
+    assert len(pump.samples) == 2
+
+
+def test_two_run_times_fit_the_priming_delay():
+    pump = calibrate([(5, 6.0), (10, 13.5), (5, 6.0)])
+    assert pump.flow_rate == pytest.approx(1.5)
+    assert pump.prime_delay == pytest.approx(1.0)
+    assert pump.run_time(15.0) == pytest.approx(11.0)
+
+
+def test_three_run_times_stay_a_line():
+    pump = calibrate([(10, 15.0), (20, 29.0), (30, 44.5)])
+    assert pump.curve == 0.0
+    assert pump.flow_rate == pytest.approx(1.475)
+
+
+def test_negative_priming_falls_back_to_the_origin():
+    pump = calibrate([(10, 16.0), (20, 30.0)])
+    assert pump.prime_delay == 0.0
+    assert pump.flow_rate == pytest.approx(76.0 / 50.0)
+
+
+def test_curve_needs_four_run_times_off_the_line():
+    volume = lambda s: 1.6 * (s - 0.5) + 0.02 * (s - 0.5) ** 2
+    assert calibrate([(s, volume(s)) for s in (5, 20, 40)]).curve == 0.0
+    pump = calibrate([(s, volume(s)) for s in (5, 10, 20, 40)])
+    assert pump.flow_rate == pytest.approx(1.6)
+    assert pump.prime_delay == pytest.approx(0.5)
+    assert pump.curve == pytest.approx(0.02)
+    assert pump.volume(pump.run_time(100.0)) == pytest.approx(100.0)
+
+
+def test_curve_pouring_less_for_longer_runs_falls_back_to_a_line():
+    volume = lambda s: 2.0 * s - 0.04 * s * s
+    flow_rate, prime_delay, curve = fit_samples([(s, volume(s)) for s in (5, 10, 15, 20)], 1.5)
+    assert curve == 0.0
+    assert flow_rate > 0
+
+
+def test_noisy_sessions_are_never_refused():
+    noise = random.Random(7)
+    for _ in range(200):
+        pump = calibrate([(s, 1.5 * (s - 0.8) * (1 + noise.gauss(0, 0.01))) for s in (5, 10, 20, 30) * 2])
+        assert pump.curve == 0.0
+        assert pump.run_time(100.0) == pytest.approx(0.8 + 100.0 / 1.5, abs=2.0)
+
+
+def test_bad_sample_is_refused():
+    pump = PumpCalibration(1.5)
+    with pytest.raises(ValueError):
+        pump.add_sample(10, 0.0)
+    assert pump.samples == []
+
+
+def test_old_curve_is_refitted_on_load(tmp_path):
+    path = tmp_path / "calibration.json"
+    save_calibration(str(path), {1: calibrate([(5, 6.0), (10, 13.5)])})
+    path.write_text(path.read_text().replace('"model": 2,', '').replace('"curve": 0.0', '"curve": 0.001'))
+    pump = load_calibration(str(path), [1, 2], 1.5)[1]
+    assert pump.curve == 0.0
+    assert pump.prime_delay == pytest.approx(1.0)
@@ -0,0 +1,84 @@
+from clock import SimulatedClock
+from pump_timer import PumpTimer
+
+
+class Relays:
+    def __init__(self, failing=()):
+        self.failing = failing  # Pins whose relay raises when switched off
+        self.on = set()
+
+    def turn_on(self, pin):
+        self.on.add(pin)
+
+    def turn_off(self, pin):
+        if pin in self.failing:
+            raise OSError(f"pin {pin} stuck")
+        self.on.discard(pin)
+
+
+class Journal:
+    def __init__(self):
+        self.errors = []
+
+    def error(self, text, channel=-1):
+        self.errors.append((text, channel))
+
+
+def test_failing_report_does_not_stop_the_timer():
+    relays = Relays()
+    journal = Journal()
+
+    def report(pour):
+        if pour.motor_pin == 1:
+            raise RuntimeError("report failed")
+
+    timer = PumpTimer(relays.turn_on, relays.turn_off, report, journal=journal)
+    pours = [timer.start(1, 0.01), timer.start(2, 0.01), timer.start(3, 0.1)]
+    for pour in pours:
+        assert pour.wait(2)
+    assert timer.thread.is_alive()
+    assert relays.on == set()
+    assert timer.errors == 1
+    assert journal.errors[0][1] == 1
+
+    # The thread still runs the next pours
+    assert timer.start(4, 0.01).wait(2)
+    assert relays.on == set()
+
+
+def test_failing_relay_does_not_keep_the_others_on():
+    relays = Relays(failing={1})
+    journal = Journal()
+    timer = PumpTimer(relays.turn_on, relays.turn_off, journal=journal)
+    pours = [timer.start(1, 0.01), timer.start(2, 0.01), timer.start(3, 0.1)]
+    for pour in pours:
+        assert pour.wait(2)
+    assert timer.thread.is_alive()
+    assert relays.on == {1}
+    assert [channel for _, channel in journal.errors] == [1]
+
+
+def test_failing_relay_on_simulated_clock():
+    clock = SimulatedClock()
+    relays = Relays(failing={1})
+    finished = []
+    timer = PumpTimer(relays.turn_on, relays.turn_off, finished.append, clock, journal=Journal())
+    pours = [timer.start(1, 5.0), timer.start(2, 5.0, delay=1.0), timer.start(3, 10.0)]
+    for pour in pours:
+        assert pour.wait()
+    assert relays.on == {1}
+    assert finished == pours
+    assert pours[1].end_time == 6.0
+
+
+def test_stop_all_with_failing_report():
+    relays = Relays()
+
+    def report(pour):
+        raise RuntimeError("report failed")
+
+    timer = PumpTimer(relays.turn_on, relays.turn_off, report, journal=Journal())
+    pours = [timer.start(1, 10.0), timer.start(2, 10.0)]
+    timer.stop_all()
+    assert all(pour.done.is_set() and pour.stopped for pour in pours)
+    assert relays.on == set()
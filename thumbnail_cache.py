@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+# Seconds to wait for an image_url before giving up on it
+FETCH_TIMEOUT = 5
+
+
+# On-disk cache of the resized cocktail images. Entries are named after a
+# hash of (source, version, size) where the version is the file mtime for a
+# local imgpath and the ETag (or content hash) for an image_url. Thumbnails
+# are stored as binary PPM, which Tk reads natively without going through
+# PIL, and the least recently used ones are removed once the cache grows
+# over max_bytes. URLs are looked up through index.json, so a warm start
+# never touches the network.
+class ThumbnailCache:
+    def __init__(self, directory, size=(170, 170), max_bytes=20 * 1024 * 1024):
+        self.directory = directory
+        self.size = size
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.index = {}  # "url|WxH" -> key of the cached thumbnail
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as file:
+                    self.index = json.load(file)
+            except ValueError:
+                print("Thumbnail index is damaged, starting a new one")
+
+    # Path of the cached thumbnail of a recipe image, creating it if needed.
+    # The local imgpath wins over image_url, like in load_cocktail_image.
+    # Returns None if neither can be loaded.
+    def thumbnail(self, path=None, url=None):
+        if path and os.path.exists(path):
+            key = self._key(path, os.stat(path).st_mtime_ns)
+            cached = self._lookup(key)
+            if cached:
+                return cached
+            try:
+                with open(path, "rb") as file:
+                    return self._store(key, file.read())
+            except Exception as e:
+                print(f"Error loading image {path}: {e}")
+                return None
+
+        if url:
+            index_key = f"{url}|{self.size[0]}x{self.size[1]}"
+            with self.lock:
+                key = self.index.get(index_key)
+            cached = self._lookup(key) if key else None
+            if cached:
+                return cached
+            try:
+                response = requests.get(url, timeout=FETCH_TIMEOUT)
+                response.raise_for_status()
+                version = response.headers.get("ETag") or hashlib.sha1(response.content).hexdigest()
+                key = self._key(url, version)
+                cached = self._store(key, response.content)
+            except Exception as e:
+                print(f"Error loading image {url}: {e}")
+                return None
+            with self.lock:
+                self.index[index_key] = key
+                self._save_index()
+            return cached
+
+        self._count(hit=False)
+        return None
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _key(self, source, version):
+        return hashlib.sha1(f"{source}|{version}|{self.size[0]}x{self.size[1]}".encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + ".ppm")
+
+    def _lookup(self, key):
+        entry = self._entry_path(key)
+        try:
+            os.utime(entry)  # Mark as recently used for the eviction
+        except FileNotFoundError:
+            return None
+        self._count(hit=True)
+        return entry
+
+    def _store(self, key, data):
+        self._count(hit=False)
+        image = Image.open(BytesIO(data))
+        image.draft("RGB", self.size)  # Let JPEG decode at a reduced scale
+        image = image.convert("RGB").resize(self.size, Image.BILINEAR)
+
+        entry = self._entry_path(key)
+        tmp_path = f"{entry}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, format="PPM")
+        os.replace(tmp_path, entry)
+        self._evict()
+        return entry
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(tmp_path, self.index_path)
+
+    # Remove the least recently used thumbnails until the cache fits max_bytes
+    def _evict(self):
+        with self.lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".ppm"):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(os.path.join(self.directory, name))
+                total -= size
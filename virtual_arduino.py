@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+import argparse
+import os
+import pty
+import random
+import select
+import threading
+import time
+import tty
+
+from led_patterns import CONTROL_OPCODES, PATTERN_OPCODES, PROGRESS_OPCODE
+from led_stream import FRAME_START
+
+PROTOCOL_VERSION = 1
+MAX_LINE_LENGTH = 79  # Same line buffer as waitmode.ino
+MAX_SEGMENTS = 11  # Progress segments of waitmode.ino, ws2812b.ino has 6 (one per LED)
+LINE_TIMEOUT = 1.0  # Seconds of silence after which waitmode.ino takes a partial line
+
+PATTERN_NAMES = {opcode: name for name, opcode in PATTERN_OPCODES.items()}
+LEGACY_OPCODES = {**CONTROL_OPCODES, **PATTERN_OPCODES}
+
+
+def is_hex(text):
+    return all(c in "0123456789abcdefABCDEF" for c in text)
+
+
+# Stand-in for the LED Arduino running waitmode.ino, on the slave side of a
+# pseudo-terminal so ArduinoLink and the GUI scripts open it like the board
+# (set CBR_ARDUINO_PORT to port). It answers the framed protocol, PING and
+# STATS, the LED opcodes and the old full command names with the same
+# replies as the sketch, and counts the binary LED frames it receives.
+#
+# Faults can be injected to measure latency and recovery:
+#   reply_delay / jitter  seconds the board is busy before handling a line
+#   drop_rate             share of the lines lost on the way
+#   read_timeout          take a partial line as complete after this many
+#                         seconds without a byte, like the sketch (1 s); a
+#                         partial framed line is a framing error. None waits
+#                         for the newline
+#   reset()               reboot, dropping input for boot_time then "#READY,1"
+#   stall(seconds)        stop answering, like a hung board
+class VirtualArduino:
+    def __init__(self, reply_delay=0.0, jitter=0.0, drop_rate=0.0, read_timeout=LINE_TIMEOUT, boot_time=0.0,
+                 waiting_mode=True, seed=None):
+        self.reply_delay = reply_delay
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.read_timeout = read_timeout
+        self.boot_time = boot_time
+        self.waiting_mode = waiting_mode  # ws2812b.ino has no WAITING command
+        self.max_segments = MAX_SEGMENTS if waiting_mode else 6
+        self.random = random.Random(seed)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)  # Pass every byte through unchanged, like a USB serial adapter
+        self.port = os.ttyname(self.slave)
+        self.lock = threading.Lock()
+        self.busy_until = 0.0  # time.monotonic() until which nothing is read (boot or stall)
+        self.history = []  # (time.monotonic(), command) of every command run
+        self.state = "off"  # Name of the current LED state
+        self.last_seq = -1
+        self.lines = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.framing_errors = 0
+        self.frames = 0
+        self.resets = 0
+        self.reset_pending = False  # Booting, "#READY,1" is due once busy_until has passed
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="VirtualArduino", daemon=True)
+        self.thread.start()
+        self._write("#READY,1")
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    # Reboot the board, like the DTR reset when the port is reopened
+    def reset(self):
+        with self.lock:
+            self.busy_until = time.monotonic() + self.boot_time
+            self.last_seq = -1
+            self.state = "off"
+            self.resets += 1
+            self.reset_pending = True
+
+    # Stop reading and answering for seconds
+    def stall(self, seconds):
+        with self.lock:
+            self.busy_until = time.monotonic() + seconds
+
+    def _write(self, text):
+        try:
+            os.write(self.master, text.encode() + b"\r\n")
+        except OSError:
+            pass  # Nobody has the port open
+
+    def _run(self):
+        buffer = bytearray()
+        frame = None  # Bytes of the binary LED frame being received
+        last_byte = time.monotonic()
+        while self.running:
+            with self.lock:
+                busy = time.monotonic() < self.busy_until
+                booting = self.reset_pending
+                if booting and not busy:
+                    self.reset_pending = False
+            if booting and not busy:
+                buffer.clear()
+                frame = None
+                self._write("#READY,1")
+            elif busy and not booting:
+                time.sleep(0.005)  # Stalled, the bytes wait in the pty
+                continue
+            readable, _, _ = select.select([self.master], [], [], 0.01)
+            if not readable:
+                if buffer and self.read_timeout is not None and time.monotonic() - last_byte >= self.read_timeout:
+                    self._line(bytes(buffer), partial=True)
+                    buffer.clear()
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                continue
+            if busy:
+                continue  # Booting, the bytes are lost
+            last_byte = time.monotonic()
+            for byte in data:
+                if frame is not None:
+                    frame.append(byte)
+                    if len(frame) >= 3 and len(frame) == frame[1] + 3:
+                        self._frame(frame)
+                        frame = None
+                elif byte == FRAME_START and not buffer:
+                    frame = bytearray()
+                elif byte == ord("\n"):
+                    self._line(bytes(buffer))
+                    buffer.clear()
+                else:
+                    buffer.append(byte)
+
+    # One binary LED frame without its start byte: type, length, payload, checksum
+    def _frame(self, frame):
+        if sum(frame[:-1]) & 0xFF == frame[-1]:
+            self.frames += 1
+            self.state = "stream"
+        else:
+            self.framing_errors += 1
+
+    # One line from the port; partial if it was taken after read_timeout
+    # without its newline
+    def _line(self, raw, partial=False):
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        if len(raw) > MAX_LINE_LENGTH:
+            self.overflows += 1
+            return
+        line = raw.decode(errors="replace").strip()
+        if any(not " " <= c <= "~" for c in line) or (partial and line.startswith("@")):
+            self.framing_errors += 1  # Garbled, or a frame cut short
+            return
+        self.lines += 1
+        delay = self.reply_delay + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+        if line == "PING":
+            self._write("#PONG")
+            return
+        if line == "STATS":
+            self._write(f"#STATS,{self.lines},{self.overflows},{self.framing_errors},{self.frames}")
+            return
+        if line.startswith("@"):
+            parts = line[1:].split(",", 2)
+            if len(parts) < 3 or parts[0] != str(PROTOCOL_VERSION) or not parts[1].isdigit():
+                self.framing_errors += 1
+                self._write("#NAK")
+                return
+            seq = int(parts[1])
+            self._write(f"#ACK,{seq}")
+            if seq == self.last_seq:
+                return
+            self.last_seq = seq
+            line = parts[2]
+        if line:
+            self.history.append((time.monotonic(), line))
+            self._command(line)
+
+    def _command(self, command):
+        if command.startswith("X") and len(command) > 1:
+            if len(command) == 25 and is_hex(command[1:]):
+                self.state = "custom"
+                self._write("Custom LED pattern")
+            else:
+                self._write("Invalid command")
+            return
+        if command.startswith(PROGRESS_OPCODE) and len(command) > 1:
+            fields = command[1:]
+            if len(fields) % 6 == 0 and len(fields) // 6 <= self.max_segments and is_hex(fields):
+                self.state = "progress"
+                self._write("Progress LED pattern")
+            else:
+                self._write("Invalid command")
+            return
+
+        opcode = command if len(command) == 1 else LEGACY_OPCODES.get(command)
+        if opcode in PATTERN_NAMES:
+            self.state = PATTERN_NAMES[opcode]
+            self._write(f"{PATTERN_NAMES[opcode]} LED pattern")
+        elif opcode == "C":
+            self.state = "COMPLETE"
+            self._write("Complete LED pattern")
+        elif opcode == "B":
+            self.state = "BLINK"
+        elif opcode == "F":
+            self.state = "off"
+            self._write("Animation stopped")
+        elif opcode == "W" and self.waiting_mode:
+            self.state = "WAITING"
+            self._write("Waiting Mode")
+        else:
+            self._write("Invalid command")
+
+
+# Round trips of commands through ArduinoLink, then how long the link takes
+# to come back after a reset of the board
+def benchmark(arduino, commands):
+    from arduino_link import ArduinoLink
+
+    link = ArduinoLink(arduino.port)
+    deadline = time.monotonic() + 5
+    while not link.link_up and time.monotonic() < deadline:
+        time.sleep(0.01)
+    opcodes = list(PATTERN_OPCODES.values())
+    for i in range(commands):
+        link.send(opcodes[i % len(opcodes)], coalesce=False)
+        while link.depth():
+            time.sleep(0.001)
+    time.sleep(0.5)
+    result = {"commands": commands, **link.stats()}
+
+    reset_at = time.monotonic()
+    arduino.reset()
+    down = up = None
+    while time.monotonic() - reset_at < 15 and up is None:
+        time.sleep(0.005)
+        if down is None and not link.link_up:
+            down = time.monotonic() - reset_at
+        elif down is not None and link.link_up:
+            up = time.monotonic() - reset_at
+    result["reset_detected_s"] = down
+    result["recovered_s"] = up
+    link.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Virtual LED Arduino on a pseudo-terminal")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each line is handled")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra delay up to this many seconds")
+    parser.add_argument("--drop", type=float, default=0.0, help="share of the lines to lose")
+    parser.add_argument("--read-timeout", type=float, default=LINE_TIMEOUT,
+                        help="take unframed partial lines after this many seconds, 0 waits for the newline")
+    parser.add_argument("--boot-time", type=float, default=1.5, help="seconds a reset takes")
+    parser.add_argument("--benchmark", type=int, metavar="COMMANDS", help="measure round trips and reset recovery")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    arduino = VirtualArduino(args.delay, args.jitter, args.drop, args.read_timeout or None, args.boot_time, seed=args.seed)
+    if args.benchmark:
+        for name, value in benchmark(arduino, args.benchmark).items():
+            print(f"{name}: {value}")
+        arduino.close()
+        return
+
+    print(f"Virtual Arduino on {arduino.port}")
+    print(f"Start the GUI with CBR_ARDUINO_PORT={arduino.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    arduino.close()
+
+
+if __name__ == "__main__":
+    main()
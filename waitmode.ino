@@ -8,84 +8,357 @@ CRGB leds[NUM_LEDS];
 #define GROUP_SIZE 6
 #define ANIMATION_DELAY 100
 #define GLOBAL_BRIGHTNESS 255
-bool isFinished = false;
+#define BLINK_DURATION 60000 // The COMPLETE blink falls back to waitColor after 1 minute
+
+// Framed commands look like "@<version>,<seq>,<COMMAND>" (see arduino_link.py)
+#define PROTOCOL_VERSION 1
+long lastSeq = -1;
+
+// Bytes from the Pi. pollSerial() moves whatever the UART has received into
+// rxRing without waiting and nextLine() assembles complete lines from it in
+// lineBuffer, so reading a command allocates nothing and a half-received
+// line never holds up the animation.
+#define RX_RING_SIZE 64 // Power of two
+#define MAX_LINE_LENGTH 79 // Longest frame is "@1,65535," + a G command for 11 pumps
+uint8_t rxRing[RX_RING_SIZE];
+uint8_t rxHead = 0; // Next byte written by pollSerial()
+uint8_t rxTail = 0; // Next byte read by nextLine()
+char lineBuffer[MAX_LINE_LENGTH + 1];
+uint8_t lineLength = 0;
+bool lineOverflow = false; // The line is longer than lineBuffer, skip it
+bool lineGarbled = false; // The line has control characters, skip it
+unsigned long lineByteTime = 0; // millis() when the last byte of the line arrived
+// ms without a byte before an unframed partial line is taken as complete, like
+// the 1 s Serial.readStringUntil() timeout the old scripts without "\n" rely on
+#define LINE_TIMEOUT 1000
+
+// Binary LED frames rendered by the Pi, "0xFE <type> <length> <payload>
+// <checksum>" (see led_stream.py). They start between two lines and are
+// shown as soon as their checksum matches.
+#define FRAME_START 0xFE
+#define FRAME_TIMEOUT 20 // ms without a byte before a partial frame is dropped
+enum FrameState { FRAME_NONE, FRAME_TYPE, FRAME_LENGTH, FRAME_PAYLOAD, FRAME_CHECKSUM };
+FrameState frameState = FRAME_NONE;
+uint8_t frameType;
+uint8_t frameLength;
+uint8_t frameReceived;
+uint8_t frameSum;
+uint8_t frameBuffer[NUM_LEDS * 3]; // A key frame, the Pi never sends a longer one
+unsigned long frameByteTime = 0;
+
+// Link quality, sent as "#STATS,<lines>,<overflows>,<framing errors>,<frames>"
+// when the Pi asks with a "STATS" line
+unsigned long rxLines = 0;
+unsigned long rxOverflows = 0; // Lines dropped for being too long
+unsigned long framingErrors = 0; // Garbled lines, malformed frames and bad LED frames
+unsigned long streamFrames = 0; // LED frames shown
+
+// What loop() is currently animating. Commands only switch the mode, the
+// frames are drawn from loop() every frameDelay ms using millis(), so
+// nothing ever blocks or recurses and a new command shows up within a frame.
+enum Mode { MODE_IDLE, MODE_MOVE, MODE_BLINK, MODE_PROGRESS };
+Mode mode = MODE_IDLE;
+unsigned long lastFrameTime = 0;
 unsigned long animationStartTime = 0;
 
+// Parameters of one moving pattern: the strip is filled with fill, then a
+// group of fg LEDs moves back and forth every speed ms leaving trail behind
+struct Pattern {
+  char opcode;
+  char name[11];
+  uint8_t fill[3];
+  uint8_t trail[3];
+  uint8_t fg[3];
+  uint8_t groupSize;
+  uint16_t speed;
+};
+
+// Built-in patterns, kept in flash. The opcodes match PATTERN_OPCODES in
+// led_patterns.py; anything else can be sent as an "X" command.
+const Pattern PATTERNS[] PROGMEM = {
+  { 'A', "ADIOS", { 0, 255, 255 }, { 255, 0, 0 }, { 0, 255, 255 }, GROUP_SIZE, ANIMATION_DELAY },          // Ocean blue
+  { 'L', "LONGISLAND", { 139, 69, 19 }, { 255, 0, 0 }, { 139, 69, 19 }, GROUP_SIZE, ANIMATION_DELAY },     // Brownish yellow
+  { 'P', "PEACHCRUSH", { 139, 69, 19 }, { 255, 0, 0 }, { 0, 255, 0 }, GROUP_SIZE, ANIMATION_DELAY },     // Green on brownish yellow
+  { 'M', "MIDORISOUR", { 255, 140, 0 }, { 255, 0, 0 }, { 0, 255, 0 }, GROUP_SIZE, ANIMATION_DELAY },       // Green on orange
+  { 'V', "ALLMOTORS", { 148, 0, 211 }, { 0, 128, 0 }, { 148, 0, 211 }, GROUP_SIZE, ANIMATION_DELAY },      // Violet
+  { 'N', "PUMPNUMBER", { 0, 0, 255 }, { 0, 128, 0 }, { 0, 0, 255 }, GROUP_SIZE, ANIMATION_DELAY },         // Blue
+};
+#define NUM_PATTERNS (sizeof(PATTERNS) / sizeof(PATTERNS[0]))
+
+// Index into PATTERNS of every opcode 'A'..'Z', -1 for the unused letters,
+// so a command is dispatched with one array lookup
+int8_t patternIndex[26];
+
+unsigned int frameDelay = ANIMATION_DELAY; // ms between two frames of the current mode
+
+// State of the moving group animation
+CRGB moveBgColor;
+CRGB moveFgColor;
+int moveGroupSize = GROUP_SIZE;
+int movePosition = 0;
+int moveDirection = 1;
+
+// State of the pour progress bar: the strip is cut into one segment per
+// pump and segment i fills up from segmentStart[i] for segmentLength[i]
+// (both in 100 ms after progressStartTime), computed from millis() so the
+// bar keeps moving smoothly without any message from the Pi
+#define MAX_SEGMENTS 11
+#define PROGRESS_DELAY 40
+uint16_t segmentStart[MAX_SEGMENTS];
+uint16_t segmentLength[MAX_SEGMENTS];
+uint8_t segmentCount = 0;
+unsigned long progressStartTime = 0;
+
+// Colour of each segment, one per pump of the pour
+const uint8_t SEGMENT_COLORS[MAX_SEGMENTS][3] PROGMEM = {
+  { 0, 255, 255 }, { 255, 140, 0 }, { 0, 255, 0 }, { 148, 0, 211 }, { 255, 0, 0 }, { 0, 0, 255 },
+  { 255, 229, 100 }, { 255, 0, 255 }, { 139, 69, 19 }, { 255, 255, 255 }, { 0, 128, 128 },
+};
+
+// State of the blink animation
+bool isWhite = true;
+bool blinkTimeout = false;
+
 void setup() {
   FastLED.addLeds<WS2812, LED_PIN, GRB>(leds, NUM_LEDS);
   FastLED.setMaxPowerInVoltsAndMilliamps(5, 1000);
   FastLED.setBrightness(255);
+  for (int i = 0; i < 26; i++) {
+    patternIndex[i] = -1;
+  }
+  for (uint8_t i = 0; i < NUM_PATTERNS; i++) {
+    patternIndex[pgm_read_byte(&PATTERNS[i].opcode) - 'A'] = i;
+  }
   Serial.begin(115200);
+  Serial.print("#READY,"); // Tell the Pi the board has (re)started
+  Serial.println(PROTOCOL_VERSION);
   FastLED.clear();
   FastLED.show();
 }
 
 void waitColor() {
-  CRGB yellow_color(255, 229, 100); 
+  CRGB yellow_color(255, 229, 100);
   fill_solid(leds, NUM_LEDS, yellow_color);
   FastLED.show();
 }
 
-void blinkAnimation() {
-  static bool isWhite = true;
-  while (!isFinished) {
-    if (isWhite) {
-      fill_solid(leds, NUM_LEDS, CRGB::White);
-    } else {
-      fill_solid(leds, NUM_LEDS, CRGB::Green);
+// Copy a complete LED frame to the strip, false if it does not fit it
+bool applyFrame() {
+  if (frameType == 'K') {
+    if (frameLength != NUM_LEDS * 3) {
+      return false;
     }
-    FastLED.show();
-    isWhite = !isWhite;
-    delay(ANIMATION_DELAY);
-    
-    if (millis() - animationStartTime >= 60000) {
-      // 1 minute has passed, break out of the animation loop
-      isFinished = true;
+    for (int i = 0; i < NUM_LEDS; i++) {
+      leds[i] = CRGB(frameBuffer[3 * i + 1], frameBuffer[3 * i], frameBuffer[3 * i + 2]);
+    }
+  } else if (frameType == 'R' || frameType == 'D') {
+    // Runs of (count, G, R, B) covering the strip, or changed (index, G, R, B)
+    if (frameLength % 4 != 0) {
+      return false;
+    }
+    int total = 0;
+    for (uint8_t i = 0; i < frameLength; i += 4) {
+      if (frameType == 'D' && frameBuffer[i] >= NUM_LEDS) {
+        return false;
+      }
+      total += frameBuffer[i];
+    }
+    if (frameType == 'R' && total != NUM_LEDS) {
+      return false;
+    }
+    int position = 0;
+    for (uint8_t i = 0; i < frameLength; i += 4) {
+      CRGB color(frameBuffer[i + 2], frameBuffer[i + 1], frameBuffer[i + 3]);
+      if (frameType == 'D') {
+        leds[frameBuffer[i]] = color;
+      } else {
+        for (uint8_t j = 0; j < frameBuffer[i]; j++) {
+          leds[position++] = color;
+        }
+      }
+    }
+  } else {
+    return false;
+  }
+  mode = MODE_IDLE; // The Pi animates, stop the local animation
+  FastLED.show();
+  return true;
+}
+
+// Feed one byte of an LED frame to its parser
+void frameByte(uint8_t c) {
+  frameByteTime = millis();
+  switch (frameState) {
+    case FRAME_TYPE:
+      frameType = c;
+      frameSum = c;
+      frameState = FRAME_LENGTH;
+      break;
+    case FRAME_LENGTH:
+      frameLength = c;
+      frameSum += c;
+      frameReceived = 0;
+      if (frameLength > sizeof(frameBuffer)) {
+        framingErrors++;
+        frameState = FRAME_NONE;
+      } else {
+        frameState = frameLength > 0 ? FRAME_PAYLOAD : FRAME_CHECKSUM;
+      }
+      break;
+    case FRAME_PAYLOAD:
+      frameBuffer[frameReceived++] = c;
+      frameSum += c;
+      if (frameReceived == frameLength) {
+        frameState = FRAME_CHECKSUM;
+      }
+      break;
+    case FRAME_CHECKSUM:
+      frameState = FRAME_NONE;
+      if (c == frameSum && applyFrame()) {
+        streamFrames++;
+      } else {
+        framingErrors++;
+      }
+      break;
+    default:
+      frameState = FRAME_NONE;
+  }
+}
+
+// Move the bytes received so far into rxRing. When the ring is full the
+// rest stays in the UART buffer until nextLine() has made room.
+void pollSerial() {
+  if (frameState != FRAME_NONE && millis() - frameByteTime > FRAME_TIMEOUT) {
+    framingErrors++; // Bytes of the frame were lost, wait for the next one
+    frameState = FRAME_NONE;
+  }
+  while (Serial.available() > 0) {
+    uint8_t next = (rxHead + 1) & (RX_RING_SIZE - 1);
+    if (next == rxTail) {
+      return;
     }
-    
-    if (Serial.available() > 0) {
-      String command = Serial.readStringUntil('\n'); 
-      command.trim();
-      if (command == "FINISHED") {
-        stopAnimation();
-      } else if (command == "ADIOS") {
-        setColor(CRGB(0, 255, 255)); // Set the background color (Ocean blue)
-        moveAnimation(CRGB::Red, CRGB(0, 255, 255), GROUP_SIZE); // Move green LEDs on Ocean blue background
-        Serial.println("ADIOS LED pattern");
-      } else if (command == "LONGISLAND") {
-        setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-        moveAnimation(CRGB::Red, CRGB(139, 69, 19), GROUP_SIZE); // Move green LEDs on Brownish Yellow background
-        Serial.println("Long Island Ice Tea LED pattern");
-      } else if (command == "PEACHCRUSH") {
-        setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-        moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-        Serial.println("Peach Crush LED pattern");
-      } else if (command == "MIDORISOUR") {
-        setColor(CRGB(255, 140, 0)); // Set the background color (Orange)
-        moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-        Serial.println("Midori Sour LED pattern");
-      } else if (command == "ALLMOTORS") {
-        setColor(CRGB(148, 0, 211)); // Set the background color (Violet)
-        moveAnimation(CRGB::Green, CRGB(148, 0, 211), GROUP_SIZE); // Move green LEDs on Violet background
-        Serial.println("ALLMOTORS LED pattern");
-      } else if (command == "PUMPNUMBER") {
-        setColor(CRGB(0, 0, 255)); // Set the background color (Blue)
-        moveAnimation(CRGB::Green, CRGB(0, 0, 255), GROUP_SIZE); // Move green LEDs on Blue background
-        Serial.println("PUMPNUMBER LED pattern");
-      } else if (command == "COMPLETE") {
-        animationStartTime = millis(); // Record the start time of the animation
-        blinkAnimation();
-        waitColor();
-        Serial.println("Complete LED pattern");
-      } else if (command == "WAITING") {
-        waitColor();
-        Serial.println("Waiting Mode");
+    rxRing[rxHead] = Serial.read();
+    rxHead = next;
+  }
+}
+
+// End the line in lineBuffer, returns it or NULL if it is dropped
+char *endLine() {
+  while (lineLength > 0 && (lineBuffer[lineLength - 1] == ' ' || lineBuffer[lineLength - 1] == '\r')) {
+    lineLength--;
+  }
+  lineBuffer[lineLength] = '\0';
+  lineLength = 0;
+  bool overflow = lineOverflow;
+  bool garbled = lineGarbled;
+  lineOverflow = false;
+  lineGarbled = false;
+  if (overflow) {
+    rxOverflows++;
+  } else if (garbled) {
+    framingErrors++;
+  } else {
+    rxLines++;
+    return lineBuffer;
+  }
+  return NULL;
+}
+
+// Next complete line from rxRing without the surrounding whitespace, NULL
+// until its newline has arrived. An unframed line sent without a newline is
+// taken after LINE_TIMEOUT ms of silence; a framed one ("@...") always ends
+// with a newline, so a partial one is dropped then. Overlong and garbled
+// lines are counted and dropped whole. LED frames on the way are shown as
+// they complete.
+char *nextLine() {
+  while (rxTail != rxHead) {
+    char c = rxRing[rxTail];
+    rxTail = (rxTail + 1) & (RX_RING_SIZE - 1);
+    if (frameState != FRAME_NONE) {
+      frameByte(c);
+    } else if ((uint8_t)c == FRAME_START && lineLength == 0 && !lineOverflow && !lineGarbled) {
+      frameState = FRAME_TYPE;
+      frameByteTime = millis();
+    } else if (c == '\n') {
+      char *line = endLine();
+      if (line != NULL) {
+        return line;
+      }
+    } else {
+      lineByteTime = millis();
+      if (lineLength == 0 && c == ' ') {
+        // Leading whitespace
+      } else if (c != '\r' && (c < ' ' || c > '~')) {
+        lineGarbled = true;
+      } else if (lineLength == MAX_LINE_LENGTH) {
+        lineOverflow = true;
       } else {
-        Serial.println("Invalid command");
+        lineBuffer[lineLength++] = c;
       }
     }
   }
-  animationStartTime = 0; // Reset animation start time
+  if ((lineLength > 0 || lineOverflow || lineGarbled) && millis() - lineByteTime >= LINE_TIMEOUT) {
+    if (lineBuffer[0] == '@') {
+      lineGarbled = true; // A frame cut short
+    }
+    return endLine();
+  }
+  return NULL;
+}
+
+void sendStats() {
+  Serial.print("#STATS,");
+  Serial.print(rxLines);
+  Serial.print(',');
+  Serial.print(rxOverflows);
+  Serial.print(',');
+  Serial.print(framingErrors);
+  Serial.print(',');
+  Serial.println(streamFrames);
+}
+
+// Read one command. Framed commands are acknowledged with "#ACK,<seq>"
+// before they run; plain "COMMAND" lines are still accepted. Returns NULL
+// while no complete line has arrived, and an empty string for a heartbeat,
+// a stats request, a malformed frame or a repeated sequence number (a retry
+// whose ack was lost), which handleCommand() skips.
+const char *readCommand() {
+  char *line = nextLine();
+  if (line == NULL) {
+    return NULL;
+  }
+  if (strcmp(line, "PING") == 0) {
+    Serial.println("#PONG"); // Heartbeat from the Pi
+    return "";
+  }
+  if (strcmp(line, "STATS") == 0) {
+    sendStats();
+    return "";
+  }
+  if (line[0] != '@') {
+    return line;
+  }
+  char *end;
+  long seq = -1;
+  if (strtol(line + 1, &end, 10) == PROTOCOL_VERSION && *end == ',') {
+    char *seqStart = end + 1;
+    seq = strtol(seqStart, &end, 10);
+    if (end == seqStart || *end != ',') {
+      seq = -1;
+    }
+  }
+  if (seq < 0) {
+    framingErrors++;
+    Serial.println("#NAK");
+    return "";
+  }
+  Serial.print("#ACK,");
+  Serial.println(seq);
+  if (seq == lastSeq) {
+    return "";
+  }
+  lastSeq = seq;
+  return end + 1;
 }
 
 void setColor(CRGB color) {
@@ -96,167 +369,254 @@ void setColor(CRGB color) {
 }
 
 void stopAnimation() {
-  isFinished = true;
+  mode = MODE_IDLE;
   FastLED.clear(); // Turn off all LEDs
   FastLED.show();
   Serial.println("Animation stopped");
 }
 
-void moveAnimation(CRGB bgColor, CRGB fgColor, int groupSize) {
-  while (!isFinished) {
-    // Left to right animation
-    for (int i = 0; i <= NUM_LEDS - groupSize && !isFinished; i++) {
-      for (int j = 0; j < groupSize; j++) {
-        leds[i + j] = fgColor;
-      }
-      FastLED.show();
-      delay(ANIMATION_DELAY);
-      for (int j = 0; j < groupSize; j++) {
-        leds[i + j] = bgColor;
-      }
-      if (Serial.available() > 0) {
-        String command = Serial.readStringUntil('\n'); // Read until newline character
-        command.trim(); // Remove leading/trailing whitespace
-        if (command == "FINISHED") {
-          stopAnimation();
-        } else if (command == "ADIOS") {
-          setColor(CRGB(0, 255, 255)); // Set the background color (Ocean blue)
-          moveAnimation(CRGB::Red, CRGB(0, 255, 255), GROUP_SIZE); // Move green LEDs on Ocean blue background
-          Serial.println("ADIOS LED pattern");
-        } else if (command == "LONGISLAND") {
-          setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-          moveAnimation(CRGB::Red, CRGB(139, 69, 19), GROUP_SIZE); // Move green LEDs on Brownish Yellow background
-          Serial.println("Long Island Ice Tea LED pattern");
-        } else if (command == "PEACHCRUSH") {
-          setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-          moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-          Serial.println("Peach Crush LED pattern");
-        } else if (command == "MIDORISOUR") {
-          setColor(CRGB(255, 140, 0)); // Set the background color (Orange)
-          moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-          Serial.println("Midori Sour LED pattern");
-        } else if (command == "ALLMOTORS") {
-          setColor(CRGB(148, 0, 211)); // Set the background color (Violet)
-          moveAnimation(CRGB::Green, CRGB(148, 0, 211), GROUP_SIZE); // Move green LEDs on Violet background
-          Serial.println("ALLMOTORS LED pattern");
-        } else if (command == "PUMPNUMBER") {
-          setColor(CRGB(0, 0, 255)); // Set the background color (Blue)
-          moveAnimation(CRGB::Green, CRGB(0, 0, 255), GROUP_SIZE); // Move green LEDs on Blue background
-          Serial.println("PUMPNUMBER LED pattern");
-
-        } else if (command == "COMPLETE") {
-          animationStartTime = millis(); // Record the start time of the animation
-          blinkAnimation();
-          waitColor();
-          Serial.println("Complete LED pattern");
-        } else if (command == "WAITING") {
-          waitColor();
-          Serial.println("Waiting Mode");
-        } else {
-          Serial.println("Invalid command");
-        }
-      }
+// Start moving a group of fgColor LEDs back and forth, leaving bgColor behind
+void startMove(CRGB bgColor, CRGB fgColor, int groupSize, unsigned int speed) {
+  moveBgColor = bgColor;
+  moveFgColor = fgColor;
+  moveGroupSize = constrain(groupSize, 1, NUM_LEDS - 1);
+  movePosition = 0;
+  moveDirection = 1;
+  frameDelay = speed;
+  mode = MODE_MOVE;
+  lastFrameTime = millis() - frameDelay; // Draw the first frame right away
+}
+
+// Start the built-in pattern number index of PATTERNS
+void startPattern(uint8_t index) {
+  Pattern pattern;
+  memcpy_P(&pattern, &PATTERNS[index], sizeof(Pattern));
+  setColor(CRGB(pattern.fill[0], pattern.fill[1], pattern.fill[2]));
+  startMove(CRGB(pattern.trail[0], pattern.trail[1], pattern.trail[2]), CRGB(pattern.fg[0], pattern.fg[1], pattern.fg[2]), pattern.groupSize, pattern.speed);
+  Serial.print(pattern.name);
+  Serial.println(" LED pattern");
+}
+
+// Value of count hex digits, -1 if one of them is not a hex digit
+long parseHex(const char *text, uint8_t count) {
+  long value = 0;
+  for (uint8_t i = 0; i < count; i++) {
+    char c = text[i];
+    value <<= 4;
+    if (c >= '0' && c <= '9') {
+      value |= c - '0';
+    } else if (c >= 'A' && c <= 'F') {
+      value |= c - 'A' + 10;
+    } else if (c >= 'a' && c <= 'f') {
+      value |= c - 'a' + 10;
+    } else {
+      return -1;
     }
+  }
+  return value;
+}
 
-    // Right to left animation
-    for (int i = NUM_LEDS - groupSize - 1; i >= 0 && !isFinished; i--) {
-      for (int j = 0; j < groupSize; j++) {
-        leds[i + j] = fgColor;
-      }
-      FastLED.show();
-      delay(ANIMATION_DELAY);
-      for (int j = 0; j < groupSize; j++) {
-        leds[i + j] = bgColor;
-      }
-      if (Serial.available() > 0) {
-        String command = Serial.readStringUntil('\n'); // Read until newline character
-        command.trim(); // Remove leading/trailing whitespace
-        if (command == "FINISHED") {
-          stopAnimation();
-        } else if (command == "ADIOS") {
-          setColor(CRGB(0, 255, 255)); // Set the background color (Ocean blue)
-          moveAnimation(CRGB::Red, CRGB(0, 255, 255), GROUP_SIZE); // Move green LEDs on Ocean blue background
-          Serial.println("ADIOS LED pattern");
-        } else if (command == "LONGISLAND") {
-          setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-          moveAnimation(CRGB::Red, CRGB(139, 69, 19), GROUP_SIZE); // Move green LEDs on Brownish Yellow background
-          Serial.println("Long Island Ice Tea LED pattern");
-        } else if (command == "PEACHCRUSH") {
-          setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-          moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-          Serial.println("Peach Crush LED pattern");
-        } else if (command == "MIDORISOUR") {
-          setColor(CRGB(255, 140, 0)); // Set the background color (Orange)
-          moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-          Serial.println("Midori Sour LED pattern");
-        } else if (command == "ALLMOTORS") {
-          setColor(CRGB(148, 0, 211)); // Set the background color (Violet)
-          moveAnimation(CRGB::Green, CRGB(148, 0, 211), GROUP_SIZE); // Move green LEDs on Violet background
-          Serial.println("ALLMOTORS LED pattern");
-        } else if (command == "PUMPNUMBER") {
-          setColor(CRGB(0, 0, 255)); // Set the background color (Blue)
-          moveAnimation(CRGB::Green, CRGB(0, 0, 255), GROUP_SIZE); // Move green LEDs on Blue background
-          Serial.println("PUMPNUMBER LED pattern");
-        } else if (command == "COMPLETE") {
-          animationStartTime = millis(); // Record the start time of the animation
-          blinkAnimation();
-          waitColor();
-          Serial.println("Complete LED pattern");
-
-        } else if (command == "WAITING") {
-          waitColor();
-          Serial.println("Waiting Mode");
-        } else {
-          Serial.println("Invalid command");
-        }
-      }
+// Start a pattern sent by the Pi as "X" + fill, trail and fg as 6 hex digits
+// each + group size as 2 and speed in ms as 4 hex digits (25 characters)
+bool startCustomPattern(const char *command) {
+  if (strlen(command) != 25) {
+    return false;
+  }
+  long fill = parseHex(command + 1, 6);
+  long trail = parseHex(command + 7, 6);
+  long fg = parseHex(command + 13, 6);
+  long groupSize = parseHex(command + 19, 2);
+  long speed = parseHex(command + 21, 4);
+  if (fill < 0 || trail < 0 || fg < 0 || groupSize < 1 || speed < 10) {
+    return false;
+  }
+  setColor(CRGB((fill >> 16) & 0xFF, (fill >> 8) & 0xFF, fill & 0xFF));
+  startMove(CRGB((trail >> 16) & 0xFF, (trail >> 8) & 0xFF, trail & 0xFF), CRGB((fg >> 16) & 0xFF, (fg >> 8) & 0xFF, fg & 0xFF), groupSize, speed);
+  Serial.println("Custom LED pattern");
+  return true;
+}
+
+// Opcode of an old style command name, 0 if unknown
+char legacyOpcode(const char *command) {
+  if (strcmp(command, "COMPLETE") == 0) return 'C';
+  if (strcmp(command, "FINISHED") == 0) return 'F';
+  if (strcmp(command, "WAITING") == 0) return 'W';
+  if (strcmp(command, "BLINK") == 0) return 'B';
+  for (uint8_t i = 0; i < NUM_PATTERNS; i++) {
+    if (strcmp_P(command, PATTERNS[i].name) == 0) {
+      return pgm_read_byte(&PATTERNS[i].opcode);
     }
   }
+  return 0;
 }
 
-void loop() {
-  if (Serial.available() > 0) {
-    String command = Serial.readStringUntil('\n'); // Read until newline character
-    command.trim(); 
-
-    if (command == "BLINK") {
-      blinkAnimation();
-    } else if (command == "ADIOS") {
-      setColor(CRGB(0, 255, 255)); // Set the background color (Ocean blue)
-      moveAnimation(CRGB::Red, CRGB(0, 255, 255), GROUP_SIZE); // Move green LEDs on Ocean blue background
-      Serial.println("ADIOS LED pattern");
-    } else if (command == "LONGISLAND") {
-      setColor(CRGB(139, 69, 19)); // Set the background color (Brownish Yellow)
-      moveAnimation(CRGB::Red, CRGB(139, 69, 19), GROUP_SIZE); // Move green LEDs on Brownish Yellow background
-      Serial.println("Long Island Ice Tea LED pattern");
-    } else if (command == "PEACHCRUSH") {
-      setColor(CRGB(139, 69, 19)); 
-      moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-      Serial.println("Peach Crush LED pattern");
-    } else if (command == "MIDORISOUR") {
-      setColor(CRGB(255, 140, 0)); // Set the background color (Orange)
-      moveAnimation(CRGB::Red, CRGB(0, 255, 0), GROUP_SIZE); // Move green LEDs on Green background
-      Serial.println("Midori Sour LED pattern");
-    } else if (command == "ALLMOTORS") {
-      setColor(CRGB(148, 0, 211)); // Set the background color (Violet)
-      moveAnimation(CRGB::Green, CRGB(148, 0, 211), GROUP_SIZE); // Move green LEDs on Violet background
-      Serial.println("ALLMOTORS LED pattern");
-    } else if (command == "PUMPNUMBER") {
-      setColor(CRGB(0, 0, 255)); // Set the background color (Blue)
-      moveAnimation(CRGB::Green, CRGB(0, 0, 255), GROUP_SIZE); // Move green LEDs on Blue background
-      Serial.println("PUMPNUMBER LED pattern");
-    } else if (command == "COMPLETE") {
-      animationStartTime = millis(); // Record the start time of the animation
-      blinkAnimation();
-      waitColor();
+// Start alternating white and green, optionally falling back to waitColor
+void startBlink(bool timeout) {
+  isWhite = true;
+  blinkTimeout = timeout;
+  animationStartTime = millis(); // Record the start time of the animation
+  mode = MODE_BLINK;
+  frameDelay = ANIMATION_DELAY;
+  lastFrameTime = millis() - frameDelay; // Draw the first frame right away
+}
+
+// Start the progress bar of a "G" command, false if it is malformed
+bool startProgress(const char *command) {
+  uint8_t length = strlen(command + 1);
+  if (length == 0 || length % 6 != 0 || length / 6 > MAX_SEGMENTS) {
+    return false;
+  }
+  uint8_t count = length / 6;
+  for (uint8_t i = 0; i < count; i++) {
+    long start = parseHex(command + 1 + 6 * i, 3);
+    long duration = parseHex(command + 4 + 6 * i, 3);
+    if (start < 0 || duration < 0) {
+      return false;
+    }
+    segmentStart[i] = start;
+    segmentLength[i] = duration;
+  }
+  segmentCount = count;
+  progressStartTime = millis();
+  mode = MODE_PROGRESS;
+  frameDelay = PROGRESS_DELAY;
+  lastFrameTime = millis() - frameDelay; // Draw the first frame right away
+  Serial.println("Progress LED pattern");
+  return true;
+}
+
+void moveFrame() {
+  for (int j = 0; j < moveGroupSize; j++) {
+    leds[movePosition + j] = moveFgColor;
+  }
+  FastLED.show();
+  for (int j = 0; j < moveGroupSize; j++) {
+    leds[movePosition + j] = moveBgColor; // Shown with the next frame
+  }
+
+  // Left to right, then right to left
+  if (moveDirection > 0) {
+    if (movePosition >= NUM_LEDS - moveGroupSize) {
+      moveDirection = -1;
+      movePosition = NUM_LEDS - moveGroupSize - 1;
+    } else {
+      movePosition++;
+    }
+  } else {
+    if (movePosition <= 0) {
+      moveDirection = 1;
+      movePosition = 0;
+    } else {
+      movePosition--;
+    }
+  }
+}
+
+void blinkFrame() {
+  if (blinkTimeout && millis() - animationStartTime >= BLINK_DURATION) {
+    // 1 minute has passed, go back to the waiting colour
+    mode = MODE_IDLE;
+    waitColor();
+    return;
+  }
+  if (isWhite) {
+    fill_solid(leds, NUM_LEDS, CRGB::White);
+  } else {
+    fill_solid(leds, NUM_LEDS, CRGB::Green);
+  }
+  FastLED.show();
+  isWhite = !isWhite;
+}
+
+void progressFrame() {
+  unsigned long elapsed = millis() - progressStartTime;
+  for (uint8_t i = 0; i < segmentCount; i++) {
+    int first = i * NUM_LEDS / segmentCount;
+    int size = (i + 1) * NUM_LEDS / segmentCount - first;
+    unsigned long start = segmentStart[i] * 100UL;
+    unsigned long duration = segmentLength[i] * 100UL;
+    // Lit part of the segment in 1/256 of an LED
+    unsigned long lit;
+    if (elapsed <= start) {
+      lit = 0;
+    } else if (elapsed >= start + duration) {
+      lit = size * 256UL;
+    } else {
+      lit = (elapsed - start) * size * 256UL / duration;
+    }
+    uint8_t red = pgm_read_byte(&SEGMENT_COLORS[i][0]);
+    uint8_t green = pgm_read_byte(&SEGMENT_COLORS[i][1]);
+    uint8_t blue = pgm_read_byte(&SEGMENT_COLORS[i][2]);
+    for (int j = 0; j < size; j++) {
+      long level = constrain((long)lit - j * 256L, 0L, 255L); // The LED at the tip is dimmed
+      leds[first + j] = CRGB(red * level / 255, green * level / 255, blue * level / 255);
+    }
+  }
+  FastLED.show();
+}
+
+// Switch to the state asked for by one command: a one-character opcode,
+// an "X" custom pattern, a "G" progress bar or, for older Pi scripts, a
+// full command name
+void handleCommand(const char *command) {
+  if (command[0] == '\0') {
+    return; // Heartbeat, retried or malformed frame, already answered by readCommand()
+  }
+  if (command[0] == 'X' && command[1] != '\0') {
+    if (!startCustomPattern(command)) {
+      Serial.println("Invalid command");
+    }
+    return;
+  }
+  if (command[0] == 'G' && command[1] != '\0') {
+    if (!startProgress(command)) {
+      Serial.println("Invalid command");
+    }
+    return;
+  }
+
+  char opcode = command[1] == '\0' ? command[0] : legacyOpcode(command);
+  if (opcode >= 'A' && opcode <= 'Z' && patternIndex[opcode - 'A'] >= 0) {
+    startPattern(patternIndex[opcode - 'A']);
+    return;
+  }
+  switch (opcode) {
+    case 'B':
+      startBlink(false);
+      break;
+    case 'C':
+      startBlink(true);
       Serial.println("Complete LED pattern");
-    } else if (command == "FINISHED") {
+      break;
+    case 'F':
       stopAnimation();
-    } else if (command == "WAITING") {
+      break;
+    case 'W':
+      mode = MODE_IDLE;
       waitColor();
       Serial.println("Waiting Mode");
-    } else {
+      break;
+    default:
       Serial.println("Invalid command");
+  }
+}
+
+void loop() {
+  pollSerial();
+  const char *command = readCommand();
+  if (command != NULL) {
+    handleCommand(command);
+  }
+
+  unsigned long now = millis();
+  if (mode != MODE_IDLE && now - lastFrameTime >= frameDelay) {
+    lastFrameTime = now;
+    if (mode == MODE_MOVE) {
+      moveFrame();
+    } else if (mode == MODE_BLINK) {
+      blinkFrame();
+    } else if (mode == MODE_PROGRESS) {
+      progressFrame();
     }
   }
 }
@@ -2,44 +2,103 @@
 # -*- coding: utf8 -*-
 
 #THE REAL DEAL
+import time
+app_start_time = time.monotonic()  # Used to log the time to the first interactive frame
+
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
 import json
-import requests
-from io import BytesIO
-import RPi.GPIO as GPIO
-import time
-import os
+import math
+import queue
+import sys
 import threading
-import serial
+from concurrent.futures import ThreadPoolExecutor
+from pour_engine import PourEngine
+from order_dispatcher import OrderDispatcher
+from pump_calibration import load_calibration, save_calibration
+from pump_scheduler import schedule_pours
+from recipe_compiler import compile_recipes
+from thumbnail_cache import ThumbnailCache
+from arduino_link import ArduinoLink, arduino_port
+from event_journal import EventJournal
+from inventory import BottleInventory, InventoryError
+from led_patterns import encode_command
+from menu_matrix import MenuMatrix
+from metrics_server import PourMetrics, metrics_port, quantiles, start_metrics_server
+from relay_driver import create_relay_driver
+from relay_timing import RelayTimingBuffer
 
 
 # Defining the GPIO pins connected to the relay module
 relay_pins = [26, 21, 19, 15, 13, 11, 7, 5, 31, 33, 35]
-pump_running = False
 
-# Initialize GPIO setup
-GPIO.setmode(GPIO.BOARD)
-GPIO.setwarnings(False)
-for pin in relay_pins:
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, GPIO.HIGH)
+# Binary event journal of the orders, relays, Arduino commands and errors,
+# read with event_journal.py; the events are also printed when run from a terminal
+journal = EventJournal('/home/damin/Desktop/cbr/journal', echo=sys.stdout.isatty())
+
+# Relay driver chosen at startup: RPi.GPIO, or the simulation with CBR_RELAY_BACKEND=sim
+relays = create_relay_driver()
+relays.setup(relay_pins)
 
 # Flow rate of the pump motors in mL/second
 flow_rate = 1.5
 
+# Number of orders allowed to wait in the queue behind the one being poured
+max_queued_orders = 5
+
+# Number of motors allowed to run at the same time, more browns out the 5V supply
+max_running_pumps = 4
+
 # Loading recipes from JSON
 #with open('/home/jongo/Desktop/cbr/ex/nanugi.json') as file:
 with open('/home/damin/Desktop/cbr/holiday.json') as file:
     recipes = json.load(file)
 
+# Resized cocktail images kept between launches
+thumbnail_cache = ThumbnailCache('/home/damin/Desktop/cbr/thumbnails', size=(170, 170))
+
+# Small pool decoding and fetching the cocktail images in the background,
+# finished (cocktail, thumbnail) pairs are queued for the Tk thread
+image_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="images")
+loaded_images = queue.Queue()
+images_pending = 0
+
 # Map the index of relay_pins with the pump motor number
 motor_mapping = {i + 1: pin for i, pin in enumerate(relay_pins)}
+pin_motors = {pin: motor for motor, pin in motor_mapping.items()}
+
+# Per-pump flow calibration, motors never calibrated use flow_rate
+calibration_path = '/home/damin/Desktop/cbr/pump_calibration.json'
+pump_calibration = load_calibration(calibration_path, motor_mapping, flow_rate)
+
+# mL left in the bottle behind every motor, decremented by what the pumps
+# actually poured and refilled from custom_frame
+inventory = BottleInventory('/home/damin/Desktop/cbr/inventory.json', motor_mapping)
+
+# Last calibration run as (motor number, seconds), waiting for its measured volume
+calibration_run = None
+
+# Function to compile the recipes into pour plans, refusing the bad ones
+def compile_recipe_plans():
+    plans, errors = compile_recipes(recipes, motor_mapping, pump_calibration, max_running_pumps)
+    for cocktail, error in errors.items():
+        journal.error(f"Recipe refused: {error}")
+    return plans
+
+# Pour plan of every valid cocktail, rebuilt whenever a pump is recalibrated
+recipe_plans = compile_recipe_plans()
 
-# Variables to record start and end times for each pump
-pump_start_times = {}
-pump_end_times = {}
+# Recipes as a cocktails x motors matrix of mL, to find what the bottles can still pour
+menu = MenuMatrix(recipe_plans, motor_mapping)
+
+# Commanded and actual times of the last relay switchings, with the timing
+# error and skew histograms of every channel
+relay_timing = RelayTimingBuffer(relay_pins)
+
+# Counters and histograms served on http://127.0.0.1:<port>/metrics when
+# CBR_METRICS_PORT is set; the relay switchings only go to it then
+metrics = PourMetrics(relay_pins)
+recorders = (relay_timing, journal, metrics) if metrics_port() else (relay_timing, journal)
 
 # Variable to record the cocktail start time
 cocktail_start_time = None
@@ -57,102 +116,157 @@ motor_mutex = threading.Lock()
 #    print(f"Sent command {command} to Arduino")
 
 
-try:
-    ser = serial.Serial('/dev/ttyUSB0', 115200) 
-except serial.SerialException:
-    ser = None  # Arduino not connected
+# The link opens the port in the background and keeps reconnecting while the
+# Arduino is not connected
+arduino = ArduinoLink(arduino_port(), 115200, journal=journal)
 
-# Function to send commands to the Arduino, checking for Arduino connection
+# Function to send commands to the Arduino as LED opcodes
 def send_command_to_arduino(command):
-    if ser:
-        ser.write(command.encode())
-        print(f"Sent command {command} to Arduino")
-    else:
-        print("Arduino not connected")
+    arduino.send(encode_command(command))  # Queued for the writer thread, never blocks
 
 # Function to send the "WAITING" command to the Arduino
 def send_waiting_command():
     send_command_to_arduino("WAITING")
-    print("Script is running...")
-
-# Function to start a pump motor
-def start_pump(motor_pin, volume):
-    run_time = volume / flow_rate  # run time based on volume
+    journal.log("message", "Script is running...")
 
-    try:
-        GPIO.output(motor_pin, GPIO.LOW)  # Turn on the motor
-        #send_command_to_arduino("PUMPNUMBER")
-        start_time = time.time()  # Record the start time
-
-        # Check if the pump operation is still running
-        while pump_running and (time.time() - start_time) < run_time:
-            pass
-
-        end_time = time.time()  # Record the end time
-
-        if pump_running:
-            GPIO.output(motor_pin, GPIO.HIGH)  # Turn off the motor
-            elapsed_time = end_time - start_time
-            pump_start_times[motor_pin] = start_time  # Record the start time
-            pump_end_times[motor_pin] = end_time  # Record the end time
-            print(f"Pumping {volume} mL from Motor {relay_pins.index(motor_pin) + 1}. Time: {int(elapsed_time // 60)} minutes {int(elapsed_time % 60)} seconds")
-    except KeyboardInterrupt:
-        print("Process interrupted by the user.")
-    finally:
-        GPIO.output(motor_pin, GPIO.HIGH)  # Turn off the motor
+# Function called by the pump timer once a pump has been switched off
+def report_pump(pour):
+    elapsed_time = pour.end_time - pour.start_time
+    if pour.stopped:
+        journal.log("pour", f"Stopped Motor {relay_pins.index(pour.motor_pin) + 1}, seconds on", pour.motor_pin, elapsed_time)
+    else:
+        journal.log("pour", f"Motor {relay_pins.index(pour.motor_pin) + 1} done in {elapsed_time:.2f} s (overshoot {pour.overshoot * 1000:.1f} ms), mL", pour.motor_pin, pour.volume or 0.0)
+    dispatcher.post("progress", pour)  # Let the UI know one more pump is done
+
+# Pour engine running the pumps and the LED strip in real time; its timer
+# thread switches the pumps off at their deadlines
+engine = PourEngine(relays, send_command_to_arduino, on_finished=report_pump, recorders=recorders, journal=journal)
+pump_timer = engine.timer
+
+# Background worker running the orders coming from the buttons
+dispatcher = OrderDispatcher(max_orders=max_queued_orders, journal=journal)
+
+# Values read from the other threads each time the metrics are scraped
+metrics.gauge("cbr_order_queue_depth", "Orders waiting behind the current one", dispatcher.depth)
+metrics.gauge("cbr_arduino_queue_depth", "Commands waiting for the Arduino writer", arduino.depth)
+metrics.gauge("cbr_serial_latency_seconds", "Round trip of the last Arduino commands", lambda: quantiles(arduino.latencies), "quantile")
+metrics.gauge("cbr_image_cache_hit_ratio", "Cocktail thumbnails found in the cache",
+              lambda: thumbnail_cache.hits / max(1, thumbnail_cache.hits + thumbnail_cache.misses))
+metrics.gauge("cbr_relay_off_error_p99_ms", "99th percentile of how late each relay went off",
+              lambda: {pin: channel["off_p99_ms"] for pin, channel in relay_timing.summary().items()}, "pin")
+if metrics_port():
+    start_metrics_server(metrics, metrics_port())
+
+# Function to compute how long a pump must run to pour volume mL
+def pump_run_time(motor_pin, volume):
+    return pump_calibration[pin_motors[motor_pin]].run_time(volume)
+
+# Function to start a pump motor, returns the running Pour without waiting for it
+def start_pump(motor_pin, volume, delay=0.0):
+    run_time = pump_run_time(motor_pin, volume)  # run time from the pump calibration
+    #send_command_to_arduino("PUMPNUMBER")
+    return pump_timer.start(motor_pin, run_time, volume, delay)
+
+# Function to plan (motor_pin, volume) pours within the motor budget,
+# returns the start offset of each pour and the total pour time
+def plan_pours(pours):
+    return schedule_pours([pump_run_time(motor_pin, volume) for motor_pin, volume in pours], max_running_pumps)
+
+# Function to take what finished pours pumped out of their bottles, from the
+# time each relay was really on (a stopped pour counts what it poured)
+def use_bottles(pours):
+    for pour in pours:
+        motor = pin_motors[pour.motor_pin]
+        inventory.pour(motor, pump_calibration[motor].volume(pour.end_time - pour.start_time))
+
+# Function to find the bottles that cannot pour needs ({motor: mL}) on top of
+# the orders already queued, returns the (short, low) lists of BottleInventory.check
+def check_bottles(needs):
+    needs = dict(needs)
+    orders = [order for order, _, _ in dispatcher.schedule()]
+    if dispatcher.current is not None:
+        orders.append(dispatcher.current)  # Taken from the bottles once it is poured
+    for order in orders:
+        if order.target is make_cocktail:
+            for step in recipe_plans[order.args[0]].steps:
+                needs[step.motor] = needs.get(step.motor, 0.0) + step.volume
+        elif order.target is start_single_motor:
+            motor = pin_motors[order.args[0]]
+            needs[motor] = needs.get(motor, 0.0) + order.args[1]
+        elif order.target is start_all_motors:
+            for motor in motor_mapping:
+                needs[motor] = needs.get(motor, 0.0) + order.args[0]
+        elif order.target is dispense_seconds:
+            motor = pin_motors[order.args[0]]
+            needs[motor] = needs.get(motor, 0.0) + pump_calibration[motor].volume(order.args[1])
+    return inventory.check(needs)
+
+# Function to describe the bottles that cannot pour an order
+def shortage_text(short):
+    return ", ".join(f"Motor {motor} has {left:.0f} of {needed:.0f} mL" for motor, needed, left in short)
+
+# Function to run a single motor and wait for it to finish
+def start_single_motor(motor_pin, volume):
+    pour = start_pump(motor_pin, volume)
+    pour.wait()
+    use_bottles([pour])
+
+# Function to run a single motor for a fixed time, used to calibrate it
+def dispense_seconds(motor_pin, seconds):
+    pour = pump_timer.start(motor_pin, seconds)
+    pour.wait()
+    use_bottles([pour])
 
 # Function to start all motors simultaneously
 def start_all_motors(volume):
-    global cocktail_start_time, pump_running
+    global cocktail_start_time
     cocktail_start_time = time.time()  # Record the cocktail start time
-    pump_running = True  # Start the pump operation
-
-    # Sending the corresponding cocktail command to Arduino for LED strip control
-    #send_command_to_arduino("ALLMOTORS")
+    journal.log("order", f"{volume} mL from All Motors")
 
-    threads = []
-
-    for motor_pin in relay_pins:
-        thread = threading.Thread(target=start_pump, args=(motor_pin, volume))
-        threads.append(thread)
-        thread.start()
-
-    # Wait for all threads to finish
-    for thread in threads:
-        thread.join()
+    # Every motor at its planned offset, with one progress bar segment per
+    # motor on the LEDs, then COMPLETE once the pump timer switched them off
+    offsets, _ = plan_pours([(motor_pin, volume) for motor_pin in relay_pins])
+    pours = engine.pour([(motor_pin, pump_run_time(motor_pin, volume), volume, offset) for motor_pin, offset in zip(relay_pins, offsets)], "ALLMOTORS")
+    use_bottles(pours)
 
     end_time = time.time()  # Record the end time for the last motor
 
-    print(f"Pumping {volume} mL from All Motors")
     total_time = end_time - cocktail_start_time
-    print(f"Total time: {int(total_time // 60)} minutes {int(total_time % 60)} seconds")
-
-    # Sending the completion command to Arduino for LED strip control
-    send_command_to_arduino("COMPLETE")
-
-    pump_running = False  # Stop the pump operation
-
-# Function to load cocktail image
-def load_cocktail_image(cocktail):
-    local_img_path = recipes[cocktail]['imgpath']
-    if os.path.exists(local_img_path):
-        try:
-            image = Image.open(local_img_path)
-            image = image.resize((170, 170), Image.BILINEAR)
-            return ImageTk.PhotoImage(image)
-        except Exception as e:
-            print(f"Error loading image for {cocktail} from local imgpath: {e}")
-    else:
-        # Load the image from "image_url"
-        response = requests.get(recipes[cocktail]['image_url'])
+    journal.log("order_done", f"{volume} mL from All Motors done, seconds", -1, total_time)
+    journal.flush()
+
+# Function to fetch the thumbnail of a cocktail image, runs on the image pool
+def fetch_cocktail_thumbnail(cocktail):
+    return thumbnail_cache.thumbnail(recipes[cocktail].get('imgpath'), recipes[cocktail].get('image_url'))
+
+# Function to swap a loaded thumbnail into its cocktail button, runs on the Tk thread
+def show_cocktail_image(cocktail, thumbnail):
+    global images_pending
+    images_pending -= 1
+    if thumbnail:
         try:
-            image = Image.open(BytesIO(response.content))
-            image = image.resize((170, 170), Image.BILINEAR)
-            return ImageTk.PhotoImage(image)
-        except Exception as e:
-            print(f"Error loading image for {cocktail} from image_url: {e}")
-    # Return None if image loading fails
-    return None
+            image = tk.PhotoImage(file=thumbnail)
+            cocktail_button = cocktail_button_map[cocktail]
+            cocktail_button.config(image=image)
+            cocktail_button.image = image  # Store the PhotoImage object
+        except tk.TclError as e:
+            journal.error(f"Bad image for {cocktail}: {e}")
+    if images_pending == 0:
+        journal.log("message", "All cocktail images loaded, seconds", -1, time.monotonic() - app_start_time)
+
+# Function to queue the result of a finished image job for the Tk thread
+def queue_cocktail_image(cocktail, future):
+    try:
+        thumbnail = future.result()
+    except Exception as e:
+        journal.error(f"No image for {cocktail}: {e}")
+        thumbnail = None
+    loaded_images.put((cocktail, thumbnail))
+
+# Function to log how long it took until the window could be used
+def log_first_frame():
+    root.update_idletasks()  # Make sure the first frame is drawn
+    journal.log("message", "First interactive frame, seconds", -1, time.monotonic() - app_start_time)
 
 # Function to display cocktail details
 def show_cocktail_details(cocktail):
@@ -164,61 +278,202 @@ def show_cocktail_details(cocktail):
 
     order_button.config(state=tk.NORMAL)
 
+# Function to estimate how long a cocktail takes within the motor budget
+def estimate_pour_time(cocktail):
+    return recipe_plans[cocktail].makespan
+
+# Function to queue an order for the selected cocktail, refused if a bottle
+# would run dry before it is poured
+def submit_order():
+    cocktail = selected_cocktail.get()
+    short, low = check_bottles({step.motor: step.volume for step in recipe_plans[cocktail].steps})
+    if short:
+        status_label.config(text=f"Cannot make {cocktail}: {shortage_text(short)}")
+        return
+    if low:
+        inventory_label.config(text="Refill soon: " + ", ".join(f"Motor {motor} ({left:.0f} mL left)" for motor, left in low))
+    if dispatcher.submit(cocktail, make_cocktail, cocktail, duration=estimate_pour_time(cocktail)) is None:
+        status_label.config(text=f"Queue full, {max_queued_orders} orders waiting")
+    update_queue_view()
+
 # Function to make a cocktail
 def make_cocktail(cocktail):
-    global cocktail_start_time, pump_running
+    global cocktail_start_time
     cocktail_start_time = time.time()  # Record the cocktail start time
-    pump_running = True  # Start the pump operation
-
-    # Sending the corresponding cocktail command to Arduino for LED strip control
-    if cocktail == "AMF":
-        send_command_to_arduino("ADIOS")
-    elif cocktail == "Long Island Ice Tea":
-        send_command_to_arduino("LONGISLAND")
-    elif cocktail == "Peach Crush":
-        send_command_to_arduino("PEACHCRUSH")
-    elif cocktail == "Midori Sour":
-        send_command_to_arduino("MIDORISOUR")
-
-    print(f"Preparing 1 {cocktail}...")
-
-    # Getting the ingredient motors and volumes for the selected cocktail
-    ingredients = recipes[cocktail]['ingredients']
 
-    # Calculate the estimated pump run times based on ingredient volumes
-    run_times = [(motor_mapping[ingredient['motor']], ingredient['quantity']) for ingredient in ingredients]
+    # Pour plan compiled when the recipes were loaded
+    plan = recipe_plans[cocktail]
 
-    # Sort the run_times in ascending order of volume
-    run_times.sort(key=lambda x: x[1])
+    # A bottle may have been used up since the order was queued
+    short, _ = inventory.check({step.motor: step.volume for step in plan.steps})
+    if short:
+        raise InventoryError(f"not enough for {cocktail}: {shortage_text(short)}")
+    metrics.order_started(cocktail, dispatcher.current.submitted)
 
-    # Create a list to store threads
-    threads = []
+    journal.log("order", cocktail)
 
-    # Turn on all required motors using threads
-    for motor_pin, volume in run_times:
-        thread = threading.Thread(target=start_pump, args=(motor_pin, volume))
-        threads.append(thread)
-        thread.start()
-
-    # Wait for all threads to finish
-    for thread in threads:
-        thread.join()
+    # Start the motors at their planned offsets, never more than max_running_pumps
+    # at once, show the pour progress on the LEDs and wait for all pumps to
+    # finish; the engine sends COMPLETE to the Arduino at the end
+    use_bottles(engine.pour_plan(plan))
 
     end_time = time.time()  # Record the end time for the last motor
 
-    print("Cocktail ready!")
-
-    # Sending the completion command to Arduino for LED strip control
-    send_command_to_arduino("COMPLETE")
-
-    pump_running = False  # Stop the pump operation
+    journal.log("order_done", f"{cocktail} ready, seconds", -1, end_time - cocktail_start_time)
+    metrics.order_completed(cocktail)
+    journal.flush()
+
+# Function to queue the custom pour selected in custom_frame
+def submit_custom_pour():
+    volume = int(volume_entry.get())
+    motors = list(motor_mapping) if selected_motor.get() == "All Motors" else [int(selected_motor.get().split()[-1])]
+    short, _ = check_bottles({motor: volume for motor in motors})
+    if short:
+        status_label.config(text=f"Cannot pour: {shortage_text(short)}")
+        return
+    if selected_motor.get() == "All Motors":
+        _, duration = plan_pours([(motor_pin, volume) for motor_pin in relay_pins])
+        order = dispatcher.submit(f"All Motors {volume} mL", start_all_motors, volume, duration=duration)
+    else:
+        motor = int(selected_motor.get().split()[-1])
+        order = dispatcher.submit(f"Motor {motor} {volume} mL", start_single_motor, motor_mapping[motor], volume, duration=pump_run_time(motor_mapping[motor], volume))
+    if order is None:
+        status_label.config(text=f"Queue full, {max_queued_orders} orders waiting")
+    update_queue_view()
+
+# Calibration step 1: run the selected motor for a fixed number of seconds
+def start_calibration_run():
+    global calibration_run
+    if selected_motor.get() == "All Motors":
+        calibration_label.config(text="Select a single motor to calibrate")
+        return
+    motor = int(selected_motor.get().split()[-1])
+    seconds = float(calibration_seconds.get())
+    if dispatcher.submit(f"Calibrate Motor {motor} {seconds:g} s", dispense_seconds, motor_mapping[motor], seconds, duration=seconds) is None:
+        calibration_label.config(text=f"Queue full, {max_queued_orders} orders waiting")
+        return
+    calibration_run = (motor, seconds)
+    calibration_label.config(text=f"Motor {motor}: dispensing {seconds:g} s, then enter the measured mL")
+    update_queue_view()
+
+# Calibration step 2: store the measured volume and refit the pump model
+def save_calibration_volume():
+    global calibration_run, recipe_plans, menu
+    if calibration_run is None:
+        calibration_label.config(text="Dispense first, then enter the measured mL")
+        return
+    motor, seconds = calibration_run
+    pump = pump_calibration[motor]
+    try:
+        pump.add_sample(seconds, float(measured_volume.get()))
+    except ValueError as e:
+        calibration_label.config(text=f"Motor {motor}: {e}")
+        return
+    save_calibration(calibration_path, pump_calibration)
+    recipe_plans = compile_recipe_plans()
+    menu = MenuMatrix(recipe_plans, motor_mapping)
+    calibration_run = None
+    calibration_label.config(text=f"Motor {motor}: {pump.flow_rate:.2f} mL/s, priming {pump.prime_delay:.2f} s ({len(pump.samples)} runs)")
+    update_queue_view()
+
+# Function to handle one event posted by the dispatcher, runs on the Tk thread
+def handle_ui_event(event):
+    if event.order is None:
+        pass  # Progress of a pour run outside the dispatcher, nothing to show
+    elif event.kind == "started":
+        status_label.config(text=f"Pouring {event.order.name}...")
+    elif event.kind == "progress":
+        status_label.config(text=f"Pouring {event.order.name}... Motor {relay_pins.index(event.data.motor_pin) + 1} done")
+    elif event.kind == "waiting_glass":
+        status_label.config(text=f"Swap the glass to start {event.order.name}")
+    elif event.kind in ("finished", "failed"):
+        if event.kind == "failed":
+            metrics.order_failed(event.order.name)
+        status_label.config(text=f"{event.order.name} {'ready' if event.kind == 'finished' else f'failed: {event.data}'}")
+        update_inventory_view()
+    update_queue_view()
+
+# Function to show the waiting orders with their estimated start and finish times
+def update_queue_view():
+    queue_listbox.delete(0, tk.END)
+    now = time.time()
+    for position, (order, start_in, finish_in) in enumerate(dispatcher.schedule(), start=1):
+        start_at = time.strftime("%H:%M:%S", time.localtime(now + start_in))
+        finish_at = time.strftime("%H:%M:%S", time.localtime(now + finish_in))
+        queue_listbox.insert(tk.END, f"{position}. {order.name}  {start_at} - {finish_at}")
+
+# Function to show the mL left behind every tracked motor, grey out the
+# cocktails the bottles cannot pour any more and show the servings left
+def update_inventory_view():
+    levels = inventory.snapshot()
+    shown = [f"M{motor} {level:.0f}" for motor, level in levels.items() if level is not None]
+    text = "Bottles (mL): " + ", ".join(shown) if shown else "Bottles not tracked, refill to start"
+
+    vector = menu.level_vector(levels)
+    available = menu.available(vector)
+    for cocktail, can_pour, servings in zip(menu.cocktails, available, menu.servings(vector)):
+        cocktail_button = cocktail_button_map.get(cocktail)
+        if cocktail_button is None:
+            continue
+        cocktail_button.state(["!disabled"] if can_pour else ["disabled"])
+        cocktail_button.config(text=cocktail if math.isinf(servings) else f"{cocktail} ({servings:.0f})")
+    selected = selected_cocktail.get()
+    if selected in menu.rows:
+        order_button.config(state=tk.NORMAL if available[menu.rows[selected]] else tk.DISABLED)
+
+    affected = menu.names(menu.affected(vector < inventory.reserve))
+    if affected:
+        text += f"\nLow bottles for {len(affected)} cocktails: " + ", ".join(affected[:5]) + (", ..." if len(affected) > 5 else "")
+    inventory_label.config(text=text)
+
+# Function to record a full bottle behind the selected motor(s)
+def refill_bottles():
+    try:
+        volume = float(refill_volume.get())
+        motors = list(motor_mapping) if selected_motor.get() == "All Motors" else [int(selected_motor.get().split()[-1])]
+        for motor in motors:
+            inventory.refill(motor, volume)
+    except (ValueError, InventoryError) as e:
+        inventory_label.config(text=f"Invalid refill: {e}")
+        return
+    journal.log("message", f"Refilled {selected_motor.get()} with {volume:g} mL")
+    update_inventory_view()
+
+# Function to refresh the queue ETAs once a second
+def tick_queue_view():
+    update_queue_view()
+    root.after(1000, tick_queue_view)
+
+# Function to handle one event parsed from the Arduino replies, runs on the Tk thread
+def handle_arduino_event(event):
+    if event.kind == "link_up":
+        arduino_label.config(text="Arduino connected")
+    elif event.kind == "link_down":
+        arduino_label.config(text=f"ARDUINO LINK DOWN: {event.text}")
+        journal.error(f"Arduino link down: {event.text}")
+    elif event.kind == "stats":
+        errors = arduino.firmware_stats["overflows"] + arduino.firmware_stats["framing_errors"]
+        if errors:
+            arduino_label.config(text=f"Arduino connected, {errors} bad serial lines")
+    elif event.kind == "ready":
+        journal.log("reply", event.text)
+    elif event.kind == "invalid":
+        journal.log("command_failed", f"Rejected {event.command}")
+    elif event.kind in ("reply", "stopped", "message"):
+        journal.log("reply", event.text)
+
+# Function to drain the dispatcher events, rescheduled every frame (~16 ms)
+def poll_ui_events():
+    dispatcher.drain(handle_ui_event)
+    arduino.drain(handle_arduino_event)
+    while not loaded_images.empty():
+        show_cocktail_image(*loaded_images.get_nowait())
+    root.after(16, poll_ui_events)
 
 # Function to stop the cocktail making process
 def stop_pumps():
-    global pump_running
-    GPIO.output(relay_pins, GPIO.HIGH)  # Turn off the motor
+    engine.stop(relay_pins)  # Cancel every pending deadline, turn off the motors and report the pours
     #send_command_to_arduino("WAITING")
-    pump_running = False
 
 # Create the main tkinter window
 root = tk.Tk()
@@ -272,9 +527,43 @@ volume_dropdown.grid(row=0, column=1, padx=10)
 volume_dropdown.set(25)  # Set default value to 25mL
 
 # Start button to activate the selected motor(s)
-start_button = ttk.Button(custom_frame, text="Start", command=lambda: start_all_motors(int(volume_entry.get())) if selected_motor.get() == "All Motors" else start_pump(motor_mapping[int(selected_motor.get().split()[-1])], int(volume_entry.get())),style="Large.TButton")
+start_button = ttk.Button(custom_frame, text="Start", command=submit_custom_pour,style="Large.TButton")
 start_button.grid(row=1, column=0, columnspan=2, padx=10, pady =5)
 
+# Calibration wizard: dispense N seconds on the selected motor, measure the
+# glass and enter the volume to fit that motor's flow model
+calibration_seconds = tk.StringVar()
+calibration_seconds_dropdown = ttk.Combobox(custom_frame, textvariable=calibration_seconds)
+calibration_seconds_dropdown['values'] = [5, 10, 20, 30, 60]
+calibration_seconds_dropdown.grid(row=2, column=0, padx=10)
+calibration_seconds_dropdown.set(10)  # Set default value to 10 seconds
+
+calibrate_button = ttk.Button(custom_frame, text="Dispense", command=start_calibration_run)
+calibrate_button.grid(row=2, column=1, padx=10, pady=5)
+
+measured_volume = tk.StringVar()
+measured_volume_entry = ttk.Entry(custom_frame, textvariable=measured_volume)
+measured_volume_entry.grid(row=3, column=0, padx=10)
+
+save_calibration_button = ttk.Button(custom_frame, text="Save mL", command=save_calibration_volume)
+save_calibration_button.grid(row=3, column=1, padx=10, pady=5)
+
+calibration_label = ttk.Label(custom_frame, text="", font=("Helvetica", 12))
+calibration_label.grid(row=4, column=0, columnspan=2, pady=5)
+
+# Refill: put a full bottle behind the selected motor(s) and enter its mL
+refill_volume = tk.StringVar()
+refill_volume_dropdown = ttk.Combobox(custom_frame, textvariable=refill_volume)
+refill_volume_dropdown['values'] = [350, 500, 700, 750, 1000]
+refill_volume_dropdown.grid(row=5, column=0, padx=10)
+refill_volume_dropdown.set(700)  # Set default value to a 700 mL bottle
+
+refill_button = ttk.Button(custom_frame, text="Refill", command=refill_bottles)
+refill_button.grid(row=5, column=1, padx=10, pady=5)
+
+inventory_label = ttk.Label(custom_frame, text="", font=("Helvetica", 12), wraplength=420)
+inventory_label.grid(row=6, column=0, columnspan=2, pady=5)
+
 # Create buttons for LED control and pump stopping at the bottom of the order_frame
 LED_waiting_button = ttk.Button(order_frame, text="LED Waiting", command=lambda: send_command_to_arduino("WAITING"),style="Large.TButton")
 LED_waiting_button.grid(row=8, column=0, padx=10, pady=10)
@@ -286,6 +575,9 @@ pump_stop_button = ttk.Button(order_frame, text="STOP PUMPS", command=stop_pumps
 #pump_stop_button = ttk.Button(order_frame, text="STOP PUMPS", command=stop_pumps,style="Large.TButton")
 pump_stop_button.grid(row=9, column=0, columnspan=2, padx=10, pady=10)
 
+arduino_label = ttk.Label(order_frame, text="Arduino not connected", font=("Helvetica", 12))
+arduino_label.grid(row=10, column=0, columnspan=2, pady=5)
+
 # Initialize labels
 details_label = ttk.Label(order_frame, text="Selected Cocktail", font=("Helvetica", 14, "bold"))
 details_label.grid(row=0, column=0, columnspan=2, pady=10)
@@ -293,26 +585,47 @@ details_label.grid(row=0, column=0, columnspan=2, pady=10)
 ingredients_label = ttk.Label(order_frame, text="", font=("Helvetica", 12))
 ingredients_label.grid(row=1, column=0, columnspan=2, pady=10)
 
-order_button = ttk.Button(order_frame, text="Click to order", command=lambda: make_cocktail(selected_cocktail.get()), state=tk.DISABLED,style="Large.TButton")
+order_button = ttk.Button(order_frame, text="Click to order", command=submit_order, state=tk.DISABLED,style="Large.TButton")
 order_button.grid(row=2, column=0, columnspan=2, pady=10)
 
-# Load cocktail images and create buttons
+status_label = ttk.Label(order_frame, text="", font=("Helvetica", 12))
+status_label.grid(row=3, column=0, columnspan=2, pady=10)
+
+# Waiting orders with their estimated start and finish times
+queue_listbox = tk.Listbox(order_frame, height=max_queued_orders, width=36, font=("Helvetica", 12))
+queue_listbox.grid(row=4, column=0, columnspan=2, pady=5)
+
+glass_button = ttk.Button(order_frame, text="Glass Swapped", command=lambda: (dispatcher.glass_swapped(), update_queue_view()),style="Large.TButton")
+glass_button.grid(row=5, column=0, columnspan=2, pady=10)
+
+# Create every cocktail button at once with a blank placeholder image, the
+# image pool swaps the real images in as they arrive
+placeholder_image = tk.PhotoImage(width=170, height=170)
+placeholder_image.put("#d9d9d9", to=(0, 0, 170, 170))
+
 cocktail_buttons = []
-for i, cocktail in enumerate(recipes):
-    image = load_cocktail_image(cocktail)
-    if image:
-        cocktail_button = ttk.Button(btn_frame, image=image, text=cocktail, compound=tk.TOP, command=lambda c=cocktail: show_cocktail_details(c))
-        cocktail_button.image = image  # Store the PhotoImage object
-        cocktail_button.grid(row=i // 2, column=i % 2, padx=10, pady=10)
-        cocktail_buttons.append(cocktail_button)
-        
+cocktail_button_map = {}
+for i, cocktail in enumerate(recipe_plans):
+    cocktail_button = ttk.Button(btn_frame, image=placeholder_image, text=cocktail, compound=tk.TOP, command=lambda c=cocktail: show_cocktail_details(c))
+    cocktail_button.image = placeholder_image  # Store the PhotoImage object
+    cocktail_button.grid(row=i // 2, column=i % 2, padx=10, pady=10)
+    cocktail_buttons.append(cocktail_button)
+    cocktail_button_map[cocktail] = cocktail_button
+
+    images_pending += 1
+    future = image_pool.submit(fetch_cocktail_thumbnail, cocktail)
+    future.add_done_callback(lambda f, c=cocktail: queue_cocktail_image(c, f))
 
 # Send the "WAITING" command when the program starts
 send_waiting_command()
 #print("Script is running...")
 
-# Start the tkinter main loop
+# Start draining the dispatcher events and the tkinter main loop
+update_inventory_view()
+poll_ui_events()
+tick_queue_view()
+root.after_idle(log_first_frame)
 root.mainloop()
 
-# Cleanup GPIO
-GPIO.cleanup()
+# Switch every relay off and release the pins
+relays.cleanup()